@@ -1,6 +1,15 @@
 from .config import settings
-from .widgets import Browser
 from .core import require_project, create_project, get_project
 from . import backends
+from .cache import cached
 
 from .version import version as __version__
+
+
+def __getattr__(name):
+    # The browser pulls in IPython, ipywidgets and pandas, so it is only
+    # imported when it is first accessed.
+    if name == 'Browser':
+        from .widgets import Browser
+        return Browser
+    raise AttributeError("module 'expipe' has no attribute '{}'".format(name))
@@ -1,31 +1,60 @@
 from ..backend import *
 from ..core import Action, Entity, Project, Module, Message, MapManager, Template
-import quantities as pq
+from ..cliutils.misc import lazy_import
+from .. import parallel
 import numpy as np
 import pathlib
 import shutil
+import copy
+import functools
+import hashlib
+import io
+import itertools
+import json
+import sys
 import os
+import threading
 
 try:
     import ruamel.yaml as yaml
 except ImportError:
     import ruamel_yaml as yaml
 
+
+@lazy_import
+def pq():
+    import quantities
+    return quantities
+
+
+@functools.lru_cache(maxsize=1024)
+def _parse_unit(unit):
+    """Dimensionality of a unit string, parsed once per unit."""
+    try:
+        return pq.Quantity(1.0, unit).dimensionality
+    except Exception:
+        return None
+
+
+def _is_quantity_dict(value):
+    return isinstance(value, dict) and "unit" in value and "value" in value
+
+
 # TODO move into plugin
 def convert_back_quantities(value):
     """Convert quantities back from dictionary."""
     result = value
     if isinstance(value, dict):
-        if "unit" in value and "value" in value and "uncertainty" in value:
+        if "unit" in value and "value" in value:
+            units = _parse_unit(value["unit"]) if isinstance(
+                value["unit"], str) else None
             try:
-                result = pq.UncertainQuantity(value["value"],
-                                              value["unit"],
-                                              value["uncertainty"])
-            except Exception:
-                pass
-        elif "unit" in value and "value" in value:
-            try:
-                result = pq.Quantity(value["value"], value["unit"])
+                if "uncertainty" in value:
+                    result = pq.UncertainQuantity(value["value"],
+                                                  units or value["unit"],
+                                                  value["uncertainty"])
+                else:
+                    result = pq.Quantity(value["value"], units or value["unit"])
             except Exception:
                 pass
         else:
@@ -38,11 +67,45 @@ def convert_back_quantities(value):
     return result
 
 
-def convert_quantities(value):
-    """Convert quantities to dictionary."""
+_PLAIN_TYPES = frozenset([str, int, float, bool, type(None)])
 
-    result = value
-    if isinstance(value, pq.Quantity):
+
+def convert_quantities(value):
+    """Convert quantities to dictionary.
+
+    Numpy arrays and scalars are converted to lists and Python scalars and
+    other mappings to dictionaries. Lists, tuples and dictionaries that
+    contain nothing to convert are returned as they are, not copied.
+    """
+    if type(value) in _PLAIN_TYPES:
+        return value
+    if type(value) is dict:
+        result = None
+        for i, (key, val) in enumerate(value.items()):
+            new_key = convert_quantities(key)
+            new_val = convert_quantities(val)
+            if result is None:
+                if new_key is key and new_val is val:
+                    continue
+                # copy the unchanged items seen so far
+                result = dict(itertools.islice(value.items(), i))
+            result[new_key] = new_val
+        return value if result is None else result
+    if type(value) in (list, tuple):
+        result = None
+        for i, val in enumerate(value):
+            new_val = convert_quantities(val)
+            if result is None:
+                if new_val is val:
+                    continue
+                result = list(value[:i])
+            result.append(new_val)
+        if result is None:
+            return value
+        return result if type(value) is list else tuple(result)
+    # no need to import quantities to check for instances of it if nobody
+    # else has imported it yet
+    if 'quantities' in sys.modules and isinstance(value, pq.Quantity):
         result = {
             "value": value.magnitude.tolist(),
             "unit": value.dimensionality.string
@@ -50,65 +113,156 @@ def convert_quantities(value):
         if isinstance(value, pq.UncertainQuantity):
             assert value.dimensionality == value.uncertainty.dimensionality
             result["uncertainty"] = value.uncertainty.magnitude.tolist()
-    elif isinstance(value, np.ndarray):
-        result = value.tolist()
-    elif isinstance(value, np.integer):
-        result = int(value)
-    elif isinstance(value, float):
-        result = float(value)
-    else:
-        # try if dictionary like objects can be converted if not return the
-        # original object
-        # Note, this might fail if .items() returns a strange combination of
-        # objects
-        try:
-            new_result = {}
-            for key, val in value.items():
-                new_key = convert_quantities(key)
-                new_result[new_key] = convert_quantities(val)
-            result = new_result
-        except AttributeError:
-            pass
+        return result
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if isinstance(value, float):
+        return float(value)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return int(value)
+    # dictionary like objects are converted to dictionaries
+    items = getattr(value, 'items', None)
+    if items is None:
+        return value
+    return {
+        convert_quantities(key): convert_quantities(val)
+        for key, val in items()}
 
-    return result
+
+# called as hook(path, digest, deleted) after expipe writes or deletes a
+# file or directory, digest is the SHA-256 of a written file if known
+_change_hooks = []
+
+
+def add_change_hook(hook):
+    if hook not in _change_hooks:
+        _change_hooks.append(hook)
+
+
+def remove_change_hook(hook):
+    if hook in _change_hooks:
+        _change_hooks.remove(hook)
+
+
+def notify_change(path, digest=None, content=None, deleted=False):
+    """Call the change hooks, with the digest of `content` if given."""
+    if not _change_hooks:
+        return
+    if content is not None:
+        digest = hashlib.sha256(content).hexdigest()
+    for hook in list(_change_hooks):
+        hook(pathlib.Path(path), digest, deleted)
+
+
+# called as invalidator(path) when a file or directory was changed by
+# another process, to drop what is cached about it, see `expipe.watch`
+_invalidators = []
+
+
+def add_invalidator(invalidator):
+    if invalidator not in _invalidators:
+        _invalidators.append(invalidator)
+
+
+def remove_invalidator(invalidator):
+    if invalidator in _invalidators:
+        _invalidators.remove(invalidator)
+
+
+def invalidate(path):
+    """Drop the cached contents of a file, or of all files in a directory."""
+    path = pathlib.Path(path)
+    for invalidator in list(_invalidators):
+        invalidator(path)
 
 
 def yaml_dump(f, data):
     assert f.suffix == '.yaml'
-    with f.open("w", encoding="utf-8") as fh:
-        yaml_ = yaml.YAML(typ='safe', pure=True)
-        yaml_.dump(
-            convert_quantities(data), fh,
-        )
+    content = yaml_dumps(data).encode('utf-8')
+    with f.open("wb") as fh:
+        fh.write(content)
+    notify_change(f, content=content)
+
 
+def yaml_dumps(data):
+    """Serialize data like `yaml_dump`, to write the same text to many files."""
+    stream = io.StringIO()
+    yaml_ = yaml.YAML(typ='safe', pure=True)
+    yaml_.dump(convert_quantities(data), stream)
+    return stream.getvalue()
 
-def yaml_load(path):
+
+def yaml_load(path, convert=True):
+    """Load a YAML file.
+
+    With `convert=False` quantities are returned as the dictionaries they
+    are stored as, so that callers can convert only the values they use
+    with `convert_back_quantities`.
+    """
     with path.open('r', encoding='utf-8') as f:
-        yaml_ = yaml.YAML(typ='safe', pure=True)
-        result = yaml_.load(f)
+        text = f.read()
+    yaml_ = yaml.YAML(typ='safe', pure=True)
+    result = yaml_.load(text)
+    if not convert or 'unit' not in text:
+        # quantities are stored as dictionaries with a "unit" key
+        return result
     return convert_back_quantities(result)
 
 
+def json_dump(path, data):
+    """Atomically write JSON, used for caches and manifests."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp-{}'.format(os.getpid()))
+    with tmp_path.open('w', encoding='utf-8') as fh:
+        json.dump(data, fh)
+    os.replace(tmp_path, path)
+
+
+def json_load(path, default=None):
+    try:
+        with pathlib.Path(path).open('r', encoding='utf-8') as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def _load_attributes(item):
+    name, path, predicate = item
+    try:
+        attributes = yaml_load(path) or {}
+    except FileNotFoundError:
+        return None
+    if predicate is not None and not predicate(attributes):
+        return None
+    return name, attributes
+
+
 class FileSystemObject(AbstractObject):
     def __init__(self, path):
         self.path = path
 
     def exists(self, name):
-        result = yaml_load(self.path)
+        result = yaml_load(self.path, convert=False)
         return name in result
 
     def get(self, name=None):
-        result = yaml_load(self.path) or {}
         if name is None:
-            return result
-        else:
-            return result.get(name)
+            return yaml_load(self.path) or {}
+        result = yaml_load(self.path, convert=False) or {}
+        return convert_back_quantities(result.get(name))
 
     def set(self, name, value):
-        result = self.get()
+        result = yaml_load(self.path, convert=False) or {}
         result[name] = value
         yaml_dump(self.path, result)
 
+    def set_items(self, values):
+        """Set several attributes in one write."""
+        result = yaml_load(self.path, convert=False) or {}
+        result.update(values)
+        yaml_dump(self.path, result)
+
     def push(self, value=None):
         raise NotImplementedError("Push not implemented on file system")
 
@@ -126,11 +280,14 @@ class FileSystemObject(AbstractObject):
 
 
 class FileSystemObjectManager(AbstractObjectManager):
-    def __init__(self, path, object_type, backend_type, has_attributes=False):
+    def __init__(self, path, object_type, backend_type, has_attributes=False,
+                 create=True):
         self.path = pathlib.Path(path)
         self._object_type = object_type
         self._backend_type = backend_type
-        self.path.mkdir(exist_ok=True)
+        # the directories of sub objects are created on the first write
+        if create:
+            self.path.mkdir(exist_ok=True)
         self.has_attributes = has_attributes
 
     def named_path(self, name):
@@ -147,21 +304,76 @@ class FileSystemObjectManager(AbstractObjectManager):
         return self._object_type(name, self._backend_type(self.path / name))
 
     def __iter__(self):
+        if not self.path.exists():
+            return
         keys = self.path.iterdir()
         for key in keys:
             yield key.stem
 
     def __len__(self):
+        if not self.path.exists():
+            return 0
         return len(list(self.path.iterdir()))
 
+    def keys_window(self, start, stop):
+        if not self.path.exists():
+            return []
+        # os.scandir reads the directory lazily, unlike listing all keys
+        with os.scandir(self.path) as entries:
+            return [
+                pathlib.Path(entry.name).stem
+                for entry in itertools.islice(entries, start, stop)]
+
     def __contains__(self, name):
         return self.named_path(name).exists()
 
     def __setitem__(self, name, value):
         if self.has_attributes:
-            (self.path / name).mkdir(exist_ok=True)
+            (self.path / name).mkdir(parents=True, exist_ok=True)
+        else:
+            self.path.mkdir(exist_ok=True)
         yaml_dump(self.named_path(name), value)
 
+    def write_modules(self, names, module, contents, overwrite=False,
+                      jobs=None):
+        """Write the same module to many objects, serializing it once.
+
+        Returns the names of the objects the module was written to, objects
+        that already have the module are skipped unless `overwrite`.
+        """
+        text = yaml_dumps(contents)
+        items = ((name, module, text, overwrite) for name in names)
+        written = []
+        for name, ok in parallel.imap(
+                self._write_module, items, jobs=jobs, threads=True):
+            if ok:
+                written.append(name)
+        return written
+
+    def _write_module(self, item):
+        name, module, text, overwrite = item
+        if not self.named_path(name).exists():
+            raise KeyError(
+                "{} '{}' ".format(self._object_type.__name__, name) +
+                "does not exist in {}".format(self.named_path(name)))
+        modules_path = self.path / name / 'modules'
+        modules_path.mkdir(exist_ok=True)
+        path = modules_path / (module + '.yaml')
+        if not overwrite and path.exists():
+            return name, False
+        content = text.encode('utf-8')
+        with path.open('wb') as fh:
+            fh.write(content)
+        notify_change(path, content=content)
+        return name, True
+
+    def iter_attributes(self, names=None, jobs=None, predicate=None):
+        names = self if names is None else names
+        items = ((name, self.named_path(name), predicate) for name in names)
+        for result in parallel.imap(_load_attributes, items, jobs=jobs):
+            if result is not None:
+                yield result
+
     def delete(self, name):
         if self.has_attributes:
             path = self.path / name
@@ -172,6 +384,7 @@ class FileSystemObjectManager(AbstractObjectManager):
             shutil.rmtree(str(path))
         else:
             path.unlink()
+        notify_change(path, deleted=True)
 
 
 class FileSystemYamlManager(AbstractObjectManager):
@@ -183,7 +396,7 @@ class FileSystemYamlManager(AbstractObjectManager):
         return self.get(name)
 
     def get(self, name, value_if_missing=None):
-        result = self._get_yaml_contents()
+        result = self._get_yaml_contents(convert=False)
         try:
             for p in self.ref_path:
                 result = result[p]
@@ -191,6 +404,8 @@ class FileSystemYamlManager(AbstractObjectManager):
         except KeyError:
             result = value_if_missing
 
+        if _is_quantity_dict(result):
+            result = convert_back_quantities(result)
         if isinstance(result, dict):
             result = MapManager(FileSystemYamlManager(self.path, self.ref_path + [name]))
 
@@ -203,29 +418,29 @@ class FileSystemYamlManager(AbstractObjectManager):
         return result == other
 
     def keys(self):
-        result = self._get_yaml_contents()
+        result = self._get_yaml_contents(convert=False)
         for p in self.ref_path:
             result = result[p]
         return result.keys()
 
     def values(self):
-        result = self._get_yaml_contents()
+        result = self._get_yaml_contents(convert=False)
         for p in self.ref_path:
             result = result[p]
         return result.keys()
 
     def __iter__(self):
-        for key in self.contents:
+        for key in self._raw_contents():
             yield key
 
     def __len__(self):
-        return len(self.contents)
+        return len(self._raw_contents())
 
     def __contains__(self, name):
-        return name in self.contents
+        return name in self._raw_contents()
 
     def __setitem__(self, name, value):
-        result = self._get_yaml_contents()
+        result = self._get_yaml_contents(convert=False)
         sub_result = result
 
         for p in self.ref_path:
@@ -238,17 +453,102 @@ class FileSystemYamlManager(AbstractObjectManager):
         sub_result[name] = value
         yaml_dump(self.path, result)
 
-    def _get_yaml_contents(self):
-        result = yaml_load(self.path) or {}
+    def _get_yaml_contents(self, convert=True):
+        result = yaml_load(self.path, convert=convert) or {}
         return result
 
-    @property
-    def contents(self):
-        result = self._get_yaml_contents()
+    def _raw_contents(self):
+        result = self._get_yaml_contents(convert=False)
         for p in self.ref_path:
             result = result[p]
         return result
 
+    @property
+    def contents(self):
+        # only convert the quantities of the part that is returned
+        return convert_back_quantities(self._raw_contents())
+
+
+class FileSystemDataManager(FileSystemYamlManager):
+    """
+    The "data" mapping in the attributes of an action, which is empty
+    until the first data is added.
+    """
+    def __init__(self, path):
+        super(FileSystemDataManager, self).__init__(path, ['data'])
+
+    def _raw_contents(self):
+        try:
+            return super(FileSystemDataManager, self)._raw_contents()
+        except KeyError:
+            return {}
+
+
+class FileSystemTemplateManager(FileSystemObjectManager):
+    """
+    Templates of a project. The contents of each template are cached and
+    only read again when the file changes or is written by expipe.
+    """
+    def __init__(self, path):
+        super(FileSystemTemplateManager, self).__init__(
+            path, Template, FileSystemYamlManager)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def template_contents(self, name):
+        """Copy of the contents of a template."""
+        path = self.named_path(name)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise KeyError(
+                "Template '{}' does not exist in {}".format(name, path))
+        stamp = st.st_mtime_ns, st.st_size
+        with self._lock:
+            cached = self._cache.get(name)
+        if cached is None or cached[0] != stamp:
+            cached = stamp, yaml_load(path) or {}
+            with self._lock:
+                self._cache[name] = cached
+        return copy.deepcopy(cached[1])
+
+    def __setitem__(self, name, value):
+        with self._lock:
+            self._cache.pop(name, None)
+        super(FileSystemTemplateManager, self).__setitem__(name, value)
+
+    def delete(self, name):
+        with self._lock:
+            self._cache.pop(name, None)
+        super(FileSystemTemplateManager, self).delete(name)
+
+    def _on_change(self, path, digest, deleted):
+        # templates written through nested mappings of their contents
+        self._invalidate(path)
+
+    def _invalidate(self, path):
+        with self._lock:
+            if path == self.path or path in self.path.parents:
+                self._cache.clear()
+            elif path.parent == self.path:
+                self._cache.pop(path.stem, None)
+
+
+_template_managers = {}
+_template_managers_lock = threading.Lock()
+
+
+def template_manager(path):
+    """The templates manager of a project, shared by all its objects."""
+    path = pathlib.Path(path)
+    with _template_managers_lock:
+        manager = _template_managers.get(path)
+        if manager is None:
+            manager = _template_managers[path] = FileSystemTemplateManager(path)
+            add_invalidator(manager._invalidate)
+            add_change_hook(manager._on_change)
+    return manager
+
 
 class FileSystemProject:
     def __init__(self, path, config):
@@ -259,10 +559,11 @@ class FileSystemProject:
             self.path / "actions", Action, FileSystemAction, has_attributes=True)
         self._entity_manager = FileSystemObjectManager(
             self.path / "entities", Entity, FileSystemEntity, has_attributes=True)
-        self._template_manager = FileSystemObjectManager(
-            self.path / "templates", Template, FileSystemYamlManager)
+        self._template_manager = template_manager(self.path / "templates")
         self._module_manager = FileSystemObjectManager(
             self.path / "modules", Module, FileSystemYamlManager)
+        from ..manifest import track
+        track(self.path)
 
     @property
     def modules(self):
@@ -284,6 +585,10 @@ class FileSystemProject:
     def attributes(self):
         return self._attribute_manager
 
+    def internal_path(self, *names):
+        """Path to caches and other internal files of the project."""
+        return self.path.joinpath('.expipe', *names)
+
 
 class FileSystemAction:
     def __init__(self, path):
@@ -293,13 +598,14 @@ class FileSystemAction:
             project = project.parent
         self._project_path = project
         self._attribute_manager = FileSystemObject(path / "attributes.yaml")
-        self._data_manager = FileSystemYamlManager(path / "attributes.yaml")
+        self._data_manager = FileSystemDataManager(path / "attributes.yaml")
+        self._data_dir_created = False
         self._message_manager = FileSystemObjectManager(
-            path / "messages", Message, FileSystemMessage, has_attributes=False)
+            path / "messages", Message, FileSystemMessage, has_attributes=False,
+            create=False)
         self._module_manager = FileSystemObjectManager(
-            path / "modules", Module, FileSystemYamlManager)
-        self._template_manager = FileSystemObjectManager(
-            project / "templates", Template, FileSystemYamlManager)
+            path / "modules", Module, FileSystemYamlManager, create=False)
+        self._template_manager = template_manager(project / "templates")
 
     @property
     def templates(self):
@@ -319,10 +625,16 @@ class FileSystemAction:
 
     @property
     def data(self):
-        return self._data_manager.get('data', {})
+        return MapManager(self._data_manager)
+
+    def internal_path(self, *names):
+        """Path to caches and other internal files of the project."""
+        return self._project_path.joinpath('.expipe', *names)
 
     def data_path(self, key=None):
-        (self.path / "data").mkdir(exist_ok=True)
+        if not self._data_dir_created:
+            (self.path / "data").mkdir(exist_ok=True)
+            self._data_dir_created = True
         if key is not None:
             return self.path / "data" / self.data[key]
         else:
@@ -335,13 +647,14 @@ class FileSystemEntity:
         project = self.path.parent
         if project.stem == 'entities': #TODO
             project = project.parent
+        self._project_path = project
         self._attribute_manager = FileSystemObject(path / "attributes.yaml")
         self._message_manager = FileSystemObjectManager(
-            path / "messages", Message, FileSystemMessage, has_attributes=False)
+            path / "messages", Message, FileSystemMessage, has_attributes=False,
+            create=False)
         self._module_manager = FileSystemObjectManager(
-            path / "modules", Module, FileSystemYamlManager)
-        self._template_manager = FileSystemObjectManager(
-            project / "templates", Template, FileSystemYamlManager)
+            path / "modules", Module, FileSystemYamlManager, create=False)
+        self._template_manager = template_manager(project / "templates")
 
     @property
     def templates(self):
@@ -359,6 +672,10 @@ class FileSystemEntity:
     def messages(self):
         return self._message_manager
 
+    def internal_path(self, *names):
+        """Path to caches and other internal files of the project."""
+        return self._project_path.joinpath('.expipe', *names)
+
 
 class FileSystemMessage:
     def __init__(self, path):
@@ -0,0 +1,160 @@
+"""Running a function on many actions and storing the results as modules.
+
+Every finished or failed action is appended to the run record
+".expipe/runs/<module>.jsonl" of the project together with the
+fingerprint of the function and of the inputs of the action. Actions
+whose latest run finished with the same fingerprint, and still have the
+output module, are skipped, so an interrupted run continues where it
+stopped and later runs only process new or changed actions.
+"""
+import collections
+import json
+import time
+import traceback
+
+from . import parallel
+from .fingerprint import action_fingerprint, fingerprint, function_fingerprint
+
+RunResult = collections.namedtuple('RunResult', ['done', 'skipped', 'failed'])
+
+
+class RunRecord:
+    """The latest run of every action for an output module."""
+    def __init__(self, path):
+        self.path = path
+        self.latest = {}
+        try:
+            with self.path.open('r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # cut short by an interrupted run
+                        continue
+                    self.latest[record['action']] = record
+        except FileNotFoundError:
+            pass
+
+    def is_done(self, name, fingerprint):
+        record = self.latest.get(name)
+        return (record is not None and record['status'] == 'done' and
+                record['fingerprint'] == fingerprint)
+
+    def append(self, name, status, fingerprint, error=None):
+        record = {
+            'action': name, 'status': status, 'fingerprint': fingerprint,
+            'time': time.time()}
+        if error is not None:
+            record['error'] = error
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        self.latest[name] = record
+
+    def compact(self):
+        """Rewrite the record with only the latest run of every action."""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            for record in self.latest.values():
+                f.write(json.dumps(record) + '\n')
+        tmp_path.replace(self.path)
+
+
+def _run_action(item):
+    """Call the function on an action, run in worker processes."""
+    func, path, project_name, name = item
+    from .core import get_project
+    try:
+        action = get_project(path, name=project_name).actions[name]
+        return name, True, func(action)
+    except Exception:
+        return name, False, traceback.format_exc()
+
+
+def _select(project, query):
+    if query is None:
+        return list(project.actions)
+    if isinstance(query, dict):
+        return [name for name, _ in project.actions.query(**query)]
+    if callable(query):
+        return [
+            name for name, attributes in project.actions.iter_attributes()
+            if query(attributes)]
+    return list(query)
+
+
+def map_actions(project, func, output_module, query=None, inputs=(),
+                data=True, workers=None, force=False):
+    """Call a function on actions and store the results as modules.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    func : callable
+        Called with an `expipe.core.Action`, returning the contents of the
+        output module. Must be picklable to run on more than one worker.
+    output_module : str
+        Name of the module the results are stored in.
+    query : dict, list or callable
+        Filters passed to `project.actions.query`, names of actions, or a
+        predicate on the attributes of actions. All actions if None.
+    inputs : list
+        Names of the modules read by the function. Together with the
+        attributes and, if `data`, the sizes and mtimes of the registered
+        data files, they decide whether an action has changed.
+    data : bool
+        Include the data files in the fingerprint of the inputs.
+    workers : int
+        Number of processes calling the function, 0 uses all CPUs.
+    force : bool
+        Run on all selected actions, also unchanged ones.
+
+    Returns
+    -------
+    result : RunResult
+        Names of the actions processed and skipped, and (name, traceback)
+        pairs of the actions that failed. Failed actions are tried again
+        by the next run.
+    """
+    record = RunRecord(
+        project._backend.internal_path('runs', output_module + '.jsonl'))
+    func_fingerprint = function_fingerprint(func)
+    fingerprints = {}
+    pending = []
+    skipped = []
+    for name in _select(project, query):
+        action = project.actions[name]
+        fingerprints[name] = fingerprint(
+            func_fingerprint,
+            action_fingerprint(action, modules=inputs, data=data))
+        if (not force and record.is_done(name, fingerprints[name]) and
+                output_module in action.modules):
+            skipped.append(name)
+        else:
+            pending.append(name)
+    items = ((func, project.path, project.id, name) for name in pending)
+    done = []
+    failed = []
+    chunksize = 1 if workers not in (None, 1) else 16
+    for name, ok, result in parallel.imap(
+            _run_action, items, jobs=workers, chunksize=chunksize):
+        if ok:
+            try:
+                project.actions[name].modules[output_module] = result
+            except Exception:
+                ok, result = False, traceback.format_exc()
+        if ok:
+            record.append(name, 'done', fingerprints[name])
+            done.append(name)
+        else:
+            record.append(name, 'failed', fingerprints[name], error=result)
+            failed.append((name, result))
+    if pending:
+        record.compact()
+    return RunResult(done, skipped, failed)
+
+
+def run_record(project, output_module):
+    """The latest run of every action for an output module, by name."""
+    return RunRecord(
+        project._backend.internal_path('runs', output_module + '.jsonl')).latest
@@ -0,0 +1,298 @@
+"""Results of functions of actions stored as modules of the actions.
+
+Functions decorated with `cached` store their result in a module of the
+action they are called with, together with the fingerprints of the
+function, its arguments and the inputs of the action under the key
+"_cache". Later calls with unchanged fingerprints read the module instead
+of calling the function. Stored results are listed in
+".expipe/cached.jsonl" of the project so that `clean` can find and remove
+stale ones without reading every module.
+"""
+import collections
+import datetime as dt
+import functools
+import importlib
+import inspect
+import json
+import os
+
+from .core import MapManager, datetime_format
+from .fingerprint import action_fingerprint, fingerprint, function_fingerprint
+
+CACHE_KEY = '_cache'
+INDEX = 'cached.jsonl'
+
+CachedResult = collections.namedtuple(
+    'CachedResult', ['action', 'module', 'meta'])
+
+# (action, module) pairs listed in the indexes by path, with the file
+# identity, size and mtime they were read at
+_indexed = {}
+
+
+def _arguments_fingerprint(signature, action, args, kwargs):
+    bound = signature.bind(action, *args, **kwargs)
+    bound.apply_defaults()
+    arguments = list(bound.arguments.items())[1:]
+    return fingerprint(arguments)
+
+
+def _stored_meta(action, module):
+    if module not in action.modules:
+        return None
+    meta = action.modules[module][CACHE_KEY]
+    if isinstance(meta, MapManager):
+        meta = meta.contents
+    return meta if isinstance(meta, dict) else None
+
+
+def _stat_key(path):
+    try:
+        st = os.stat(str(path))
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+def _index_entries(path):
+    """The (action, module) pairs listed in an index, read again only
+    after it changed."""
+    key = _stat_key(path)
+    cached = _indexed.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    entries = set()
+    try:
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries.add((entry['action'], entry['module']))
+    except FileNotFoundError:
+        pass
+    _indexed[path] = key, entries
+    return entries
+
+
+def _add_to_index(action, module):
+    path = action._backend.internal_path(INDEX)
+    entries = _index_entries(path)
+    if (action.id, module) in entries:
+        return
+    line = json.dumps({'action': action.id, 'module': module}) + '\n'
+    try:
+        f = path.open('a', encoding='utf-8')
+    except FileNotFoundError:
+        path.parent.mkdir(exist_ok=True)
+        f = path.open('a', encoding='utf-8')
+    with f:
+        f.write(line)
+    entries.add((action.id, module))
+    _indexed[path] = _stat_key(path), entries
+
+
+def cached(module, inputs=(), data=True):
+    """Store the result of a function of an action as a module of it.
+
+    The decorated function is called with an `expipe.core.Action` and
+    optionally more arguments. Its result is stored in the module
+    `module` of the action and returned. Later calls return the contents
+    of the module instead, as long as the source of the function, the
+    arguments, the attributes of the action, the modules named in
+    `inputs` and, if `data`, the sizes and mtimes of its data files are
+    unchanged. Results stored in the module are converted like other
+    modules, e.g. numpy arrays are read back as lists.
+
+    Results that are not dicts are stored under the key "value". Since
+    the module holds one result, calls with other arguments replace it.
+    Calls raise ValueError if the action already has the module without
+    a cached result in it.
+
+    Examples
+    --------
+    >>> @expipe.cached(module='spike_statistics')
+    ... def spike_statistics(action, bin_size=0.01):
+    ...     return {'rate': ...}
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        func_fingerprint = function_fingerprint(func)
+        name = '{}.{}'.format(func.__module__, func.__qualname__)
+
+        def meta_for(action, args, kwargs):
+            return {
+                'function': name,
+                'function_fingerprint': func_fingerprint,
+                'arguments': _arguments_fingerprint(
+                    signature, action, args, kwargs),
+                'inputs': action_fingerprint(
+                    action, modules=inputs, data=data),
+                'input_modules': list(inputs),
+                'data': data,
+            }
+
+        @functools.wraps(func)
+        def wrapper(action, *args, **kwargs):
+            meta = meta_for(action, args, kwargs)
+            stored = _stored_meta(action, module)
+            if stored is not None and all(
+                    stored.get(key) == value for key, value in meta.items()):
+                contents = action.modules[module].contents
+                stored = contents.pop(CACHE_KEY)
+                return contents['value'] if stored.get('wrapped') else contents
+            if stored is None and module in action.modules:
+                # never overwrite modules not written by cached functions
+                raise ValueError(
+                    'Module "{}" of action "{}" exists and does not hold a '
+                    'cached result'.format(module, action.id))
+            result = func(action, *args, **kwargs)
+            meta['created'] = dt.datetime.now().strftime(datetime_format)
+            if isinstance(result, dict):
+                if CACHE_KEY in result:
+                    raise ValueError(
+                        'Results of cached functions cannot contain the '
+                        'key "{}"'.format(CACHE_KEY))
+                contents = dict(result)
+            else:
+                contents = {'value': result}
+                meta['wrapped'] = True
+            contents[CACHE_KEY] = meta
+            action.modules[module] = contents
+            _add_to_index(action, module)
+            return result
+
+        wrapper.module = module
+        return wrapper
+    return decorator
+
+
+def cached_results(project):
+    """The results of cached functions stored in a project, read from the
+    modules listed in the index."""
+    path = project._backend.internal_path(INDEX)
+    seen = collections.OrderedDict()
+    try:
+        with path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                seen[entry['action'], entry['module']] = None
+    except FileNotFoundError:
+        return
+    for name, module in seen:
+        if name not in project.actions:
+            continue
+        meta = _stored_meta(project.actions[name], module)
+        if meta is not None:
+            yield CachedResult(name, module, meta)
+
+
+def _current_function(name):
+    """The function named "module.qualname" if it can be imported."""
+    if '<locals>' in name:
+        return None
+    module_name, _, qualname = name.rpartition('.')
+    parts = [qualname]
+    while module_name:
+        try:
+            obj = importlib.import_module(module_name)
+        except ImportError:
+            # the qualname may contain classes
+            module_name, _, part = module_name.rpartition('.')
+            parts.insert(0, part)
+            continue
+        except Exception:
+            return None
+        try:
+            for part in parts:
+                obj = getattr(obj, part)
+        except AttributeError:
+            return None
+        return obj
+    return None
+
+
+def stale_reason(project, result):
+    """Why a cached result is stale, or None if it is current.
+
+    Results are stale when the inputs of the action changed, or when the
+    function can be imported and its source changed.
+    """
+    action = project.actions[result.action]
+    meta = result.meta
+    try:
+        inputs = action_fingerprint(
+            action, modules=meta.get('input_modules') or [],
+            data=meta.get('data', True))
+    except Exception:
+        inputs = None
+    if inputs != meta.get('inputs'):
+        return 'inputs changed'
+    func = _current_function(meta.get('function', ''))
+    if func is not None and callable(func):
+        if function_fingerprint(func) != meta.get('function_fingerprint'):
+            return 'function changed'
+    return None
+
+
+def clean(project, stale=True, older_than=None, module=None, everything=False,
+          dry_run=False):
+    """Remove stored results of cached functions.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    stale : bool
+        Remove results whose inputs or function changed.
+    older_than : datetime.timedelta
+        Remove results created longer ago than this.
+    module : str
+        Only consider results stored in this module.
+    everything : bool
+        Remove all results.
+    dry_run : bool
+        Only report what would be removed.
+
+    Returns
+    -------
+    removed : list
+        (action, module, reason) of every removed result.
+    """
+    now = dt.datetime.now()
+    removed = []
+    kept = []
+    for result in cached_results(project):
+        if module is not None and result.module != module:
+            kept.append(result)
+            continue
+        reason = None
+        if everything:
+            reason = 'removed'
+        if reason is None and older_than is not None:
+            created = dt.datetime.strptime(
+                result.meta.get('created'), datetime_format)
+            if now - created > older_than:
+                reason = 'older than {}'.format(older_than)
+        if reason is None and stale:
+            reason = stale_reason(project, result)
+        if reason is None:
+            kept.append(result)
+            continue
+        removed.append((result.action, result.module, reason))
+        if not dry_run:
+            project.actions[result.action].delete_module(result.module)
+    if not dry_run:
+        path = project._backend.internal_path(INDEX)
+        tmp_path = path.with_name(path.name + '.tmp')
+        if path.exists():
+            with tmp_path.open('w', encoding='utf-8') as f:
+                for result in kept:
+                    f.write(json.dumps(
+                        {'action': result.action, 'module': result.module}
+                    ) + '\n')
+            tmp_path.replace(path)
+    return removed
@@ -15,13 +15,108 @@ import json
 import subprocess
 import pathlib
 from .cliutils import load_plugins, IPlugin
+from .cliutils.plugin import plugin_fingerprint, discover_plugin_commands
+from . import query
 import expipe as expipe_module
 
+
+# ------------------------------------------------------------------------------
+# Lazy plugin commands
+# ------------------------------------------------------------------------------
+
+def plugin_manifest_path():
+    return pathlib.Path.home() / '.config' / 'expipe' / 'plugin-manifest.yaml'
+
+
+class PluginGroup(click.Group):
+    """Click group that imports plugin modules only when one of their
+    commands is invoked.
+
+    The commands each plugin module provides are cached in a manifest
+    together with a fingerprint of the installed plugin, and the plugin is
+    only imported to rediscover its commands when the fingerprint changes.
+    """
+    def __init__(self, *args, **kwargs):
+        super(PluginGroup, self).__init__(*args, **kwargs)
+        self._plugin_commands = None
+        self._loaded_plugins = set()
+
+    def _load_manifest(self):
+        if self._plugin_commands is not None:
+            return self._plugin_commands
+        self._plugin_commands = {}
+        path = plugin_manifest_path()
+        manifest = expipe_module.config._load_config(path) or {}
+        changed = False
+        for modname in list_plugins() or []:
+            fingerprint = plugin_fingerprint(modname)
+            entry = manifest.get(modname)
+            if fingerprint is None or entry is None or \
+                    entry.get('fingerprint') != fingerprint:
+                commands = self._load_plugin(modname)
+                if commands is None:
+                    continue
+                entry = {
+                    'fingerprint': fingerprint,
+                    'commands': {
+                        name: command.get_short_help_str()
+                        for name, command in commands.items()
+                    }
+                }
+                if fingerprint is not None:
+                    manifest[modname] = entry
+                    changed = True
+            for name, short_help in entry['commands'].items():
+                self._plugin_commands[name] = (modname, short_help)
+        if changed:
+            try:
+                expipe_module.config._dump_config(path, manifest)
+            except OSError as e:
+                print('WARNING: Unable to store plugin manifest. ' + str(e))
+        return self._plugin_commands
+
+    def _load_plugin(self, modname):
+        commands = discover_plugin_commands(modname)
+        self._loaded_plugins.add(modname)
+        for command in (commands or {}).values():
+            self.add_command(command)
+        return commands
+
+    def list_commands(self, ctx):
+        plugin_commands = self._load_manifest()
+        return sorted(set(self.commands) | set(plugin_commands))
+
+    def get_command(self, ctx, cmd_name):
+        plugin_commands = self._load_manifest()
+        if cmd_name in plugin_commands:
+            modname, _ = plugin_commands[cmd_name]
+            if modname not in self._loaded_plugins:
+                self._load_plugin(modname)
+        return self.commands.get(cmd_name)
+
+    def format_commands(self, ctx, formatter):
+        # Use the cached help texts so that "--help" does not import plugins
+        plugin_commands = self._load_manifest()
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in plugin_commands and name not in self.commands:
+                short_help = plugin_commands[name][1]
+            else:
+                command = self.commands.get(name)
+                if command is None or command.hidden:
+                    continue
+                short_help = command.get_short_help_str()
+            rows.append((name, short_help))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
 # ------------------------------------------------------------------------------
 # CLI tool
 # ------------------------------------------------------------------------------
 
-@click.group()
+@click.group(cls=PluginGroup)
 # @click.version_option(version=__version_git__)
 @click.help_option('-h', '--help')
 @click.pass_context
@@ -116,16 +211,367 @@ class Default(IPlugin):
         @click.argument(
             'object-type', type=click.Choice(['actions', 'entities', 'modules'])
         )
-        def list_stuff(object_type):
+        @click.option(
+            '--tag', '-t', multiple=True,
+            help='Only objects with this tag, can be given multiple times.'
+        )
+        @click.option(
+            '--user', '-u', multiple=True,
+            help='Only objects with this user, can be given multiple times.'
+        )
+        @click.option(
+            '--entity', '-e', multiple=True,
+            help='Only actions with this entity, can be given multiple times.'
+        )
+        @click.option(
+            '--location', '-l', multiple=True,
+            help='Only objects at one of the given locations.'
+        )
+        @click.option(
+            '--type', 'type_', multiple=True,
+            help='Only objects of one of the given types.'
+        )
+        @click.option(
+            '--since', type=click.STRING,
+            help='Only objects with datetime at or after e.g. "2020-01-31".'
+        )
+        @click.option(
+            '--until', type=click.STRING,
+            help='Only objects with datetime before e.g. "2020-02-01".'
+        )
+        @click.option(
+            '--columns', '-c', type=click.STRING,
+            help='Comma separated attributes to print, "id" is the name.'
+        )
+        @click.option(
+            '--format', '-f', 'format_', default='plain',
+            type=click.Choice(['plain', 'json', 'jsonl', 'csv']),
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=1,
+            help='Number of processes reading attributes, 0 uses all CPUs.'
+        )
+        def list_stuff(object_type, tag, user, entity, location, type_,
+                       since, until, columns, format_, jobs):
             """Print project objects."""
             try:
                 project = expipe_module.get_project(path=pathlib.Path.cwd())
             except KeyError as e:
                 print(str(e))
                 return
-            for object in getattr(project, object_type):
-                print(object)
+            filters = dict(
+                tags=tag, users=user, entities=entity, location=location,
+                type=type_, since=since, until=until)
+            has_filters = any(filters.values())
+            if object_type == 'modules':
+                if has_filters or columns:
+                    raise click.UsageError(
+                        'Modules have no attributes to filter or select.')
+                for object in project.modules:
+                    print(object)
+                return
+            objects = getattr(project, object_type)
+            if columns is None and format_ == 'plain':
+                if not has_filters:
+                    for object in objects:
+                        print(object)
+                    return
+                columns = ['id']
+            elif columns is None:
+                columns = ['id', 'type', 'location', 'datetime', 'users', 'tags']
+                if object_type == 'actions':
+                    columns.append('entities')
+            else:
+                columns = [c.strip() for c in columns.split(',')]
+            try:
+                rows = (
+                    query.select_columns(name, attributes, columns)
+                    for name, attributes in objects.query(jobs=jobs, **filters))
+            except ValueError as e:
+                raise click.BadParameter(str(e))
+            _write_rows(rows, columns, format_)
+
+        @cli.command('du')
+        @click.option(
+            '--by', '-b', default='action',
+            type=click.Choice(['action', 'tag', 'user', 'entity', 'month']),
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=8,
+            help='Number of threads scanning data directories.'
+        )
+        @click.option(
+            '--refresh', is_flag=True,
+            help='Ignore cached sizes and stat every file.'
+        )
+        @click.option(
+            '--bytes', 'in_bytes', is_flag=True,
+            help='Print sizes in bytes.'
+        )
+        def du(by, jobs, refresh, in_bytes):
+            """Print disk usage of action data."""
+            from .diskusage import format_size
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            usage = project.disk_usage(by=by, jobs=jobs, refresh=refresh)
+            for key, value in usage.items():
+                size = value.size if in_bytes else format_size(value.size)
+                print('{}\t{}\t{}'.format(
+                    size, value.files, '(none)' if key is None else key))
 
+        @cli.command('export')
+        @click.argument('path', type=click.Path())
+        @click.option(
+            '--format', '-f', 'format_', default='csv',
+            type=click.Choice(['csv', 'parquet', 'feather']),
+        )
+        @click.option(
+            '--field', multiple=True,
+            help='Module field to export as "module/key/subkey", ' +
+                 'can be given multiple times.'
+        )
+        @click.option(
+            '--no-messages', is_flag=True,
+            help='Do not export messages.'
+        )
+        @click.option(
+            '--incremental', '-i', is_flag=True,
+            help='Only read objects that changed since the last export.'
+        )
+        @click.option(
+            '--chunk-size', type=click.INT, default=1000,
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=1,
+            help='Number of processes reading objects, 0 uses all CPUs.'
+        )
+        def export(path, format_, field, no_messages, incremental, chunk_size,
+                   jobs):
+            """Export project metadata to tables in PATH."""
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            try:
+                counts = project.export(
+                    path, format=format_, fields=field,
+                    messages=not no_messages, incremental=incremental,
+                    chunk_size=chunk_size, jobs=jobs)
+            except ImportError as e:
+                raise click.ClickException(
+                    'Exporting to {} requires pyarrow: {}'.format(format_, e))
+            for kind, count in counts.items():
+                print('{}: {} read, {} unchanged'.format(
+                    kind, count['read'], count['copied']))
+
+        @cli.command('ingest')
+        @click.argument('action-id', type=click.STRING)
+        @click.argument('src', type=click.Path(exists=True))
+        @click.option(
+            '--key', '-k', type=click.STRING,
+            help='Data key, defaults to the name of SRC.'
+        )
+        @click.option(
+            '--mode', '-m', default='copy',
+            type=click.Choice(['copy', 'hardlink', 'reflink', 'move']),
+        )
+        @click.option(
+            '--dest', type=click.STRING,
+            help='Path in the data directory, defaults to the name of SRC.'
+        )
+        @click.option(
+            '--no-checksum', is_flag=True,
+            help='Do not compute checksums, allows copying in the kernel.'
+        )
+        @click.option(
+            '--dedup', is_flag=True,
+            help='Link identical files to one copy in the project store.'
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=8,
+            help='Number of files ingested at a time.'
+        )
+        def ingest(action_id, src, key, mode, dest, no_checksum, dedup, jobs):
+            """Copy, link or move SRC into the data of an action and
+            register it. Interrupted ingests resume where they stopped."""
+            from .diskusage import format_size
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            try:
+                action = project.actions[action_id]
+            except KeyError as e:
+                raise click.ClickException(str(e))
+            key = key or pathlib.Path(src).name
+            if dedup and no_checksum:
+                raise click.BadParameter(
+                    '--dedup cannot be combined with --no-checksum')
+            info = action.data.ingest(
+                src, key, mode=mode, dest=dest, checksum=not no_checksum,
+                dedup=dedup, jobs=jobs)
+            print('Ingested "{}" ({}) into {}'.format(
+                key, format_size(info['size']), action.data.path(key)))
+
+        @cli.command('dedup')
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=8,
+            help='Number of threads hashing files.'
+        )
+        @click.option(
+            '--min-size', type=click.INT, default=0,
+            help='Only deduplicate files of at least this many bytes.'
+        )
+        @click.option(
+            '--dry-run', '-n', is_flag=True,
+            help='Only report how much space would be saved.'
+        )
+        def dedup(jobs, min_size, dry_run):
+            """Store identical action data files once and link them.
+
+            Linked files share their contents, replace them instead of
+            modifying them in place. Files on other file systems are
+            skipped.
+            """
+            from .diskusage import format_size
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            result = project.dedup(jobs=jobs, min_size=min_size, dry_run=dry_run)
+            if dry_run:
+                message = '{} files, {} unique, {} would be linked saving {}'
+            else:
+                message = '{} files, {} unique, {} linked, {} saved'
+            if result.skipped:
+                message += ', {} on other file systems skipped'
+            print(message.format(
+                result.files, result.unique, result.linked,
+                format_size(result.saved), result.skipped))
+
+        @cli.command('verify')
+        @click.option(
+            '--full', is_flag=True,
+            help='Hash all files, not only those whose size or mtime changed.'
+        )
+        @click.option(
+            '--yaml', is_flag=True,
+            help='Parse all YAML files to find malformed ones.'
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=None,
+            help='Number of processes hashing files, 0 uses all CPUs.'
+        )
+        @click.option(
+            '--no-update', is_flag=True,
+            help='Do not record changed files in the manifest.'
+        )
+        def verify(full, yaml, jobs, no_update):
+            """Check project files against the checksum manifest.
+
+            The manifest is built on the first run. Files written by expipe
+            are recorded as they are written, so later runs only hash files
+            changed by other means. Exits with an error if files are
+            missing, corrupt or malformed.
+            """
+            from .manifest import DAMAGE
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            damaged = 0
+            for problem in project.verify(
+                    full=full, yaml=yaml, jobs=jobs, update=not no_update):
+                line = '{:<10}{}'.format(problem.status, problem.path)
+                if problem.detail:
+                    line += ': ' + problem.detail
+                print(line)
+                damaged += problem.status in DAMAGE
+            if damaged:
+                raise click.ClickException(
+                    '{} damaged files'.format(damaged))
+
+        @cli.command('diff')
+        @click.argument('path_a', type=click.Path(exists=True, file_okay=False))
+        @click.argument('path_b', type=click.Path(exists=True, file_okay=False))
+        @click.option(
+            '--refresh', is_flag=True,
+            help='Record files changed outside expipe in the manifests first.'
+        )
+        @click.option(
+            '--jobs', '-j', type=click.INT, default=None,
+            help='Number of processes hashing files when refreshing.'
+        )
+        def diff(path_a, path_b, refresh, jobs):
+            """Compare the files of two projects by their manifests.
+
+            Lists files created, modified and deleted in PATH_B relative
+            to PATH_A. Only the cached manifests are read, run with
+            --refresh or "expipe verify" in a project after it was changed
+            outside expipe.
+            """
+            from . import manifest
+            for path in [path_a, path_b]:
+                if refresh or not manifest.Manifest(path).exists():
+                    try:
+                        project = expipe_module.get_project(path=path)
+                    except KeyError as e:
+                        raise click.ClickException(str(e))
+                    for problem in project.verify(jobs=jobs):
+                        pass
+            created, modified, deleted = manifest.diff(path_a, path_b)
+            for status, paths in [
+                    ('created', created), ('modified', modified),
+                    ('deleted', deleted)]:
+                for path in paths:
+                    print('{:<10}{}'.format(status, path))
+
+        @cli.command('clean-cache')
+        @click.option(
+            '--older-than', type=click.FLOAT, default=None,
+            help='Also remove results older than this many days.'
+        )
+        @click.option(
+            '--module', '-m', type=click.STRING, default=None,
+            help='Only consider results stored in this module.'
+        )
+        @click.option(
+            '--all', 'everything', is_flag=True,
+            help='Remove all results, not only stale ones.'
+        )
+        @click.option(
+            '--dry-run', '-n', is_flag=True,
+            help='Only list the results that would be removed.'
+        )
+        def clean_cache(older_than, module, everything, dry_run):
+            """Remove stale results of cached functions.
+
+            Results are stale when the attributes, input modules or data
+            files of their action changed, or when the function that
+            computed them can be imported and its source changed.
+            """
+            import datetime
+            try:
+                project = expipe_module.get_project(path=pathlib.Path.cwd())
+            except KeyError as e:
+                print(str(e))
+                return
+            if older_than is not None:
+                older_than = datetime.timedelta(days=older_than)
+            removed = project.clean_cache(
+                older_than=older_than, module=module, everything=everything,
+                dry_run=dry_run)
+            for action, module, reason in removed:
+                print('{}/{}: {}'.format(action, module, reason))
+            print('{} {} results'.format(
+                'Would remove' if dry_run else 'Removed', len(removed)))
 
         @cli.command('config')
         @click.argument(
@@ -170,6 +616,32 @@ class Default(IPlugin):
             expipe_module.config._dump_config_by_name(path, config)
 
 
+def _write_rows(rows, columns, format_):
+    """Stream rows to stdout as they arrive."""
+    import csv
+    out = sys.stdout
+    if format_ == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+    elif format_ == 'json':
+        out.write('[')
+    for i, row in enumerate(rows):
+        if format_ == 'plain':
+            out.write('\t'.join(query.format_cell(v) for v in row) + '\n')
+        elif format_ == 'csv':
+            writer.writerow([query.format_cell(v) for v in row])
+        else:
+            line = json.dumps(dict(zip(columns, row)), default=str)
+            if format_ == 'json':
+                line = (',\n ' if i > 0 else '') + line
+            else:
+                line += '\n'
+            out.write(line)
+        out.flush()
+    if format_ == 'json':
+        out.write(']\n')
+
+
 # ------------------------------------------------------------------------------
 # CLI plugins
 # ------------------------------------------------------------------------------
@@ -189,8 +661,6 @@ def load_cli_plugins(cli, modules=None):
             raise e
 
 
-# Load all plugins when importing this module.
-
 def list_plugins():
     cwd = pathlib.Path.cwd()
     try:
@@ -200,4 +670,7 @@ def list_plugins():
         config = expipe_module.settings
     return config.get('plugins')
 
-load_cli_plugins(expipe, list_plugins())
+
+# Plugins are attached lazily by the PluginGroup, only the default commands
+# are attached when importing this module.
+Default().attach_to_cli(expipe)
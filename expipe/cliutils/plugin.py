@@ -82,3 +82,94 @@ def load_plugins(modules):
         except ImportError as e:
             print('WARNING: Unable to import plugin. ' + str(e))
     return IPluginRegistry.plugins
+
+
+#------------------------------------------------------------------------------
+# Plugin command manifest
+#------------------------------------------------------------------------------
+
+def plugin_fingerprint(modname):
+    """Fingerprint the installed version of a plugin module without
+    importing it.
+
+    Parameters
+    ----------
+
+    modname : str
+        Dotted name of the plugin module.
+
+    Returns
+    -------
+
+    fingerprint : list or None
+        Version, path and modification time of the plugin files, None if
+        the module cannot be found.
+
+    """
+    import importlib.util
+    import importlib.metadata
+    parts = modname.split('.')
+    try:
+        spec = importlib.util.find_spec(parts[0])
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        return None
+    try:
+        version = importlib.metadata.version(parts[0])
+    except importlib.metadata.PackageNotFoundError:
+        version = None
+    paths = [spec.origin]
+    if len(parts) > 1 and spec.submodule_search_locations:
+        # NOTE find_spec on a dotted name imports the parent packages, so
+        # locate the submodule by hand
+        base = op.join(list(spec.submodule_search_locations)[0], *parts[1:])
+        paths.append(base + '.py' if op.exists(base + '.py')
+                     else op.join(base, '__init__.py'))
+    result = [version]
+    for path in paths:
+        try:
+            result.extend([path, os.stat(path).st_mtime_ns])
+        except (OSError, TypeError):
+            result.extend([path, None])
+    return result
+
+
+def discover_plugin_commands(modname):
+    """Import a plugin module and collect the commands it attaches to the CLI.
+
+    Parameters
+    ----------
+
+    modname : str
+        Dotted name of the plugin module.
+
+    Returns
+    -------
+
+    commands : dict or None
+        Mapping of command name to `click.Command`, None if the module
+        could not be imported.
+
+    """
+    import click
+    before = list(IPluginRegistry.plugins)
+    try:
+        importlib.import_module(modname)
+    except ImportError as e:
+        print('WARNING: Unable to import plugin. ' + str(e))
+        return None
+    plugins = [
+        p for p in IPluginRegistry.plugins
+        if p not in before or p.__module__ == modname or
+        p.__module__.startswith(modname + '.')]
+    group = click.Group()
+    for plugin in plugins:
+        if not hasattr(plugin, 'attach_to_cli'):
+            continue
+        try:
+            plugin().attach_to_cli(group)
+        except Exception as e:
+            print("Error when loading plugin `%s`" % plugin)
+            raise e
+    return dict(group.commands)
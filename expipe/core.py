@@ -1,14 +1,14 @@
 from . import config
-from . import widgets
-from .widgets import display
+from .cliutils.misc import lazy_import
+from .query import AttributeFilter
 import expipe
 import collections.abc
+import itertools
 import datetime as dt
 import numpy as np
 import warnings
 import pathlib
 import abc
-import IPython.display as ipd
 try:
     import ruamel.yaml as yaml
 except ImportError:
@@ -19,6 +19,18 @@ datetime_key_format = '%Y%m%dT%H%M%S'
 verbose = False
 
 
+@lazy_import
+def ipd():
+    import IPython.display as ipd
+    return ipd
+
+
+@lazy_import
+def widgets():
+    import expipe.widgets.display
+    return expipe.widgets
+
+
 class ListManager:
     """
     Common class for lists of objects, such as messages.
@@ -89,12 +101,22 @@ class MapManager:
     def values(self):
         return collections.abc.ValuesView(self)
 
+    def keys_window(self, start, stop):
+        """
+        Return the keys from position `start` to `stop` without listing
+        all keys when the backend supports it.
+        """
+        if hasattr(self._backend, 'keys_window'):
+            return self._backend.keys_window(start, stop)
+        return list(itertools.islice(iter(self), start, stop))
+
     def _ipython_key_completions_(self):
         return self.keys()
 
     @property
     def contents(self):
-        if hasattr(self._backend, 'contents'):
+        # check the class, hasattr on the instance would load the contents
+        if hasattr(type(self._backend), 'contents'):
             return self._backend.contents
         else:
             name = self._backend.__class__.__name__
@@ -106,11 +128,63 @@ class Modules(MapManager):
         super(Modules, self).__init__(backend=backend)
         self.object = object
 
+    def __getitem__(self, name):
+        module = super(Modules, self).__getitem__(name)
+        module._owner = self.object
+        return module
+
+    def __setitem__(self, name, value):
+        change = 'modified' if name in self else 'created'
+        super(Modules, self).__setitem__(name, value)
+        self.object._emit(change, 'module', name)
+
     def _ipython_display_(self):
         ipd.display(widgets.display.modules_view(self.object))
 
 
-class Actions(MapManager):
+class ObjectManager(MapManager):
+    """
+    Common class for maps of objects with attributes, such as actions and
+    entities.
+    """
+    def iter_attributes(self, names=None, jobs=None):
+        """
+        Iterate over (name, attributes) pairs, optionally reading the
+        attributes of many objects in parallel with `jobs` processes.
+        """
+        return self._backend.iter_attributes(names=names, jobs=jobs)
+
+    def query(self, names=None, jobs=None, **filters):
+        """
+        Iterate over (name, attributes) pairs of the objects matching the
+        filters, see `expipe.query.AttributeFilter` for the options.
+        """
+        predicate = AttributeFilter(**filters)
+        return self._backend.iter_attributes(
+            names=names, jobs=jobs, predicate=predicate or None)
+
+    def to_dataframe(self, columns=None, ids=None, tags='matrix', jobs=None):
+        """
+        Return the attributes as a pandas DataFrame indexed by name.
+
+        Parameters
+        ----------
+        columns : list
+            Attributes to include, defaults to `expipe.table.DEFAULT_COLUMNS`.
+        ids : list
+            Names of the objects to include, defaults to all.
+        tags : str
+            "matrix" for a boolean column per tag, "list" for a list column
+            or "exploded" for one row per tag.
+        jobs : int
+            Number of processes reading attribute files.
+        """
+        from . import table
+        items = self.iter_attributes(names=ids, jobs=jobs)
+        return table.to_dataframe(items, columns=columns, tags=tags)
+
+
+class Actions(ObjectManager):
     def __init__(self, object, backend):
         super(Actions, self).__init__(backend=backend)
         self.object = object
@@ -119,7 +193,7 @@ class Actions(MapManager):
         ipd.display(widgets.display.actions_view(self.object))
 
 
-class Entities(MapManager):
+class Entities(ObjectManager):
     def __init__(self, object, backend):
         super(Entities, self).__init__(backend=backend)
         self.object = object
@@ -154,6 +228,10 @@ class ExpipeObject:
         self.id = object_id
         self._backend = backend
 
+    def _emit(self, change, kind, name, key=None):
+        from . import events
+        events.emit(self, change, kind, name, key=key)
+
     @property
     def modules(self):
         return Modules(self, self._backend.modules)
@@ -198,12 +276,22 @@ class ExpipeObject:
         module = self.modules[name]
         self._backend.modules.delete(name)
         del module
+        self._emit('deleted', 'module', name)
 
     def _load_template(self, template):
-        contents = self._backend.templates[template].contents
+        templates = self._backend.templates
+        if hasattr(templates, 'template_contents'):
+            # cached by the backend
+            contents = templates.template_contents(template)
+        else:
+            contents = templates[template].contents
         name = contents.get('identifier')
         if name is None:
             raise ValueError('Template "' + template + '" has no identifier.')
+        from .schema import SCHEMA_KEY, template_schema
+        if template_schema(contents) is not None:
+            # the schema describes the module and is not part of it
+            del contents[SCHEMA_KEY]
         return name, contents
 
     def _create_module(self, name, contents):
@@ -238,6 +326,7 @@ class Project(ExpipeObject):
     def _create_action(self, name):
         dtime = dt.datetime.today().strftime(datetime_format)
         self.actions[name] = {"registered": dtime}
+        self._emit('created', 'action', name)
         return self.actions[name]
 
     def require_action(self, name):
@@ -266,6 +355,7 @@ class Project(ExpipeObject):
         action = self.actions[name]
         action = self._backend.actions.delete(name)
         del action
+        self._emit('deleted', 'action', name)
 
     @property
     def entities(self):
@@ -274,6 +364,7 @@ class Project(ExpipeObject):
     def _create_entity(self, name):
         dtime = dt.datetime.today().strftime(datetime_format)
         self.entities[name] = {"registered": dtime}
+        self._emit('created', 'entity', name)
         return self.entities[name]
 
     def require_entity(self, name):
@@ -302,6 +393,7 @@ class Project(ExpipeObject):
         entity = self.entities[name]
         action = self._backend.entities.delete(name)
         del entity
+        self._emit('deleted', 'entity', name)
 
     @property
     def templates(self):
@@ -313,6 +405,7 @@ class Project(ExpipeObject):
         if not 'identifier' in contents:
             raise ValueError('Template contents must contain "identifier"')
         self.templates[name] = contents
+        self._emit('created', 'template', name)
         return self.templates[name]
 
     def require_template(self, name, contents=None):
@@ -341,11 +434,166 @@ class Project(ExpipeObject):
         template = self.templates[name]
         self._backend.templates.delete(name)
         del template
+        self._emit('deleted', 'template', name)
+
+    def apply_template(self, template, actions=None, overwrite=False,
+                       jobs=None):
+        """
+        Create a module from a template in many actions at once. The
+        template is read and serialized once and written to every action.
+
+        Parameters
+        ----------
+        template : str
+            Name of the template, the module is named by its identifier.
+        actions : list
+            Names of the actions, all actions if None.
+        overwrite : bool
+            Replace the module in actions that already have it, these are
+            skipped otherwise.
+        jobs : int
+            Number of threads writing modules.
+
+        Returns
+        -------
+        written : list
+            Names of the actions the module was written to.
+        """
+        from . import events
+        name, contents = self._load_template(template)
+        actions = list(self.actions) if actions is None else list(actions)
+        written = self._backend.actions.write_modules(
+            actions, name, contents, overwrite=overwrite, jobs=jobs)
+        for action in written:
+            events.emit(self.actions[action], 'created', 'module', name)
+        return written
+
+    def map_actions(self, func, output_module, query=None, inputs=(),
+                    data=True, workers=None, force=False):
+        """
+        Call `func(action)` on the actions matching `query` on `workers`
+        processes and store the results in the module `output_module`,
+        skipping actions whose inputs are unchanged since the last run,
+        see `expipe.batch.map_actions`.
+        """
+        from . import batch
+        return batch.map_actions(
+            self, func, output_module, query=query, inputs=inputs, data=data,
+            workers=workers, force=force)
+
+    def clean_cache(self, stale=True, older_than=None, module=None,
+                    everything=False, dry_run=False):
+        """
+        Remove results of functions decorated with `expipe.cached` that
+        are stale, old or stored in a module, see `expipe.cache.clean`.
+        """
+        from . import cache
+        return cache.clean(
+            self, stale=stale, older_than=older_than, module=module,
+            everything=everything, dry_run=dry_run)
+
+    def validate(self, template, actions=None, jobs=None):
+        """
+        Check the modules derived from a template against the schema of
+        the template, yielding violations as they are found, see
+        `expipe.schema.validate`.
+        """
+        from . import schema
+        return schema.validate(self, template, actions=actions, jobs=jobs)
 
     @property
     def path(self):
         return self._backend.path
 
+    def dedup(self, jobs=8, min_size=0, dry_run=False):
+        """
+        Replace identical data files of actions by links to one copy in
+        the content-addressed store of the project, see
+        `expipe.store.dedup`.
+        """
+        from . import store
+        return store.dedup(
+            self, jobs=jobs, min_size=min_size, dry_run=dry_run)
+
+    def verify(self, full=False, yaml=False, jobs=None, update=True):
+        """
+        Check the files of the project against its checksum manifest,
+        hashing only files whose size or mtime changed unless `full`, see
+        `expipe.manifest.verify`.
+        """
+        from . import manifest
+        return manifest.verify(
+            self, full=full, yaml=yaml, jobs=jobs, update=update)
+
+    def subscribe(self, callback):
+        """
+        Call `callback(event)` when actions, entities, modules, messages
+        or attributes of the project are changed in this process, see
+        `expipe.events`.
+        """
+        from . import events
+        return events.subscribe(callback, project=self.path)
+
+    def unsubscribe(self, callback):
+        from . import events
+        events.unsubscribe(callback)
+
+    def follow(self, offset=0, interval=0.5, timeout=None):
+        """
+        Yield changes made by any process as they are appended to the
+        journal of the project, see `expipe.events.follow`.
+        """
+        from . import events
+        return events.follow(
+            self.path, offset=offset, interval=interval, timeout=timeout)
+
+    def watch(self, interval=1.0, poll=None):
+        """
+        Watch the project for changes made by any process, with inotify
+        or by polling, dropping cached contents of changed files, see
+        `expipe.watch.Watcher`.
+        """
+        from . import watch
+        return watch.watch(self, interval=interval, poll=poll)
+
+    def state_token(self):
+        """
+        Token identifying the current state of the project, for
+        `changes_since`, see `expipe.manifest.state_token`.
+        """
+        from . import manifest
+        return manifest.state_token(self)
+
+    def changes_since(self, token=None, refresh=False, jobs=None):
+        """
+        Actions, entities, modules, messages and data files created,
+        modified or deleted since a state token, see
+        `expipe.manifest.changes_since`.
+        """
+        from . import manifest
+        return manifest.changes_since(
+            self, token=token, refresh=refresh, jobs=jobs)
+
+    def disk_usage(self, by='action', jobs=None, refresh=False):
+        """
+        Size of the action data grouped by "action", "tag", "user",
+        "entity" or "month", see `expipe.diskusage.disk_usage`.
+        """
+        from . import diskusage
+        return diskusage.disk_usage(self, by=by, jobs=jobs, refresh=refresh)
+
+    def export(self, path, format='csv', fields=None, messages=True,
+               incremental=False, chunk_size=1000, jobs=None):
+        """
+        Export attributes, messages and module fields of all actions and
+        entities to CSV, Parquet or Feather tables, see
+        `expipe.export.export`.
+        """
+        from . import export
+        return export.export(
+            self, path, format=format, fields=fields, messages=messages,
+            incremental=incremental, chunk_size=chunk_size, jobs=jobs)
+
 
 class ExpipeSubObject(ExpipeObject):
     def __init__(self, object_id, backend):
@@ -375,11 +623,23 @@ class ExpipeSubObject(ExpipeObject):
             raise KeyError("Message with the same datetime already exists '{}'".format(datetime_key_str))
 
         self.messages[datetime_key_str] = message
+        self._emit('created', 'message', datetime_key_str)
         return self.messages[datetime_key_str]
 
     def delete_messages(self):
         for message in self.messages:
             self._backend.messages.delete(name=message)
+            self._emit('deleted', 'message', message)
+
+    def _set_attribute(self, name, value):
+        self._backend.attributes.set(name, value)
+        self._emit('modified', 'attribute', name)
+
+    def _property_list(self, name):
+        return PropertyList(
+            self._backend.attributes, name, dtype=str, unique=True,
+            data=self._backend.attributes.get(name),
+            on_change=lambda: self._emit('modified', 'attribute', name))
 
     def _assert_message_dtype(self, text, user, datetime):
         _assert_message_text_dtype(text)
@@ -394,7 +654,7 @@ class ExpipeSubObject(ExpipeObject):
     def location(self, value):
         if not isinstance(value, str):
             raise TypeError('Expected "str" got "' + str(type(value)) + '"')
-        self._backend.attributes.set('location', value)
+        self._set_attribute('location', value)
 
     @property
     def type(self):
@@ -404,7 +664,7 @@ class ExpipeSubObject(ExpipeObject):
     def type(self, value):
         if not isinstance(value, str):
             raise TypeError('Expected "str" got "' + str(type(value)) + '"')
-        self._backend.attributes.set('type', value)
+        self._set_attribute('type', value)
 
 
     @property
@@ -424,12 +684,11 @@ class ExpipeSubObject(ExpipeObject):
             raise TypeError(
                 'Expected "datetime" got "' + str(type(value)) + '".')
         dtime = value.strftime(datetime_format)
-        self._backend.attributes.set('datetime', dtime)
+        self._set_attribute('datetime', dtime)
 
     @property
     def users(self):
-        return PropertyList(self._backend.attributes, 'users', dtype=str, unique=True,
-                           data=self._backend.attributes.get('users'))
+        return self._property_list('users')
 
     @users.setter
     def users(self, value):
@@ -439,12 +698,11 @@ class ExpipeSubObject(ExpipeObject):
             raise TypeError('Expected contents to be "str" got ' +
                             str([type(v) for v in value]))
         value = list(set(value))
-        self._backend.attributes.set('users', value)
+        self._set_attribute('users', value)
 
     @property
     def tags(self):
-        return PropertyList(self._backend.attributes, 'tags', dtype=str, unique=True,
-                           data=self._backend.attributes.get('tags'))
+        return self._property_list('tags')
 
     @tags.setter
     def tags(self, value):
@@ -454,7 +712,7 @@ class ExpipeSubObject(ExpipeObject):
             raise TypeError('Expected contents to be "str" got ' +
                             str([type(v) for v in value]))
         value = list(set(value))
-        self._backend.attributes.set('tags', value)
+        self._set_attribute('tags', value)
 
     @property
     def attributes(self):
@@ -488,8 +746,7 @@ class Action(ExpipeSubObject):
 
     @property
     def entities(self):
-        return PropertyList(self._backend.attributes, 'entities', dtype=str, unique=True,
-                           data=self._backend.attributes.get('entities'))
+        return self._property_list('entities')
 
     @entities.setter
     def entities(self, value):
@@ -499,11 +756,15 @@ class Action(ExpipeSubObject):
             raise TypeError('Expected contents to be "str" got ' +
                             str([type(v) for v in value]))
         value = list(set(value))
-        self._backend.attributes.set('entities', value)
+        self._set_attribute('entities', value)
 
     @property
     def data(self):
-        return MapManager(self._backend.data)
+        """
+        The data files of the action, see `expipe.datafiles.DataRegistry`.
+        """
+        from .datafiles import DataRegistry
+        return DataRegistry(self)
 
     def data_path(self, key=None):
         return self._backend.data_path(key)
@@ -516,6 +777,43 @@ class Module(MapManager):
     def __init__(self, module_id, backend):
         super(Module, self).__init__(backend=backend)
         self.id = module_id
+        self._owner = None
+
+    def __getitem__(self, name):
+        return self._wrap(super(Module, self).__getitem__(name), [name])
+
+    def __setitem__(self, name, value):
+        super(Module, self).__setitem__(name, value)
+        self._changed([name])
+
+    def _wrap(self, value, keys):
+        if isinstance(value, MapManager):
+            return _ModuleMap(value._backend, self, keys)
+        return value
+
+    def _changed(self, keys):
+        if self._owner is not None:
+            self._owner._emit(
+                'modified', 'module', self.id,
+                key='/'.join(str(key) for key in keys))
+
+
+class _ModuleMap(MapManager):
+    """
+    Mapping nested in a module, its changes are changes of the module
+    """
+    def __init__(self, backend, module, keys):
+        super(_ModuleMap, self).__init__(backend=backend)
+        self._module = module
+        self._keys = keys
+
+    def __getitem__(self, name):
+        return self._module._wrap(
+            super(_ModuleMap, self).__getitem__(name), self._keys + [name])
+
+    def __setitem__(self, name, value):
+        super(_ModuleMap, self).__setitem__(name, value)
+        self._module._changed(self._keys + [name])
 
 
 class Template(MapManager):
@@ -573,12 +871,13 @@ class Message:
 
 class PropertyList:
     def __init__(self, db_instance, name, dtype=None, unique=False,
-                 data=None):
+                 data=None, on_change=None):
         self._backend = db_instance
         self.name = name
         self.dtype = dtype
         self.unique = unique
         self.data = data or self._backend.get(self.name)
+        self._on_change = on_change
 
     def __iter__(self):
         data = self.data or []
@@ -616,6 +915,8 @@ class PropertyList:
         if self.unique:
             data = list(set(data))
         self._backend.set(self.name, data)
+        if self._on_change is not None:
+            self._on_change()
 
     def extend(self, value):
         data = self.data or []
@@ -624,6 +925,8 @@ class PropertyList:
         if self.unique:
             data = list(set(data))
         self._backend.set(self.name, data)
+        if self._on_change is not None:
+            self._on_change()
 
     def dtype_manager(self, value, iter_value=False, retrieve=False):
         if iter_value:
@@ -0,0 +1,448 @@
+"""Registry of the data files of an action.
+
+The `data` attribute of an action maps keys to paths relative to the data
+directory of the action. Registering a key also stores its size, mtime and
+SHA-256 digest under the `data_info` attribute, so that data can be listed
+and summarized across many actions from the attributes alone, without
+touching the files.
+"""
+import errno
+import hashlib
+import mmap as mmap_
+import os
+import pathlib
+import shutil
+
+from . import parallel
+from .backends.filesystem import notify_change
+from .core import MapManager
+
+CHUNK_SIZE = 1 << 20
+INFO_KEY = 'data_info'
+INGEST_MODES = ['copy', 'hardlink', 'reflink', 'move']
+PARTIAL_SUFFIX = '.partial'
+# from linux/fs.h, clones the extents of a file on btrfs, xfs and others
+FICLONE = 0x40049409
+# errors of zero-copy and clone calls on file systems that lack them
+_UNSUPPORTED = (
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTTY,
+    errno.EBADF, errno.EPERM)
+
+
+def file_hash(path, algorithm='sha256', chunk_size=CHUNK_SIZE):
+    """Hex digest of a file, read in chunks into a reused buffer."""
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def _walk_files(path):
+    """Relative paths of all files below a directory, sorted."""
+    result = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in files:
+            full = os.path.join(root, name)
+            result.append(os.path.relpath(full, path))
+    return sorted(result)
+
+
+def _tree_digest(files):
+    """Digest of a directory from (relative path, file digest) pairs."""
+    digest = hashlib.sha256()
+    for name, file_digest in files:
+        digest.update('{}\0{}\n'.format(
+            pathlib.PurePath(name).as_posix(), file_digest).encode())
+    return digest.hexdigest()
+
+
+def path_info(path, checksum=True):
+    """Size, mtime and optionally SHA-256 digest of a file or directory.
+
+    The digest of a directory is computed over the relative paths and
+    digests of its files, so it only depends on their names and contents.
+    """
+    path = pathlib.Path(path)
+    st = os.stat(path)
+    if not path.is_dir():
+        info = {'size': st.st_size, 'mtime': st.st_mtime_ns}
+        if checksum:
+            info['sha256'] = file_hash(path)
+        return info
+    size = 0
+    mtime = st.st_mtime_ns
+    files = _walk_files(path)
+    for name in files:
+        file_st = os.stat(path / name)
+        size += file_st.st_size
+        mtime = max(mtime, file_st.st_mtime_ns)
+    info = {'size': size, 'mtime': mtime, 'files': len(files)}
+    if checksum:
+        info['sha256'] = _tree_digest(
+            (name, file_hash(path / name)) for name in files)
+    return info
+
+
+def _copy_range(src, dst, offset, size):
+    """Copy bytes from offset to size in the kernel, False if unsupported."""
+    copy_range = getattr(os, 'copy_file_range', None)
+    while offset < size:
+        try:
+            if copy_range is not None:
+                n = copy_range(src, dst, size - offset, offset, offset)
+            else:
+                os.lseek(dst, offset, os.SEEK_SET)
+                n = os.sendfile(dst, src, offset, size - offset)
+        except OSError as e:
+            if e.errno in _UNSUPPORTED and copy_range is not None:
+                # e.g. copying across file systems on older kernels
+                copy_range = None
+                continue
+            if e.errno in _UNSUPPORTED:
+                return False
+            raise
+        if n == 0:
+            break
+        offset += n
+    return True
+
+
+def _copy_chunks(src, dst, offset, digest, chunk_size=CHUNK_SIZE):
+    """Copy from offset to the end, hashing the bytes as they are copied."""
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    os.lseek(src, offset, os.SEEK_SET)
+    os.lseek(dst, offset, os.SEEK_SET)
+    while True:
+        n = os.readv(src, [buffer])
+        if not n:
+            break
+        if digest is not None:
+            digest.update(view[:n])
+        written = 0
+        while written < n:
+            written += os.write(dst, view[written:n])
+
+
+def copy_file(src, dst, checksum=True, chunk_size=CHUNK_SIZE):
+    """Copy a file, computing its SHA-256 digest in the same pass.
+
+    The copy is written to "<dst>.partial" and renamed when complete. An
+    interrupted copy is resumed from the end of the partial file, whose
+    bytes are only read again to continue the digest. Without a checksum
+    the data is copied in the kernel with `os.copy_file_range` or
+    `os.sendfile` where available.
+
+    Returns
+    -------
+    digest : str
+        Hex digest of the file, None if not `checksum`.
+    """
+    src, dst = pathlib.Path(src), pathlib.Path(dst)
+    partial = dst.with_name(dst.name + PARTIAL_SUFFIX)
+    size = os.stat(src).st_size
+    digest = hashlib.sha256() if checksum else None
+    offset = 0
+    if partial.exists():
+        offset = os.stat(partial).st_size
+        if offset > size:
+            offset = 0
+        elif digest is not None and offset > 0:
+            with open(partial, 'rb') as f:
+                remaining = offset
+                while remaining > 0:
+                    chunk = f.read(min(chunk_size, remaining))
+                    digest.update(chunk)
+                    remaining -= len(chunk)
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(partial, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(dst_fd, offset)
+            if digest is not None or not _copy_range(
+                    src_fd, dst_fd, offset, size):
+                _copy_chunks(src_fd, dst_fd, offset, digest, chunk_size)
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, partial)
+    os.replace(partial, dst)
+    return None if digest is None else digest.hexdigest()
+
+
+def reflink_file(src, dst):
+    """Clone a file sharing its extents, False if unsupported."""
+    import fcntl
+    src_fd = os.open(src, os.O_RDONLY)
+    try:
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        except OSError as e:
+            os.close(dst_fd)
+            dst_fd = None
+            os.unlink(dst)
+            if e.errno in _UNSUPPORTED:
+                return False
+            raise
+        finally:
+            if dst_fd is not None:
+                os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+    shutil.copystat(src, dst)
+    return True
+
+
+def _data_relative(data_dir, path):
+    """Path relative to the data directory, raising ValueError if it
+    leaves it."""
+    # normalize without resolving symlinks, which may point to other
+    # volumes, and reject relative paths leaving the data directory
+    full = pathlib.Path(os.path.normpath(data_dir / path))
+    try:
+        return full.relative_to(os.path.normpath(data_dir))
+    except ValueError:
+        raise ValueError(
+            'Data "{}" is not in the data directory {}'.format(
+                path, data_dir))
+
+
+def _ingest_file(item):
+    """Ingest one file, run in threads."""
+    src, dst, mode, checksum = item
+    src, dst = pathlib.Path(src), pathlib.Path(dst)
+    st = os.stat(src)
+    if dst.exists():
+        dst_st = os.stat(dst)
+        if (dst_st.st_size, dst_st.st_mtime_ns) == (st.st_size, st.st_mtime_ns):
+            # completed in an earlier, interrupted ingest
+            if mode == 'move':
+                os.unlink(src)
+            return dst, file_hash(dst) if checksum else None
+        os.unlink(dst)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    if mode == 'move':
+        try:
+            os.rename(src, dst)
+            return dst, file_hash(dst) if checksum else None
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        digest = copy_file(src, dst, checksum=checksum)
+        os.unlink(src)
+        return dst, digest
+    if mode == 'hardlink':
+        os.link(src, dst)
+        return dst, file_hash(dst) if checksum else None
+    if mode == 'reflink' and reflink_file(src, dst):
+        return dst, file_hash(dst) if checksum else None
+    return dst, copy_file(src, dst, checksum=checksum)
+
+
+def ingest(registry, src, key, mode='copy', dest=None, checksum=True,
+           dedup=False, jobs=8):
+    """Bring a file or directory into the data directory of an action
+    and register it under `key`, see `DataRegistry.ingest`."""
+    if mode not in INGEST_MODES:
+        raise ValueError(
+            'Expected "mode" to be one of {} got "{}"'.format(
+                INGEST_MODES, mode))
+    if dedup and not checksum:
+        raise ValueError('Deduplication requires checksums')
+    src = pathlib.Path(src)
+    if not src.exists():
+        raise FileNotFoundError('No such file or directory: {}'.format(src))
+    dest = _data_relative(registry.path(), dest or src.name)
+    target = registry.path() / dest
+    is_dir = src.is_dir()
+    if is_dir:
+        names = _walk_files(src)
+        items = (
+            (src / name, target / name, mode, checksum) for name in names)
+    else:
+        items = [(src, target, mode, checksum)]
+    digests = {}
+    for path, digest in parallel.imap(
+            _ingest_file, items, jobs=jobs, threads=True):
+        digests[path] = digest
+    if is_dir and mode == 'move':
+        shutil.rmtree(str(src))
+    if dedup:
+        from .store import project_store
+        store = project_store(registry._action._backend)
+        for path, digest in digests.items():
+            store.add(path, digest)
+    for path, digest in digests.items():
+        notify_change(path, digest)
+    info = path_info(target, checksum=False)
+    if checksum:
+        if not is_dir:
+            info['sha256'] = digests[target]
+        else:
+            # the digests of the copies, instead of reading the files
+            # again, and of files already in the target, e.g. moved by an
+            # interrupted ingest
+            info['sha256'] = _tree_digest(
+                (name, digests.get(target / name) or file_hash(target / name))
+                for name in _walk_files(target))
+    registry._record({key: (dest.as_posix(), info)})
+    return info
+
+
+class DataRegistry(MapManager):
+    """
+    The data files of an action.
+
+    Works like a mapping of keys to paths relative to the data directory
+    of the action, with methods to register files together with their
+    size, mtime and checksum, verify them and open them.
+    """
+    def __init__(self, action):
+        super(DataRegistry, self).__init__(action._backend.data)
+        self._action = action
+
+    @property
+    def _attributes(self):
+        return self._action._backend.attributes
+
+    def path(self, key=None):
+        """Absolute path of the data with `key` or of the data directory."""
+        return self._action.data_path(key)
+
+    def info(self, key=None):
+        """Recorded size, mtime and checksum of `key` or of all keys."""
+        info = self._attributes.get(INFO_KEY) or {}
+        if key is None:
+            return info
+        if key not in info:
+            raise KeyError('Data "{}" is not registered'.format(key))
+        return info[key]
+
+    def register(self, key, path=None, checksum=True):
+        """Register a file or directory in the data directory.
+
+        Parameters
+        ----------
+        key : str
+        path : str or pathlib.Path
+            Path of the data, relative to the data directory or absolute
+            below it. Defaults to the path already stored for `key`.
+        checksum : bool
+            Compute the SHA-256 digest of the data.
+
+        Returns
+        -------
+        info : dict
+            The recorded size, mtime and checksum.
+        """
+        data_dir = self.path()
+        if path is None:
+            path = self[key]
+        path = _data_relative(data_dir, path)
+        info = path_info(data_dir / path, checksum=checksum)
+        self._record({key: (path.as_posix(), info)})
+        return info
+
+    def _record(self, entries):
+        # write the paths and their info in one update of the attributes
+        data = self._attributes.get('data') or {}
+        infos = self._attributes.get(INFO_KEY) or {}
+        for key, (path, info) in entries.items():
+            data[key] = path
+            infos[key] = info
+        self._attributes.set_items({'data': data, INFO_KEY: infos})
+
+    def ingest(self, src, key, mode='copy', dest=None, checksum=True,
+               dedup=False, jobs=8):
+        """Bring a file or directory into the data directory and register it.
+
+        Files of a directory are copied in parallel. Copies are checksummed
+        in the same pass that copies them, are written to ".partial"
+        files and resume where they stopped if interrupted, and files
+        already ingested by an interrupted run are skipped.
+
+        Parameters
+        ----------
+        src : str or pathlib.Path
+            File or directory to ingest.
+        key : str
+        mode : str
+            "copy", "hardlink", "reflink" (clone the file extents on file
+            systems that support it and copy otherwise) or "move".
+        dest : str
+            Path relative to the data directory, defaults to the name of
+            `src`. Raises ValueError if it is outside the data directory.
+        checksum : bool
+            Record the SHA-256 digest. Without it, copies are made in the
+            kernel where supported.
+        dedup : bool
+            Store the files in the content-addressed store of the project
+            and link them from the data directory, see `expipe.store`.
+        jobs : int
+            Number of files ingested at a time.
+
+        Returns
+        -------
+        info : dict
+            The recorded size, mtime and checksum.
+        """
+        return ingest(
+            self, src, key, mode=mode, dest=dest, checksum=checksum,
+            dedup=dedup, jobs=jobs)
+
+    def verify(self, key=None, checksum=False):
+        """Keys whose data changed since they were registered.
+
+        Sizes and mtimes are compared, and checksums too if `checksum`.
+        Missing data is reported as changed.
+        """
+        infos = self.info()
+        keys = list(infos) if key is None else [key]
+        changed = []
+        for key in keys:
+            recorded = infos[key]
+            try:
+                current = path_info(
+                    self.path(key),
+                    checksum=checksum and 'sha256' in recorded)
+            except (FileNotFoundError, KeyError):
+                changed.append(key)
+                continue
+            if any(recorded.get(name) != value
+                   for name, value in current.items()):
+                changed.append(key)
+        return changed
+
+    def open(self, key, mmap=True, dtype=None, shape=None, offset=0):
+        """Open a data file for reading.
+
+        Parameters
+        ----------
+        key : str
+        mmap : bool
+            Return a read-only memory map instead of a file object.
+        dtype : numpy dtype
+            Return a read-only `numpy.memmap` of raw binary data.
+        shape : tuple
+            Shape of the memmap, defaults to a flat array of the file.
+        offset : int
+            Offset in bytes of the array in the file.
+        """
+        path = self.path(key)
+        if dtype is not None:
+            import numpy as np
+            return np.memmap(
+                path, dtype=dtype, mode='r', shape=shape, offset=offset)
+        if not mmap:
+            return open(path, 'rb')
+        with open(path, 'rb') as f:
+            return mmap_.mmap(f.fileno(), 0, access=mmap_.ACCESS_READ)
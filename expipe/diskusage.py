@@ -0,0 +1,122 @@
+import collections
+import os
+import pathlib
+
+from . import parallel
+from .backends.filesystem import json_dump, json_load
+
+Usage = collections.namedtuple('Usage', ['size', 'files'])
+
+GROUPS = ['action', 'tag', 'user', 'entity', 'month']
+# attributes listing the values grouped by
+FIELDS = {'tag': 'tags', 'user': 'users', 'entity': 'entities'}
+
+
+def _scan_data(item):
+    """Sum the sizes of all files below a data directory.
+
+    The sizes of the files directly inside each directory are cached
+    together with the mtime of the directory. Files are only stat'ed in
+    directories whose mtime changed, i.e. where files were added, removed
+    or renamed since the last scan.
+    """
+    name, path, cached = item
+    cached = cached or {}
+    dirs = {}
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            mtime = os.stat(os.path.join(path, rel)).st_mtime_ns
+            entries = os.scandir(os.path.join(path, rel))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        previous = cached.get(rel)
+        reuse = previous is not None and previous[0] == mtime
+        size = 0
+        count = 0
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(os.path.join(rel, entry.name))
+                elif not reuse:
+                    try:
+                        size += entry.stat(follow_symlinks=False).st_size
+                    except FileNotFoundError:
+                        continue
+                    count += 1
+        if reuse:
+            size, count = previous[1], previous[2]
+        dirs[rel] = [mtime, size, count]
+    return name, dirs
+
+
+def disk_usage(project, by='action', jobs=None, refresh=False):
+    """Disk usage of the data of all actions in a project.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    by : str
+        Group sizes by "action", "tag", "user", "entity" or "month" (of the
+        action datetime). Actions with several tags, users or entities
+        count towards each of them.
+    jobs : int
+        Number of threads scanning the data directories.
+    refresh : bool
+        Ignore the cache and stat every file. Directory mtimes do not
+        change when a file is modified in place, so use this after
+        appending to existing files.
+
+    Returns
+    -------
+    usage : OrderedDict
+        Mapping of group to `Usage(size, files)` sorted by size.
+    """
+    if by not in GROUPS:
+        raise ValueError(
+            'Expected "by" to be one of {} got "{}"'.format(GROUPS, by))
+    cache_path = project._backend.internal_path('disk-usage.json')
+    cache = {} if refresh else json_load(cache_path, {})
+    actions_path = pathlib.Path(project.path) / 'actions'
+    items = (
+        (name, str(actions_path / name / 'data'), cache.get(name))
+        for name in project.actions)
+    new_cache = {}
+    per_action = {}
+    for name, dirs in parallel.imap(_scan_data, items, jobs=jobs, threads=True):
+        new_cache[name] = dirs
+        per_action[name] = Usage(
+            sum(d[1] for d in dirs.values()), sum(d[2] for d in dirs.values()))
+    if new_cache != cache:
+        json_dump(cache_path, new_cache)
+
+    if by == 'action':
+        groups = per_action
+    else:
+        groups = collections.defaultdict(lambda: Usage(0, 0))
+        for name, attributes in project.actions.iter_attributes(
+                names=list(per_action), jobs=jobs):
+            for key in _group_keys(attributes, by):
+                usage = groups[key]
+                groups[key] = Usage(
+                    usage.size + per_action[name].size,
+                    usage.files + per_action[name].files)
+    return collections.OrderedDict(
+        sorted(groups.items(), key=lambda item: item[1].size, reverse=True))
+
+
+def _group_keys(attributes, by):
+    if by == 'month':
+        dtime = attributes.get('datetime') or attributes.get('registered')
+        return [dtime[:7] if dtime else None]
+    values = attributes.get(FIELDS[by]) or []
+    return values or [None]
+
+
+def format_size(size):
+    for unit in ['B', 'kB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1000 or unit == 'TB':
+            break
+        size /= 1000
+    return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
@@ -0,0 +1,174 @@
+"""Change events of projects.
+
+Creating, modifying and deleting actions, entities, modules, messages and
+attributes through expipe emits an `Event`. Events are passed to the
+subscribers in this process and appended to the journal
+".expipe/journal.jsonl" of the project, one JSON object per line, which
+other processes can tail with `follow` instead of walking the project.
+"""
+import collections
+import json
+import os
+import pathlib
+import threading
+import time
+import warnings
+
+JOURNAL = 'journal.jsonl'
+FIELDS = ['change', 'kind', 'owner', 'name', 'key', 'time']
+
+Event = collections.namedtuple('Event', FIELDS + ['project', 'offset'])
+Event.__doc__ = """
+Change of a project.
+
+change : str
+    "created", "modified" or "deleted".
+kind : str
+    "action", "entity", "module", "message", "template" or "attribute".
+owner : str
+    The object owning modules, messages and attributes, "actions/<id>",
+    "entities/<id>" or "" for the project.
+name : str
+    Id of the action, entity, module, message or template, or the name
+    of the attribute.
+key : str
+    The key set in a module, the keys of nested mappings separated by "/",
+    None for other events.
+time : float
+    Seconds since the epoch.
+project : str
+    Path to the project.
+offset : int
+    Position in the journal after the event, for resuming `follow`, None
+    for events passed to subscribers.
+"""
+
+_subscribers = []
+_lock = threading.Lock()
+
+
+def subscribe(callback, project=None):
+    """Call `callback(event)` on every event, or only on the events of the
+    project at path `project`."""
+    if project is not None:
+        project = str(pathlib.Path(project).absolute())
+    with _lock:
+        _subscribers.append((callback, project))
+    return callback
+
+
+def unsubscribe(callback):
+    with _lock:
+        _subscribers[:] = [s for s in _subscribers if s[0] is not callback]
+
+
+def _owner(obj):
+    from .core import Action, Entity
+    if isinstance(obj, Action):
+        return 'actions/' + str(obj.id)
+    if isinstance(obj, Entity):
+        return 'entities/' + str(obj.id)
+    return ''
+
+
+def emit(obj, change, kind, name, key=None):
+    """Journal an event of an expipe object and pass it to subscribers."""
+    backend = obj._backend
+    record = {
+        'change': change, 'kind': kind, 'owner': _owner(obj),
+        'name': str(name), 'key': None if key is None else str(key),
+        'time': time.time()}
+    project = None
+    # backends without internal files have no journal
+    if hasattr(type(backend), 'internal_path'):
+        journal = backend.internal_path(JOURNAL)
+        project = str(journal.parent.parent.absolute())
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with _lock:
+            try:
+                f = journal.open('a', encoding='utf-8')
+            except FileNotFoundError:
+                journal.parent.mkdir(exist_ok=True)
+                f = journal.open('a', encoding='utf-8')
+            with f:
+                f.write(line)
+    with _lock:
+        subscribers = list(_subscribers)
+    if not subscribers:
+        return
+    event = Event(project=project, offset=None, **record)
+    for callback, subscribed in subscribers:
+        if subscribed is not None and subscribed != project:
+            continue
+        try:
+            callback(event)
+        except Exception as e:
+            # the change is made, a failing subscriber must not undo it
+            warnings.warn('Event subscriber {!r} failed: {!r}'.format(
+                callback, e))
+
+
+def read(project, offset=0):
+    """Events appended to the journal of a project after `offset`.
+
+    Returns
+    -------
+    events : list
+        Complete events, each with the offset after it.
+    offset : int
+        Offset after the last complete event.
+    """
+    project = pathlib.Path(project).absolute()
+    path = project / '.expipe' / JOURNAL
+    events = []
+    try:
+        f = path.open('rb')
+    except FileNotFoundError:
+        return events, offset
+    with f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b'\n'):
+                # being written
+                break
+            offset += len(line)
+            record = json.loads(line.decode('utf-8'))
+            events.append(Event(
+                project=str(project), offset=offset,
+                **{field: record.get(field) for field in FIELDS}))
+    return events, offset
+
+
+def follow(project, offset=0, interval=0.5, timeout=None):
+    """Yield the events of a project as they are appended to its journal.
+
+    Parameters
+    ----------
+    project : str or pathlib.Path
+        Path to the project.
+    offset : int
+        Start after this offset, e.g. the offset of the last event seen,
+        or from the start of the journal.
+    interval : float
+        Seconds between checks for new events.
+    timeout : float
+        Stop after this many seconds without new events, never if None.
+    """
+    path = pathlib.Path(project) / '.expipe' / JOURNAL
+    last_event = time.monotonic()
+    size = None
+    while True:
+        try:
+            current = os.stat(str(path)).st_size
+        except FileNotFoundError:
+            current = 0
+        if current != size:
+            size = current
+            events, offset = read(project, offset)
+            for event in events:
+                yield event
+            if events:
+                last_event = time.monotonic()
+        if timeout is not None and time.monotonic() - last_event >= timeout:
+            return
+        time.sleep(interval)
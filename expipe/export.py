@@ -0,0 +1,345 @@
+"""Streaming export of project metadata to CSV, Parquet or Feather.
+
+Each kind of object is written to its own table in the output directory,
+e.g. "actions.csv" and "entities.csv", and their messages to
+"messages-actions.csv" and "messages-entities.csv". Objects are read in
+chunks, so memory use does not grow with the size of the project. CSV
+only needs the standard library while Parquet and Feather require
+`pyarrow`.
+
+With `incremental=True` only objects whose attributes, modules or
+messages changed since the previous export are read again; the rows of
+all other objects are copied from the previous export.
+"""
+import csv
+import datetime as dt
+import hashlib
+import json
+import os
+import pathlib
+
+from . import parallel
+from .backends.filesystem import (
+    json_dump, json_load, yaml_load, convert_quantities)
+
+FORMATS = {'csv': '.csv', 'parquet': '.parquet', 'feather': '.feather'}
+OBJECT_COLUMNS = [
+    'id', 'type', 'location', 'datetime', 'registered', 'users', 'tags']
+MESSAGE_COLUMNS = ['object', 'id', 'datetime', 'user', 'text']
+STAT_THREADS = 8
+LIST_COLUMNS = ['users', 'tags', 'entities']
+DATETIME_COLUMNS = ['datetime', 'registered']
+STATE_FILE = 'export-state.json'
+
+
+def _object_columns(kind, fields):
+    columns = list(OBJECT_COLUMNS)
+    if kind == 'actions':
+        columns.append('entities')
+    return columns + list(fields) + ['other']
+
+
+def _encode(value):
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(convert_quantities(value), default=str)
+
+
+def _get_field(path, field):
+    module, *keys = field.split('/')
+    module_path = path / 'modules' / (module + '.yaml')
+    try:
+        value = yaml_load(module_path)
+    except FileNotFoundError:
+        return None
+    for key in keys:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return _encode(value)
+
+
+def _read_object(item):
+    """Read the rows of an object and its messages, run in workers."""
+    kind, name, path, fields, messages = item
+    path = pathlib.Path(path)
+    try:
+        attributes = yaml_load(path / 'attributes.yaml') or {}
+    except FileNotFoundError:
+        return name, None, []
+    columns = _object_columns(kind, fields)
+    row = []
+    for column in columns:
+        if column == 'id':
+            row.append(name)
+        elif column == 'other':
+            other = {
+                key: value for key, value in attributes.items()
+                if key not in columns}
+            row.append(_encode(other) if other else None)
+        elif column in fields:
+            row.append(_get_field(path, column))
+        elif column in LIST_COLUMNS:
+            row.append(list(attributes.get(column) or []))
+        else:
+            row.append(attributes.get(column))
+    message_rows = []
+    if messages:
+        messages_path = path / 'messages'
+        for message_path in sorted(messages_path.glob('*.yaml')):
+            message = yaml_load(message_path) or {}
+            message_rows.append([
+                name, message_path.stem, message.get('datetime'),
+                message.get('user'), message.get('text')])
+    return name, row, message_rows
+
+
+def _stat_fingerprint(path):
+    stats = []
+    try:
+        st = os.stat(path / 'attributes.yaml')
+    except FileNotFoundError:
+        return None
+    stats.append(('attributes.yaml', st.st_mtime_ns, st.st_size))
+    for sub in ['modules', 'messages']:
+        try:
+            entries = os.scandir(path / sub)
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                st = entry.stat()
+                stats.append((sub + '/' + entry.name, st.st_mtime_ns, st.st_size))
+    return hashlib.sha1(repr(sorted(stats)).encode()).hexdigest()
+
+
+def _fingerprint(item):
+    name, path = item
+    return name, _stat_fingerprint(pathlib.Path(path))
+
+
+class _CsvTable:
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self._file = path.open('w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(columns)
+
+    def write(self, rows):
+        for row in rows:
+            self._writer.writerow([
+                '' if value is None else
+                json.dumps(value) if column in LIST_COLUMNS else value
+                for column, value in zip(self.columns, row)])
+
+    def copy(self, path, key, skip):
+        index = self.columns.index(key)
+        count = 0
+        with path.open('r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            if next(reader, None) != self.columns:
+                raise ValueError('Columns of "{}" changed'.format(path))
+            for row in reader:
+                if row[index] not in skip:
+                    self._writer.writerow(row)
+                    count += 1
+        return count
+
+    def close(self):
+        self._file.close()
+
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+    fields = []
+    for column in columns:
+        if column in LIST_COLUMNS:
+            type_ = pa.list_(pa.string())
+        elif column in DATETIME_COLUMNS:
+            type_ = pa.timestamp('ms')
+        else:
+            type_ = pa.string()
+        fields.append(pa.field(column, type_))
+    return pa.schema(fields)
+
+
+def _parse_datetime(value):
+    from .core import datetime_format
+    try:
+        return dt.datetime.strptime(value, datetime_format)
+    except (TypeError, ValueError):
+        return None
+
+
+class _ArrowTable:
+    def __init__(self, path, columns, format):
+        import pyarrow as pa
+        import pyarrow.parquet
+        self.path = path
+        self.columns = columns
+        self.format = format
+        self.schema = _arrow_schema(columns)
+        if format == 'parquet':
+            self._writer = pyarrow.parquet.ParquetWriter(str(path), self.schema)
+        else:
+            self._writer = pa.ipc.new_file(str(path), self.schema)
+
+    def write(self, rows):
+        import pyarrow as pa
+        if not rows:
+            return
+        arrays = []
+        for i, column in enumerate(self.columns):
+            values = [row[i] for row in rows]
+            if column in DATETIME_COLUMNS:
+                values = [_parse_datetime(value) for value in values]
+            elif column not in LIST_COLUMNS:
+                values = [None if v is None else str(v) for v in values]
+            arrays.append(pa.array(values, type=self.schema.field(column).type))
+        self._writer.write_batch(
+            pa.RecordBatch.from_arrays(arrays, schema=self.schema))
+
+    def _batches(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet
+        if self.format == 'parquet':
+            source = pyarrow.parquet.ParquetFile(str(path))
+            if source.schema_arrow != self.schema:
+                raise ValueError('Columns of "{}" changed'.format(path))
+            yield from source.iter_batches()
+        else:
+            with pa.memory_map(str(path)) as source:
+                reader = pa.ipc.open_file(source)
+                if reader.schema != self.schema:
+                    raise ValueError('Columns of "{}" changed'.format(path))
+                for i in range(reader.num_record_batches):
+                    yield reader.get_batch(i)
+
+    def copy(self, path, key, skip):
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        skip = pa.array(sorted(skip), type=pa.string())
+        count = 0
+        for batch in self._batches(path):
+            batch = batch.filter(pc.invert(pc.is_in(batch[key], value_set=skip)))
+            if batch.num_rows > 0:
+                self._writer.write_batch(batch)
+                count += batch.num_rows
+        return count
+
+    def close(self):
+        self._writer.close()
+
+
+def _open_table(path, columns, format):
+    if format == 'csv':
+        return _CsvTable(path, columns)
+    return _ArrowTable(path, columns, format)
+
+
+def export(project, path, format='csv', fields=None, messages=True,
+           incremental=False, chunk_size=1000, jobs=None):
+    """Export the attributes, messages and selected module fields of all
+    actions and entities of a project.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    path : str or pathlib.Path
+        Output directory.
+    format : str
+        "csv", "parquet" or "feather".
+    fields : list
+        Module fields to include as columns given as
+        "module/key/subkey". Values that are not strings are JSON encoded.
+    messages : bool
+        Also export the messages of all objects.
+    incremental : bool
+        Only read objects that changed since the last export to `path`.
+    chunk_size : int
+        Number of objects read and written at a time.
+    jobs : int
+        Number of processes reading objects.
+
+    Returns
+    -------
+    counts : dict
+        Number of objects read and copied from the previous export per
+        table.
+    """
+    if format not in FORMATS:
+        raise ValueError(
+            'Expected "format" to be one of {} got "{}"'.format(
+                list(FORMATS), format))
+    fields = list(fields or [])
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    options = {'format': format, 'fields': fields, 'messages': messages}
+    state = json_load(path / STATE_FILE, {}) if incremental else {}
+    if state.get('options') != options:
+        state = {}
+    new_state = {'options': options}
+    counts = {}
+    for kind in ['actions', 'entities']:
+        previous = state.get(kind, {})
+        objects_path = pathlib.Path(project.path) / kind
+        fingerprints = dict(parallel.imap(
+            _fingerprint,
+            ((name, str(objects_path / name)) for name in getattr(project, kind)),
+            jobs=STAT_THREADS, threads=True))
+        fingerprints = {k: v for k, v in fingerprints.items() if v is not None}
+        changed = set(
+            name for name, fingerprint in fingerprints.items()
+            if previous.get(name) != fingerprint)
+        skip = changed | (set(previous) - set(fingerprints))
+        tables = {kind: _object_columns(kind, fields)}
+        if messages:
+            tables['messages-' + kind] = MESSAGE_COLUMNS
+        if not all((path / (t + FORMATS[format])).exists() for t in tables):
+            previous = {}
+        writers = {}
+        copied = 0
+        try:
+            for table, columns in tables.items():
+                table_path = path / (table + FORMATS[format])
+                tmp_path = table_path.with_name(table_path.name + '.tmp')
+                writers[table] = _open_table(tmp_path, columns, format)
+                if previous:
+                    key = 'id' if table == kind else 'object'
+                    count = writers[table].copy(table_path, key, skip)
+                    copied += count if table == kind else 0
+            items = (
+                (kind, name, str(objects_path / name), fields, messages)
+                for name in fingerprints if name in changed or not previous)
+            rows = []
+            message_rows = []
+            read = 0
+            for name, row, object_messages in parallel.imap(
+                    _read_object, items, jobs=jobs):
+                if row is None:
+                    continue
+                rows.append(row)
+                message_rows.extend(object_messages)
+                read += 1
+                if len(rows) >= chunk_size:
+                    writers[kind].write(rows)
+                    if messages:
+                        writers['messages-' + kind].write(message_rows)
+                    rows, message_rows = [], []
+            writers[kind].write(rows)
+            if messages:
+                writers['messages-' + kind].write(message_rows)
+        except BaseException:
+            for writer in writers.values():
+                writer.close()
+                writer.path.unlink()
+            raise
+        for writer in writers.values():
+            writer.close()
+        for table, writer in writers.items():
+            os.replace(writer.path, path / (table + FORMATS[format]))
+        new_state[kind] = fingerprints
+        counts[kind] = {'read': read, 'copied': copied}
+    json_dump(path / STATE_FILE, new_state)
+    return counts
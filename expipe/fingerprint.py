@@ -0,0 +1,96 @@
+"""Fingerprints of functions and of the inputs they read from actions.
+
+A fingerprint is the SHA-256 digest of a canonical JSON encoding of its
+parts. Results computed from an action can be reused as long as the
+fingerprint of the function and of the inputs is unchanged.
+"""
+import functools
+import hashlib
+import inspect
+import json
+
+import numpy as np
+
+from .datafiles import file_hash, path_info
+
+
+def _default(value):
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes())
+        return ['ndarray', value.dtype.str, value.shape, digest.hexdigest()]
+    if hasattr(value, 'magnitude') and hasattr(value, 'units'):
+        return ['quantity', value.magnitude, str(value.units)]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=repr)
+    return repr(value)
+
+
+def fingerprint(*parts):
+    """SHA-256 digest of the parts, which are encoded as sorted JSON."""
+    text = json.dumps(
+        parts, sort_keys=True, default=_default, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def function_fingerprint(func):
+    """Fingerprint of the name and source code of a function, and of the
+    arguments bound by `functools.partial`."""
+    if isinstance(func, functools.partial):
+        return fingerprint(
+            function_fingerprint(func.func), func.args, func.keywords)
+    func = inspect.unwrap(func)
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        code = getattr(func, '__code__', None)
+        if code is None:
+            source = repr(func)
+        else:
+            source = [code.co_code.hex(), repr(code.co_consts)]
+    return fingerprint(
+        getattr(func, '__module__', None), getattr(func, '__qualname__', None),
+        source)
+
+
+def action_inputs(action, modules=(), data=True):
+    """Summary of the inputs of an action, changing whenever they change.
+
+    Parameters
+    ----------
+    action : expipe.core.Action
+    modules : list
+        Names of modules read, summarized by the digest of their files.
+    data : bool
+        Include the size and mtime of every registered data file.
+
+    Returns
+    -------
+    inputs : dict
+        The attributes, module digests and data file sizes and mtimes,
+        missing modules and data are None.
+    """
+    inputs = {'attributes': action.attributes}
+    backend = action._backend.modules
+    digests = {}
+    for name in modules:
+        try:
+            digests[name] = file_hash(backend.named_path(name))
+        except FileNotFoundError:
+            digests[name] = None
+    inputs['modules'] = digests
+    if data:
+        infos = {}
+        for key, path in (inputs['attributes'].get('data') or {}).items():
+            try:
+                infos[key] = path_info(action.data_path() / path, checksum=False)
+            except FileNotFoundError:
+                infos[key] = None
+        inputs['data'] = infos
+    return inputs
+
+
+def action_fingerprint(action, modules=(), data=True):
+    """Fingerprint of the inputs of an action, see `action_inputs`."""
+    return fingerprint(action_inputs(action, modules=modules, data=data))
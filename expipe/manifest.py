@@ -0,0 +1,528 @@
+"""Checksum manifest of the files of a project.
+
+The manifest records size, mtime and SHA-256 of every file in a project,
+except the internal files in ".expipe". It is stored as a snapshot in
+".expipe/manifest.json" and an append-only log of later changes in
+".expipe/manifest.jsonl". Once a manifest has been built, every file
+expipe writes or deletes in the project is appended to the log, so that
+verifying the project only has to hash files that were changed by other
+means.
+
+The log is appended to and compacted into the snapshot under a lock on
+".expipe/manifest.lock", so that changes recorded by other processes
+meanwhile are not lost.
+
+Every change has a sequence number, increasing with each change recorded
+in the manifest. A state token "<manifest id>:<seq>" identifies the state
+of a project, and the changes made after it are found by comparing the
+sequence numbers in the manifest instead of walking the project.
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import pathlib
+import threading
+import uuid
+
+from . import parallel
+from .backends import filesystem
+from .backends.filesystem import json_dump, json_load
+from .datafiles import file_hash, PARTIAL_SUFFIX
+
+SNAPSHOT = 'manifest.json'
+LOG = 'manifest.jsonl'
+LOCK = 'manifest.lock'
+IGNORED = frozenset(['.expipe', '.git'])
+# entries in the manifest
+SIZE, MTIME, DIGEST, SEQ, CREATED = range(5)
+# problems that indicate damage rather than changes
+DAMAGE = frozenset(['missing', 'corrupt', 'malformed'])
+
+CATEGORIES = [
+    'actions', 'entities', 'modules', 'messages', 'data', 'templates', 'other']
+
+Problem = collections.namedtuple('Problem', ['path', 'status', 'detail'])
+ChangeSet = collections.namedtuple('ChangeSet', ['created', 'modified', 'deleted'])
+Changes = collections.namedtuple('Changes', ['token'] + CATEGORIES)
+
+
+@contextlib.contextmanager
+def _file_lock(path):
+    """Exclusive lock between processes, where fcntl is available."""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class Manifest:
+    """
+    The manifest of a project.
+
+    Attributes
+    ----------
+    files : dict
+        Mapping of paths relative to the project, with "/" separators, to
+        [size, mtime, sha256, seq, created] lists, where seq and created are
+        the sequence numbers of the latest write and of the creation.
+    deleted : dict
+        Mapping of deleted paths to the sequence numbers of the deletion
+        and of the creation.
+    seq : int
+        Sequence number of the latest change.
+    id : str
+        Identifies the manifest, changes when it is rebuilt.
+    """
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+        internal = self.root / '.expipe'
+        self.snapshot_path = internal / SNAPSHOT
+        self.log_path = internal / LOG
+        self.lock_path = internal / LOCK
+        self.files = {}
+        self.deleted = {}
+        self.seq = 0
+        self.id = None
+        self._lock = threading.Lock()
+        # the log file and the position in it of the changes applied
+        self._log_id = None
+        self._offset = 0
+
+    def exists(self):
+        return self.snapshot_path.exists()
+
+    def load(self):
+        """Read the snapshot and replay the log."""
+        snapshot = json_load(self.snapshot_path, None)
+        if snapshot is None:
+            raise FileNotFoundError(
+                'No manifest in {}'.format(self.snapshot_path))
+        self.id = snapshot['id']
+        self.seq = snapshot['seq']
+        self.files = snapshot['files']
+        self.deleted = snapshot['deleted']
+        self._log_id = None
+        self._offset = 0
+        self._replay()
+        return self
+
+    def _replay(self):
+        """Apply the changes appended to the log after those applied."""
+        try:
+            f = self.log_path.open('rb')
+        except FileNotFoundError:
+            self._log_id = None
+            self._offset = 0
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            log_id = st.st_dev, st.st_ino
+            if self._log_id is not None and log_id != self._log_id:
+                # compacted by another process
+                f.close()
+                self.load()
+                return
+            self._log_id = log_id
+            f.seek(self._offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # being written
+                    break
+                self._offset += len(line)
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted write
+                    continue
+                self._apply(change)
+
+    def _apply(self, change):
+        self.seq += 1
+        rel = change['p']
+        if change.get('x'):
+            prefix = rel + '/'
+            for key in [k for k in self.files if k == rel or k.startswith(prefix)]:
+                entry = self.files.pop(key)
+                self.deleted[key] = [self.seq, entry[CREATED]]
+        else:
+            entry = self.files.get(rel)
+            created = self.seq if entry is None else entry[CREATED]
+            self.files[rel] = [
+                change['s'], change['m'], change['h'], self.seq, created]
+            self.deleted.pop(rel, None)
+
+    @property
+    def token(self):
+        return '{}:{}'.format(self.id, self.seq)
+
+    def save(self, changes=()):
+        """Apply the changes appended to the log by others and then
+        `changes`, write the state as the snapshot and clear the log."""
+        with self._lock, _file_lock(self.lock_path):
+            if self.exists():
+                self._replay()
+            for change in changes:
+                self._apply(change)
+            json_dump(self.snapshot_path, {
+                'id': self.id, 'seq': self.seq, 'files': self.files,
+                'deleted': self.deleted})
+            try:
+                self.log_path.unlink()
+            except FileNotFoundError:
+                pass
+            self._log_id = None
+            self._offset = 0
+
+    def relative(self, path):
+        """Path relative to the project with "/" separators, or None."""
+        try:
+            rel = pathlib.Path(path).relative_to(self.root)
+        except ValueError:
+            return None
+        if not rel.parts or rel.parts[0] in IGNORED:
+            return None
+        return rel.as_posix()
+
+    def record(self, path, digest=None, deleted=False):
+        """Append a write or deletion of a file to the log."""
+        rel = self.relative(path)
+        if rel is None:
+            return
+        if deleted:
+            change = {'p': rel, 'x': 1}
+        else:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                return
+            if os.path.isdir(path):
+                return
+            if digest is None:
+                digest = file_hash(path)
+            change = {
+                'p': rel, 's': st.st_size, 'm': st.st_mtime_ns, 'h': digest}
+        line = json.dumps(change, separators=(',', ':')) + '\n'
+        with self._lock, _file_lock(self.lock_path):
+            self._replay()
+            with self.log_path.open('ab') as f:
+                f.write(line.encode('utf-8'))
+                st = os.fstat(f.fileno())
+                self._log_id = st.st_dev, st.st_ino
+                self._offset = f.tell()
+            self._apply(change)
+
+
+_tracked = {}
+_tracked_lock = threading.Lock()
+
+
+def _on_change(path, digest, deleted):
+    path = pathlib.Path(path)
+    for root, manifest in list(_tracked.items()):
+        if root not in path.parents:
+            continue
+        try:
+            manifest.record(path, digest=digest, deleted=deleted)
+        except FileNotFoundError:
+            # the manifest was removed
+            _tracked.pop(root, None)
+
+
+def track(root):
+    """Record the files expipe writes in the project at `root` in its
+    manifest, if it has one."""
+    root = pathlib.Path(root).absolute()
+    with _tracked_lock:
+        if root in _tracked:
+            return _tracked[root]
+        manifest = Manifest(root)
+        if not manifest.exists():
+            return None
+        _tracked[root] = manifest
+        filesystem.add_change_hook(_on_change)
+    return manifest
+
+
+def _walk(root):
+    """Yield (relative path, absolute path, stat) of all project files."""
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with entries:
+            for entry in entries:
+                name = rel + '/' + entry.name if rel else entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORED:
+                        stack.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    if entry.name.endswith(PARTIAL_SUFFIX):
+                        continue
+                    try:
+                        yield name, entry.path, entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+
+def _check_file(item):
+    """Hash a file and parse it if it is YAML, run in worker processes."""
+    rel, path = item
+    try:
+        st = os.stat(path)
+        if not rel.endswith('.yaml'):
+            return rel, st.st_size, st.st_mtime_ns, file_hash(path), None
+        with open(path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        return rel, None, None, None, None
+    error = None
+    try:
+        filesystem.yaml.YAML(typ='safe', pure=True).load(content.decode('utf-8'))
+    except Exception as e:
+        error = '{}: {}'.format(type(e).__name__, str(e).splitlines()[0]
+                                if str(e) else '')
+    return (rel, st.st_size, st.st_mtime_ns,
+            hashlib.sha256(content).hexdigest(), error)
+
+
+def build(project, jobs=None):
+    """Hash all files of a project into a new manifest.
+
+    Returns
+    -------
+    problems : list
+        Malformed YAML files found while building.
+    """
+    manifest = Manifest(project.path)
+    manifest.id = uuid.uuid4().hex
+    items = ((rel, path) for rel, path, st in _walk(str(manifest.root)))
+    problems = []
+    for rel, size, mtime, digest, error in parallel.imap(
+            _check_file, items, jobs=jobs):
+        if size is None:
+            continue
+        manifest.seq += 1
+        manifest.files[rel] = [size, mtime, digest, manifest.seq, manifest.seq]
+        if error is not None:
+            problems.append(Problem(rel, 'malformed', error))
+    manifest.save()
+    _tracked.pop(manifest.root.absolute(), None)
+    track(manifest.root)
+    return problems
+
+
+def verify(project, full=False, yaml=False, jobs=None, update=True):
+    """Check the files of a project against its manifest.
+
+    Files are stat'ed and only those whose size or mtime differs from
+    the manifest are hashed, unless `full`. Hashed YAML files are also
+    parsed. A manifest is built first if the project has none.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    full : bool
+        Hash and parse all files.
+    yaml : bool
+        Hash and parse all YAML files, but only hash the data files whose
+        size or mtime changed.
+    jobs : int
+        Number of processes hashing files, 0 uses all CPUs.
+    update : bool
+        Record new, modified and deleted files in the manifest. Corrupt
+        files are kept with their recorded checksum.
+
+    Yields
+    ------
+    problem : Problem
+        (path, status, detail) where status is "new", "modified",
+        "missing", "corrupt" (content changed while size and mtime did
+        not) or "malformed" (YAML that cannot be parsed).
+    """
+    manifest = Manifest(project.path)
+    if not manifest.exists():
+        yield from build(project, jobs=jobs)
+        return
+    manifest.load()
+    seen = set()
+    changes = []
+
+    def candidates():
+        for rel, path, st in _walk(str(manifest.root)):
+            seen.add(rel)
+            entry = manifest.files.get(rel)
+            if (full or entry is None or
+                    yaml and rel.endswith('.yaml') or
+                    entry[SIZE] != st.st_size or
+                    entry[MTIME] != st.st_mtime_ns):
+                yield rel, path
+
+    for rel, size, mtime, digest, error in parallel.imap(
+            _check_file, candidates(), jobs=jobs):
+        if size is None:
+            continue
+        entry = manifest.files.get(rel)
+        if error is not None:
+            yield Problem(rel, 'malformed', error)
+        if entry is None:
+            yield Problem(rel, 'new', '')
+        elif entry[DIGEST] != digest:
+            if (entry[SIZE], entry[MTIME]) == (size, mtime):
+                yield Problem(rel, 'corrupt', 'checksum differs')
+                continue
+            yield Problem(rel, 'modified', '')
+        elif (entry[SIZE], entry[MTIME]) == (size, mtime):
+            continue
+        changes.append({'p': rel, 's': size, 'm': mtime, 'h': digest})
+    for rel in sorted(set(manifest.files) - seen):
+        yield Problem(rel, 'missing', '')
+        changes.append({'p': rel, 'x': 1})
+    if update and (changes or manifest.log_path.exists()):
+        # also compacts the log of changes recorded by expipe
+        manifest.save(changes)
+
+
+def categorize(rel):
+    """The category and name of a project file.
+
+    Actions and entities are named by their id, modules and messages by
+    (owner, name) where the owner is "actions/<id>", "entities/<id>" or ""
+    for the project, and data files by (action id, path in the data
+    directory).
+    """
+    parts = rel.split('/')
+    stem = parts[-1].rsplit('.', 1)[0]
+    if parts[0] in ('actions', 'entities') and len(parts) == 2:
+        # the directory of an action or entity
+        return parts[0], parts[1]
+    if parts[0] in ('actions', 'entities') and len(parts) > 2:
+        owner = '/'.join(parts[:2])
+        if parts[2:] == ['attributes.yaml']:
+            return parts[0], parts[1]
+        if parts[2] in ('modules', 'messages') and len(parts) == 4:
+            return parts[2], (owner, stem)
+        if parts[0] == 'actions' and parts[2] == 'data' and len(parts) > 3:
+            return 'data', (parts[1], '/'.join(parts[3:]))
+    elif parts[0] == 'modules' and len(parts) == 2:
+        return 'modules', ('', stem)
+    elif parts[0] == 'templates' and len(parts) == 2:
+        return 'templates', stem
+    return 'other', rel
+
+
+def _parse_token(token):
+    manifest_id, _, seq = str(token).rpartition(':')
+    try:
+        return manifest_id, int(seq)
+    except ValueError:
+        raise ValueError('Malformed state token "{}"'.format(token))
+
+
+def changes(manifest, token=None):
+    """Categorized changes recorded in a manifest after a state token.
+
+    Returns
+    -------
+    changes : Changes
+        The current token and a `ChangeSet` of sorted names per category.
+        Files both created and deleted after the token are left out.
+    """
+    since = 0
+    if token is not None:
+        manifest_id, since = _parse_token(token)
+        if manifest_id != manifest.id:
+            raise ValueError(
+                'State token "{}" is from another manifest, the project '
+                'was rebuilt or is another project'.format(token))
+    sets = {category: ChangeSet(set(), set(), set()) for category in CATEGORIES}
+    for rel, entry in manifest.files.items():
+        if entry[SEQ] <= since:
+            continue
+        category, name = categorize(rel)
+        if entry[CREATED] > since:
+            sets[category].created.add(name)
+        else:
+            sets[category].modified.add(name)
+    for rel, (seq, created) in manifest.deleted.items():
+        if seq <= since or created > since:
+            continue
+        category, name = categorize(rel)
+        sets[category].deleted.add(name)
+    return Changes(manifest.token, **{
+        category: ChangeSet(*(sorted(names) for names in changed))
+        for category, changed in sets.items()})
+
+
+def _load(project, jobs=None):
+    manifest = Manifest(project.path)
+    if not manifest.exists():
+        build(project, jobs=jobs)
+    return manifest.load()
+
+
+def state_token(project):
+    """Token identifying the current state of a project, building its
+    manifest if it has none."""
+    return _load(project).token
+
+
+def changes_since(project, token=None, refresh=False, jobs=None):
+    """Actions, entities, modules, messages and data files created,
+    modified or deleted since a state token.
+
+    Changes made through expipe are recorded in the manifest as they are
+    made. Files changed by other means, e.g. copied by rsync, are only
+    found after `verify` has updated the manifest, which `refresh` does
+    first.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    token : str
+        Token returned by `state_token` or a previous call, None for all
+        files.
+    refresh : bool
+        Update the manifest with files changed outside expipe first.
+    jobs : int
+        Number of processes hashing files when refreshing.
+
+    Returns
+    -------
+    changes : Changes
+        Sorted names created, modified and deleted per category, and the
+        token of the current state.
+    """
+    if refresh:
+        for problem in verify(project, jobs=jobs, update=True):
+            pass
+    return changes(_load(project, jobs=jobs), token)
+
+
+def diff(path_a, path_b):
+    """Compare the cached manifests of two project directories.
+
+    Returns
+    -------
+    created, modified, deleted : list
+        Sorted paths only in b, in both with different checksums and only
+        in a.
+    """
+    a = Manifest(path_a).load().files
+    b = Manifest(path_b).load().files
+    created = sorted(set(b) - set(a))
+    deleted = sorted(set(a) - set(b))
+    modified = sorted(
+        rel for rel in set(a) & set(b) if a[rel][DIGEST] != b[rel][DIGEST])
+    return created, modified, deleted
@@ -0,0 +1,66 @@
+import collections
+import concurrent.futures
+import itertools
+import os
+
+
+def _apply_chunk(func, chunk):
+    return [func(item) for item in chunk]
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def imap(func, iterable, jobs=None, chunksize=16, threads=False):
+    """Lazily apply a function to all items of an iterable.
+
+    Results are yielded in order as soon as they are ready. With more than
+    one job the items are sent in chunks to a pool of worker processes
+    (or threads), keeping only a bounded number of chunks in flight so that
+    neither the input nor the output is held in memory.
+
+    Parameters
+    ----------
+    func : callable
+        Function to apply, must be picklable when using processes.
+    iterable : iterable
+        Items to apply the function to.
+    jobs : int
+        Number of workers, `None` or 1 runs in the current process and
+        0 uses one worker per CPU.
+    chunksize : int
+        Number of items sent to a worker at a time.
+    threads : bool
+        Use threads instead of processes, suitable for I/O bound functions.
+    """
+    if jobs is None or jobs == 1:
+        for item in iterable:
+            yield func(item)
+        return
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    if threads:
+        executor = concurrent.futures.ThreadPoolExecutor(jobs)
+    else:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+    max_pending = jobs * 2
+    pending = collections.deque()
+    try:
+        for chunk in _chunks(iterable, chunksize):
+            pending.append(executor.submit(_apply_chunk, func, chunk))
+            while len(pending) >= max_pending or (pending and pending[0].done()):
+                for result in pending.popleft().result():
+                    yield result
+        while pending:
+            for result in pending.popleft().result():
+                yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,82 @@
+import datetime as dt
+import json
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return [value]
+    return list(value)
+
+
+def parse_datetime(value):
+    """Parse a date or datetime given as a string, e.g. "2020-01-31" or
+    "2020-01-31T12:00:00".
+    """
+    if value is None or isinstance(value, dt.datetime):
+        return value
+    if isinstance(value, dt.date):
+        return dt.datetime(value.year, value.month, value.day)
+    return dt.datetime.fromisoformat(value)
+
+
+class AttributeFilter:
+    """
+    Picklable predicate on the attributes of actions or entities.
+
+    List attributes (tags, users, entities) must contain all given values,
+    while location and type must match one of the given values. The
+    datetime must be within [since, until).
+    """
+    def __init__(self, tags=None, users=None, entities=None, location=None,
+                 type=None, since=None, until=None):
+        self.lists = {
+            key: set(_as_list(value)) for key, value in
+            [('tags', tags), ('users', users), ('entities', entities)]
+            if value
+        }
+        self.choices = {
+            key: set(_as_list(value)) for key, value in
+            [('location', location), ('type', type)] if value
+        }
+        self.since = parse_datetime(since)
+        self.until = parse_datetime(until)
+        from .core import datetime_format
+        self._datetime_format = datetime_format
+
+    def __bool__(self):
+        return bool(self.lists or self.choices or self.since or self.until)
+
+    def __call__(self, attributes):
+        for key, values in self.lists.items():
+            if not values.issubset(attributes.get(key) or []):
+                return False
+        for key, values in self.choices.items():
+            if attributes.get(key) not in values:
+                return False
+        if self.since is not None or self.until is not None:
+            dtime = attributes.get('datetime')
+            if dtime is None:
+                return False
+            dtime = dt.datetime.strptime(dtime, self._datetime_format)
+            if self.since is not None and dtime < self.since:
+                return False
+            if self.until is not None and dtime >= self.until:
+                return False
+        return True
+
+
+def select_columns(name, attributes, columns):
+    """Return a row of the given columns, "id" is the object name."""
+    return [name if column == 'id' else attributes.get(column)
+            for column in columns]
+
+
+def format_cell(value):
+    """Format a value for a text cell, lists and dicts are JSON encoded."""
+    if value is None:
+        return ''
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return str(value)
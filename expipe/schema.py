@@ -0,0 +1,200 @@
+"""Validation of module contents against the schema of a template.
+
+A template may declare a schema under the "schema" key, mapping paths of
+keys separated by "/" to the expected type, unit, allowed values and
+whether the key is required::
+
+    identifier: electrophysiology
+    schema:
+      depth: {type: quantity, unit: um, required: true}
+      location/region: {type: str, values: [MEC, LEC, CA1]}
+      channels: {type: int}
+
+Other values of the "schema" key, such as mappings not using any of the
+keys above, are ordinary template contents, and unknown keys in a schema
+are errors. The schema is compiled once into a `Validator`, which checks
+module contents as they are stored, without reconstructing quantities.
+"""
+import collections
+
+from . import parallel
+from .backends.filesystem import yaml_load, _parse_unit, _is_quantity_dict
+
+SCHEMA_KEY = 'schema'
+TYPES = {
+    'str': (str,),
+    'int': (int,),
+    'float': (int, float),
+    'bool': (bool,),
+    'list': (list,),
+    'dict': (dict,),
+    'quantity': (dict,),
+}
+SPEC_KEYS = ['type', 'unit', 'required', 'values']
+
+Violation = collections.namedtuple(
+    'Violation', ['action', 'module', 'path', 'message'])
+
+_MISSING = object()
+
+
+def _normalize_unit(unit):
+    units = _parse_unit(unit) if isinstance(unit, str) else None
+    return unit if units is None else units.string
+
+
+class Validator:
+    """
+    Compiled schema of a template.
+
+    Calling the validator with the contents of a module returns a list of
+    (path, message) tuples, one per violation.
+    """
+    def __init__(self, schema):
+        self.rules = []
+        for path, spec in schema.items():
+            spec = spec or {}
+            unknown = set(spec) - set(SPEC_KEYS)
+            if unknown:
+                raise ValueError(
+                    'Unknown keys {} in schema of "{}", expected {}'.format(
+                        sorted(unknown), path, SPEC_KEYS))
+            type_name = spec.get('type')
+            unit = spec.get('unit')
+            if type_name is None and unit is not None:
+                type_name = 'quantity'
+            if type_name is not None and type_name not in TYPES:
+                raise ValueError(
+                    'Unknown type "{}" in schema of "{}", expected one '
+                    'of {}'.format(type_name, path, list(TYPES)))
+            values = spec.get('values')
+            self.rules.append((
+                path, tuple(str(path).split('/')), type_name,
+                None if unit is None else _normalize_unit(unit),
+                bool(spec.get('required', False)),
+                None if values is None else list(values)))
+
+    def __call__(self, contents):
+        violations = []
+        for path, keys, type_name, unit, required, values in self.rules:
+            value = contents
+            for key in keys:
+                if not isinstance(value, dict) or key not in value:
+                    value = _MISSING
+                    break
+                value = value[key]
+            if value is _MISSING:
+                if required:
+                    violations.append((path, 'missing required key'))
+                continue
+            if value is None:
+                continue
+            message = self._check(value, type_name, unit, values)
+            if message is not None:
+                violations.append((path, message))
+        return violations
+
+    @staticmethod
+    def _check(value, type_name, unit, values):
+        if type_name is not None:
+            types = TYPES[type_name]
+            if (not isinstance(value, types) or
+                    type_name in ['int', 'float'] and isinstance(value, bool)):
+                return 'expected {} got {}'.format(
+                    type_name, type(value).__name__)
+            if type_name == 'dict' and _is_quantity_dict(value):
+                return 'expected dict got quantity'
+            if type_name == 'quantity' and not _is_quantity_dict(value):
+                return 'expected quantity got dict without "value" and "unit"'
+        if unit is not None:
+            if not _is_quantity_dict(value):
+                return 'expected quantity in "{}" got {}'.format(
+                    unit, type(value).__name__)
+            value_unit = value.get('unit')
+            if value_unit != unit and _normalize_unit(value_unit) != unit:
+                return 'expected unit "{}" got "{}"'.format(unit, value_unit)
+        if values is not None:
+            checked = value['value'] if _is_quantity_dict(value) else value
+            if checked not in values:
+                return 'expected one of {} got {!r}'.format(values, checked)
+        return None
+
+
+def template_schema(contents):
+    """The schema declared in the contents of a template, or None.
+
+    The "schema" key is a schema when it maps paths to mappings and any of
+    them uses the keys in `SPEC_KEYS`, otherwise it is ordinary template
+    contents. Unknown keys in a schema raise ValueError, so that a typo
+    does not turn off validation.
+    """
+    schema = contents.get(SCHEMA_KEY)
+    if not isinstance(schema, dict) or not schema:
+        return None
+    if not all(isinstance(spec, dict) for spec in schema.values()):
+        return None
+    if not any(set(spec) & set(SPEC_KEYS) for spec in schema.values()):
+        return None
+    for path, spec in schema.items():
+        unknown = set(spec) - set(SPEC_KEYS)
+        if unknown:
+            raise ValueError(
+                'Unknown keys {} in schema of "{}", expected {}'.format(
+                    sorted(unknown), path, SPEC_KEYS))
+    return schema
+
+
+def compile_schema(schema):
+    """Compile the schema of a template into a `Validator`."""
+    return Validator(schema or {})
+
+
+def _validate_module(item):
+    """Validate the module of an action, run in workers."""
+    name, module, path, validator = item
+    try:
+        contents = yaml_load(path, convert=False)
+    except FileNotFoundError:
+        return []
+    if not isinstance(contents, dict):
+        return [Violation(name, module, '', 'expected a mapping')]
+    return [
+        Violation(name, module, path_, message)
+        for path_, message in validator(contents)]
+
+
+def validate(project, template, actions=None, jobs=None):
+    """Check the modules derived from a template against its schema.
+
+    Modules are derived from a template when they are named by its
+    identifier. Actions without such a module are skipped.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    template : str
+        Name of the template.
+    actions : list
+        Names of the actions to check, all actions if None.
+    jobs : int
+        Number of processes reading modules.
+
+    Yields
+    ------
+    violation : Violation
+        (action, module, path, message) for every violation, in the order
+        of the actions.
+    """
+    contents = project.templates[template].contents
+    module = contents.get('identifier')
+    if module is None:
+        raise ValueError('Template "' + template + '" has no identifier.')
+    validator = compile_schema(template_schema(contents))
+    actions = project.actions if actions is None else actions
+    actions_path = project.path / 'actions'
+    items = (
+        (name, module, actions_path / name / 'modules' / (module + '.yaml'),
+         validator)
+        for name in actions)
+    for violations in parallel.imap(_validate_module, items, jobs=jobs):
+        yield from violations
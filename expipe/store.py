@@ -0,0 +1,216 @@
+"""Content-addressed store for deduplicating action data.
+
+Files are stored once under `.expipe/objects/ab/cdef...`, named by their
+SHA-256 digest, and the data files of actions are hard links to them.
+A stored file is the same file as the data files linking to it, so
+modifying one in place modifies every action linking to it; replace such
+files instead of editing them. Files on another file system than the
+project, such as data directories linked to other volumes, cannot be
+linked and are left as they are.
+"""
+import collections
+import errno
+import os
+import pathlib
+
+from . import parallel
+from .backends.filesystem import json_dump, json_load, notify_change
+from .datafiles import file_hash
+
+HASH_CACHE = 'hash-cache.json'
+
+DedupResult = collections.namedtuple(
+    'DedupResult', ['files', 'unique', 'linked', 'saved', 'skipped'])
+
+
+class ObjectStore:
+    """
+    Content-addressed store in a directory, usually ".expipe/objects" of
+    a project, see `project_store`.
+    """
+    def __init__(self, path):
+        self.path = pathlib.Path(path)
+
+    def object_path(self, digest):
+        return self.path / digest[:2] / digest[2:]
+
+    def __contains__(self, digest):
+        return self.object_path(digest).exists()
+
+    def add(self, path, digest=None):
+        """Store a file and replace it with a link to the stored copy.
+
+        Returns
+        -------
+        saved : int
+            Number of bytes saved, i.e. the size of the file if an
+            identical file was already stored and 0 otherwise. None if
+            the file is on another file system than the store and was
+            left as it is.
+        """
+        path = pathlib.Path(path)
+        digest = digest or file_hash(path)
+        object_path = self.object_path(digest)
+        st = os.stat(path)
+        try:
+            object_st = os.stat(object_path)
+        except FileNotFoundError:
+            object_st = None
+        try:
+            if object_st is None:
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                os.link(path, object_path)
+                return 0
+            if (object_st.st_dev, object_st.st_ino) == (st.st_dev, st.st_ino):
+                return 0
+            # link next to the file and rename over it, so that the file
+            # is never missing
+            tmp_path = path.with_name(
+                path.name + '.dedup-{}'.format(os.getpid()))
+            os.link(object_path, tmp_path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            return None
+        os.replace(tmp_path, path)
+        notify_change(path, digest)
+        return st.st_size
+
+    def prune(self):
+        """Remove stored files that no action links to anymore."""
+        removed = 0
+        if not self.path.exists():
+            return removed
+        with os.scandir(self.path) as prefixes:
+            prefixes = [p.path for p in prefixes if p.is_dir()]
+        for prefix in prefixes:
+            with os.scandir(prefix) as entries:
+                for entry in entries:
+                    if entry.stat().st_nlink == 1:
+                        os.unlink(entry.path)
+                        removed += 1
+        return removed
+
+
+def project_store(backend):
+    """The store of the project of a project or action backend."""
+    return ObjectStore(backend.internal_path('objects'))
+
+
+def _hash_file(item):
+    """Hash a file unless the cached digest has the same size and mtime,
+    run in threads."""
+    rel, path, cached = item
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return rel, None, None
+    inode = st.st_dev, st.st_ino
+    if cached is not None and cached[:2] == [st.st_size, st.st_mtime_ns]:
+        return rel, cached, inode
+    return rel, [st.st_size, st.st_mtime_ns, file_hash(path)], inode
+
+
+def _data_files(actions_path):
+    for action in os.scandir(actions_path):
+        data_path = os.path.join(action.path, 'data')
+        for root, dirs, files in os.walk(data_path):
+            for name in files:
+                path = os.path.join(root, name)
+                if os.path.islink(path):
+                    continue
+                yield os.path.relpath(path, actions_path), path
+
+
+def dedup(project, jobs=8, min_size=0, dry_run=False):
+    """Deduplicate the data files of all actions in a project.
+
+    Files are hashed on `jobs` threads, reusing the digests cached by an
+    earlier run for files with the same size and mtime. Every file is
+    then moved to the content-addressed store and replaced by a hard
+    link to it, so identical files share one copy. Files on another file
+    system than the project are skipped. Stored files that no action
+    links to anymore are removed.
+
+    Parameters
+    ----------
+    project : expipe.core.Project
+    jobs : int
+        Number of threads hashing files.
+    min_size : int
+        Only deduplicate files of at least this many bytes.
+    dry_run : bool
+        Only hash files and report the savings.
+
+    Returns
+    -------
+    result : DedupResult
+        Number of files, of unique files, of files replaced by links, the
+        number of bytes saved and the number of files skipped, which is
+        always 0 for dry runs.
+    """
+    store = project_store(project._backend)
+    cache_path = project._backend.internal_path(HASH_CACHE)
+    cache = json_load(cache_path, {})
+    actions_path = pathlib.Path(project.path) / 'actions'
+    items = (
+        (rel, path, cache.get(rel))
+        for rel, path in _data_files(actions_path))
+    new_cache = {}
+    files = []
+    for rel, entry, inode in parallel.imap(
+            _hash_file, items, jobs=jobs, threads=True):
+        if entry is None:
+            continue
+        new_cache[rel] = entry
+        if entry[0] >= min_size:
+            files.append((rel, entry, inode))
+    files.sort()
+
+    unique = len(set(entry[2] for rel, entry, inode in files))
+    if dry_run:
+        # files sharing a digest but not the inode of the first such
+        # file would be replaced by links
+        first = {}
+        linked = [
+            (rel, entry[0]) for rel, entry, inode in files
+            if first.setdefault(entry[2], inode) != inode]
+        json_dump(cache_path, new_cache)
+        return DedupResult(
+            len(files), unique, len(linked), sum(s for r, s in linked), 0)
+
+    linked = 0
+    saved = 0
+    skipped = 0
+    changed = set()
+    for rel, (size, mtime, digest), inode in files:
+        freed = store.add(actions_path / rel, digest)
+        if freed is None:
+            skipped += 1
+        elif freed:
+            linked += 1
+            saved += freed
+            # the link has the mtime of the stored file
+            new_cache[rel][1] = os.stat(actions_path / rel).st_mtime_ns
+            changed.add(pathlib.PurePath(rel).parts[0])
+    json_dump(cache_path, new_cache)
+    store.prune()
+    for name in sorted(changed):
+        _refresh_data_info(project.actions[name])
+    return DedupResult(len(files), unique, linked, saved, skipped)
+
+
+def _refresh_data_info(action):
+    """Update the recorded sizes and mtimes of data replaced by links to
+    identical stored files, keeping their checksums."""
+    from .datafiles import INFO_KEY, path_info
+    infos = action.data.info()
+    updated = {}
+    for key, info in infos.items():
+        try:
+            current = path_info(action.data.path(key), checksum=False)
+        except (FileNotFoundError, KeyError):
+            current = {}
+        updated[key] = dict(info, **current)
+    if updated != infos:
+        action._backend.attributes.set(INFO_KEY, updated)
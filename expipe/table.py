@@ -0,0 +1,75 @@
+import numpy as np
+
+DEFAULT_COLUMNS = [
+    'type', 'location', 'datetime', 'registered', 'users', 'tags', 'entities']
+LIST_COLUMNS = ['users', 'tags', 'entities']
+DATETIME_COLUMNS = ['datetime', 'registered']
+CATEGORICAL_COLUMNS = ['type', 'location']
+TAGS_LAYOUTS = ['matrix', 'list', 'exploded']
+
+
+def collect_columns(items, columns):
+    """Collect (name, attributes) pairs into a dict of column lists."""
+    ids = []
+    result = {column: [] for column in columns}
+    appends = [(column, result[column].append) for column in columns]
+    for name, attributes in items:
+        ids.append(name)
+        for column, append in appends:
+            value = attributes.get(column)
+            if column in LIST_COLUMNS:
+                value = list(value) if value else []
+            append(value)
+    return ids, result
+
+
+def tags_matrix(tags):
+    """Boolean matrix of shape (rows, unique tags) from lists of tags."""
+    names = sorted(set(tag for row in tags for tag in row))
+    index = {name: i for i, name in enumerate(names)}
+    rows = np.fromiter(
+        (i for i, row in enumerate(tags) for _ in row), dtype=np.intp)
+    cols = np.fromiter(
+        (index[tag] for row in tags for tag in row), dtype=np.intp)
+    matrix = np.zeros((len(tags), len(names)), dtype=bool)
+    matrix[rows, cols] = True
+    return names, matrix
+
+
+def to_dataframe(items, columns=None, tags='matrix'):
+    """Build a pandas DataFrame from (name, attributes) pairs.
+
+    Datetimes are converted to `datetime64`, type and location are
+    categorical and users and entities are list columns. Tags are either
+    a boolean column per tag named "tags.<tag>" (`tags="matrix"`), a list
+    column (`tags="list"`) or one row per tag (`tags="exploded"`).
+    """
+    import pandas as pd
+    from .core import datetime_format
+    if tags not in TAGS_LAYOUTS:
+        raise ValueError(
+            'Expected "tags" to be one of {} got "{}"'.format(TAGS_LAYOUTS, tags))
+    columns = list(columns or DEFAULT_COLUMNS)
+    ids, data = collect_columns(items, columns)
+    index = pd.Index(ids, name='id', dtype=object)
+    frame = {}
+    for column in columns:
+        values = data[column]
+        if column in DATETIME_COLUMNS:
+            values = pd.to_datetime(values, format=datetime_format, errors='coerce')
+        elif column in CATEGORICAL_COLUMNS:
+            values = pd.Categorical(values)
+        elif column in LIST_COLUMNS:
+            series = np.empty(len(values), dtype=object)
+            series[:] = values
+            values = series
+        if column == 'tags' and tags == 'matrix':
+            names, matrix = tags_matrix(data[column])
+            for i, name in enumerate(names):
+                frame['tags.' + name] = matrix[:, i]
+            continue
+        frame[column] = values
+    df = pd.DataFrame(frame, index=index)
+    if 'tags' in columns and tags == 'exploded':
+        df = df.explode('tags')
+    return df
@@ -30,6 +30,209 @@ def test_cli():
     assert result.exit_code == 0
     result = runner.invoke(expipe, ["status"])
     assert result.exit_code == 0
+    result = runner.invoke(expipe, ["du", "--by", "tag"])
+    assert result.exit_code == 0
     os.chdir('..')
     shutil.rmtree('my_project')
-    shutil.rmtree('my_other_project')
\ No newline at end of file
+    shutil.rmtree('my_other_project')
+
+PLUGIN_SOURCE = '''
+from expipe.cliutils import IPlugin
+import click
+
+
+class LazyTestPlugin(IPlugin):
+    def attach_to_cli(self, cli):
+        @cli.command('lazy-hello')
+        def lazy_hello():
+            """Say hello from a lazy plugin."""
+            print('hello')
+'''
+
+
+def test_cli_plugins_are_lazy(tmp_path, monkeypatch):
+    import sys
+    import click
+    from expipe.cli import PluginGroup
+    (tmp_path / 'expipe_lazy_test_plugin.py').write_text(PLUGIN_SOURCE)
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setattr(
+        'expipe.cli.list_plugins', lambda: ['expipe_lazy_test_plugin'])
+
+    # first invocation discovers the plugin commands and stores the manifest
+    runner = CliRunner()
+    result = runner.invoke(click.group(cls=PluginGroup)(lambda: None), ['--help'])
+    assert result.exit_code == 0
+    assert 'lazy-hello' in result.output
+    assert (tmp_path / '.config' / 'expipe' / 'plugin-manifest.yaml').exists()
+
+    # later invocations only import the plugin when its command is invoked
+    del sys.modules['expipe_lazy_test_plugin']
+    cli = click.group(cls=PluginGroup)(lambda: None)
+    result = runner.invoke(cli, ['--help'])
+    assert result.exit_code == 0
+    assert 'Say hello from a lazy plugin.' in result.output
+    assert 'expipe_lazy_test_plugin' not in sys.modules
+    result = runner.invoke(cli, ['lazy-hello'])
+    assert result.exit_code == 0
+    assert result.output == 'hello\n'
+    assert 'expipe_lazy_test_plugin' in sys.modules
+
+
+def test_cli_list_filter_formats(tmp_path, monkeypatch):
+    import csv
+    import io
+    import json
+    from datetime import datetime
+    from expipe import require_project
+    project = require_project(tmp_path / 'project')
+    for i in range(3):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = ['even'] if i % 2 == 0 else ['odd']
+        action.datetime = datetime(2020, 1, i + 1)
+    monkeypatch.chdir(tmp_path / 'project')
+
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['list', 'actions', '--tag', 'even'])
+    assert result.exit_code == 0
+    assert sorted(result.output.split()) == ['action-0', 'action-2']
+
+    result = runner.invoke(
+        expipe, ['list', 'actions', '-f', 'json', '--since', '2020-01-02'])
+    assert result.exit_code == 0
+    rows = json.loads(result.output)
+    assert sorted(r['id'] for r in rows) == ['action-1', 'action-2']
+
+    result = runner.invoke(
+        expipe, ['list', 'actions', '-f', 'jsonl', '-c', 'id,tags', '-j', '2'])
+    assert result.exit_code == 0
+    rows = [json.loads(line) for line in result.output.splitlines()]
+    assert {r['id']: r['tags'] for r in rows}['action-1'] == ['odd']
+
+    result = runner.invoke(expipe, ['list', 'actions', '-f', 'csv', '-c', 'id'])
+    assert result.exit_code == 0
+    rows = list(csv.reader(io.StringIO(result.output)))
+    assert rows[0] == ['id'] and len(rows) == 4
+
+    result = runner.invoke(expipe, ['list', 'modules', '--tag', 'even'])
+    assert result.exit_code != 0
+
+
+def test_cli_ingest(tmp_path, monkeypatch):
+    from expipe import require_project
+    project = require_project(tmp_path / 'project')
+    project.create_action('action')
+    src = tmp_path / 'recording'
+    src.mkdir()
+    (src / 'data.bin').write_bytes(b'1' * 100)
+    monkeypatch.chdir(tmp_path / 'project')
+
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['ingest', 'action', str(src), '-k', 'raw'])
+    assert result.exit_code == 0, result.output
+    action = project.actions['action']
+    assert (action.data.path('raw') / 'data.bin').read_bytes() == b'1' * 100
+    assert action.data.info('raw')['size'] == 100
+
+    result = runner.invoke(expipe, ['ingest', 'missing', str(src)])
+    assert result.exit_code != 0
+
+
+def test_cli_dedup(tmp_path, monkeypatch):
+    from expipe import require_project
+    project = require_project(tmp_path / 'project')
+    for i in range(3):
+        action = project.create_action('action-{}'.format(i))
+        (action.data_path() / 'calibration.bin').write_bytes(b'c' * 1000)
+    monkeypatch.chdir(tmp_path / 'project')
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['dedup', '--dry-run'])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == (
+        '3 files, 1 unique, 2 would be linked saving 2.0 kB')
+    result = runner.invoke(expipe, ['dedup'])
+    assert result.output.strip() == '3 files, 1 unique, 2 linked, 2.0 kB saved'
+    result = runner.invoke(expipe, ['dedup'])
+    assert result.output.strip() == '3 files, 1 unique, 0 linked, 0 B saved'
+
+
+def test_cli_verify(tmp_path, monkeypatch):
+    from expipe import require_project
+    project = require_project(tmp_path / 'project')
+    action = project.create_action('action')
+    action.create_module('tracking', contents={'fps': 30})
+    monkeypatch.chdir(tmp_path / 'project')
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['verify'])
+    assert result.exit_code == 0, result.output
+    assert result.output == ''
+    (action.data_path() / 'raw.bin').write_bytes(b'r')
+    result = runner.invoke(expipe, ['verify', '--no-update'])
+    assert result.exit_code == 0, result.output
+    assert result.output.split() == ['new', 'actions/action/data/raw.bin']
+    (action.path / 'modules' / 'tracking.yaml').write_text('fps: [30\n')
+    result = runner.invoke(expipe, ['verify', '--jobs', '2'])
+    assert result.exit_code == 1
+    lines = sorted(
+        line.split()[:2] for line in result.output.splitlines()
+        if not line.startswith('Error'))
+    assert lines == [
+        ['malformed', 'actions/action/modules/tracking.yaml:'],
+        ['modified', 'actions/action/modules/tracking.yaml'],
+        ['new', 'actions/action/data/raw.bin'],
+    ]
+    assert 'Error: 1 damaged files' in result.output
+
+
+def test_cli_diff(tmp_path, monkeypatch):
+    import shutil
+    from expipe import require_project, get_project
+    project = require_project(tmp_path / 'a')
+    action = project.create_action('action')
+    action.create_module('tracking', contents={'fps': 30})
+    shutil.copytree(str(tmp_path / 'a'), str(tmp_path / 'b'))
+    project = get_project(tmp_path / 'b', name='a')
+    project.actions['action'].modules['tracking']['fps'] = 60
+    project.create_action('other')
+    (tmp_path / 'b' / 'actions' / 'action' / 'data').mkdir()
+    (tmp_path / 'b' / 'actions' / 'action' / 'data' / 'raw.bin').write_bytes(b'r')
+    monkeypatch.chdir(tmp_path)
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['diff', 'a', 'b'])
+    assert result.exit_code == 0, result.output
+    lines = [line.split() for line in result.output.splitlines()]
+    assert lines == [
+        ['created', 'actions/action/data/raw.bin'],
+        ['created', 'actions/other/attributes.yaml'],
+        ['modified', 'actions/action/modules/tracking.yaml'],
+    ]
+    (tmp_path / 'b' / 'actions' / 'action' / 'data' / 'raw.bin').unlink()
+    result = runner.invoke(expipe, ['diff', 'a', 'b'])
+    assert len(result.output.splitlines()) == 3
+    result = runner.invoke(expipe, ['diff', 'a', 'b', '--refresh'])
+    assert len(result.output.splitlines()) == 2
+
+
+def test_cli_clean_cache(tmp_path, monkeypatch):
+    from expipe import require_project, cached
+    project = require_project(tmp_path / 'project')
+    action = project.create_action('action')
+
+    @cached(module='summary')
+    def summary(action):
+        return {'tags': len(action.tags)}
+
+    summary(action)
+    monkeypatch.chdir(tmp_path / 'project')
+    runner = CliRunner()
+    result = runner.invoke(expipe, ['clean-cache'])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == 'Removed 0 results'
+    action.tags = ['changed']
+    result = runner.invoke(expipe, ['clean-cache', '--dry-run'])
+    assert result.output.splitlines() == [
+        'action/summary: inputs changed', 'Would remove 1 results']
+    result = runner.invoke(expipe, ['clean-cache'])
+    assert result.output.splitlines()[-1] == 'Removed 1 results'
+    assert 'summary' not in action.modules
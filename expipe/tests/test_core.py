@@ -230,6 +230,48 @@ def test_module_quantities(project_path):
     assert all(a == b for a, b in zip(quan, mod_contents['quan']))
 
 
+def test_convert_quantities():
+    import numpy as np
+    import quantities as pq
+    from collections import OrderedDict
+    from expipe.backends.filesystem import convert_quantities
+    plain = {'a': [1, 2.5, 'x', None], 'b': {'c': (1, 2)}}
+    assert convert_quantities(plain) is plain
+    data = {
+        'a': 1, 'b': [np.float64(1.5), 'x'], 'c': {'d': np.arange(3)},
+        'e': (np.int32(1),), 'f': [1, 2] * pq.s, 'g': OrderedDict(h=1)}
+    result = convert_quantities(data)
+    assert result == {
+        'a': 1, 'b': [1.5, 'x'], 'c': {'d': [0, 1, 2]}, 'e': (1,),
+        'f': {'value': [1.0, 2.0], 'unit': 's'}, 'g': {'h': 1}}
+    assert type(result['b'][0]) is float and type(result['g']) is dict
+    assert data['c']['d'].tolist() == [0, 1, 2]
+
+
+def test_module_quantities_converted_on_access(project_path):
+    import quantities as pq
+    from expipe.backends.filesystem import yaml_load
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    contents = {
+        'depth': 1.5 * pq.um,
+        'error': pq.UncertainQuantity([1., 2.], 'mV', [.1, .2]),
+        'nested': {'rate': [1, 2] * pq.Hz, 'name': 'x'},
+    }
+    module = project.create_module(pytest.PROJECT_MODULE_ID, contents=contents)
+    raw = yaml_load(module._backend.path, convert=False)
+    assert raw['depth'] == {'value': 1.5, 'unit': 'um'}
+    assert module['depth'] == 1.5 * pq.um
+    assert isinstance(module['error'], pq.UncertainQuantity)
+    assert list(module['error'].uncertainty.magnitude) == [.1, .2]
+    assert isinstance(module['nested'], expipe.core.MapManager)
+    assert isinstance(module['nested']['rate'], pq.Quantity)
+    assert isinstance(module['nested'].contents['rate'], pq.Quantity)
+    assert sorted(module['nested']) == ['name', 'rate']
+    module['nested']['name'] = 'y'
+    assert module.contents['nested']['name'] == 'y'
+    assert isinstance(module.contents['depth'], pq.Quantity)
+
+
 def test_module_int_key(project_path):
     import numpy as np
     quan = 1
@@ -516,6 +558,276 @@ def test_action_data(project_path):
     assert action.users == ['Mikkel']
 
 
+def test_action_data_registry(project_path):
+    import hashlib
+    import numpy as np
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.require_action(pytest.ACTION_ID)
+    values = np.arange(10, dtype='int16')
+    raw_path = action.data_path() / 'raw.bin'
+    values.tofile(str(raw_path))
+    info = action.data.register('raw', 'raw.bin')
+    assert action.data['raw'] == 'raw.bin'
+    assert info['size'] == 20
+    assert info['sha256'] == hashlib.sha256(values.tobytes()).hexdigest()
+    assert action.attributes['data_info']['raw'] == info
+
+    sub = action.data_path() / 'session'
+    sub.mkdir()
+    (sub / 'a.txt').write_text('a')
+    (sub / 'b.txt').write_text('bb')
+    info = action.data.register('session', sub)
+    assert action.data['session'] == 'session'
+    assert (info['size'], info['files']) == (3, 2)
+    assert action.data.verify() == []
+
+    memmap = action.data.open('raw', dtype='int16', shape=(2, 5))
+    assert memmap[1, 4] == 9
+    with action.data.open('raw') as mapped:
+        assert mapped[:2] == values.tobytes()[:2]
+
+    (sub / 'b.txt').write_text('cc')
+    assert action.data.verify(checksum=True) == ['session']
+    raw_path.unlink()
+    assert action.data.verify() == ['raw', 'session']
+    with pytest.raises(ValueError):
+        action.data.register('outside', project_path)
+    with pytest.raises(ValueError):
+        action.data.register('outside', '../attributes.yaml')
+    with pytest.raises(ValueError):
+        action.data.register('outside', 'session/../../attributes.yaml')
+
+
+def test_data_registry_empty(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action('a')
+    assert list(action.data) == []
+    assert len(action.data) == 0
+    assert 'raw' not in action.data
+
+    # missing nested module keys are not empty mappings
+    module = action.create_module('m', contents={'a': {'b': 1}})
+    nested = module['a']
+    action.modules['m'] = {'c': 2}
+    with pytest.raises(KeyError):
+        list(nested)
+
+
+@pytest.mark.parametrize('mode', ['copy', 'hardlink', 'reflink', 'move'])
+def test_action_data_ingest(project_path, tmp_path, mode):
+    from expipe.datafiles import path_info
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.require_action(pytest.ACTION_ID)
+    src = tmp_path / 'recording'
+    (src / 'sub').mkdir(parents=True)
+    for i in range(5):
+        (src / 'sub' / '{}.bin'.format(i)).write_bytes(bytes([i]) * 1000 * i)
+    (src / 'meta.txt').write_text('meta')
+    expected = path_info(src)
+    info = action.data.ingest(src, 'raw', mode=mode, jobs=2)
+    target = action.data.path('raw')
+    assert target == action.data_path() / 'recording'
+    assert info['sha256'] == expected['sha256']
+    assert path_info(target)['sha256'] == expected['sha256']
+    assert action.data.info('raw') == info
+    assert action.data.verify(checksum=True) == []
+    assert src.exists() == (mode != 'move')
+    if mode == 'hardlink':
+        assert (target / 'meta.txt').stat().st_ino == (src / 'meta.txt').stat().st_ino
+
+
+def test_action_data_ingest_resumed_move(project_path, tmp_path):
+    from expipe.datafiles import path_info
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.require_action(pytest.ACTION_ID)
+    src = tmp_path / 'recording'
+    src.mkdir()
+    (src / 'a.bin').write_bytes(b'a' * 100)
+    (src / 'b.bin').write_bytes(b'b' * 200)
+    expected = path_info(src)
+    # an interrupted move left one file in the target
+    target = action.data_path() / 'recording'
+    target.mkdir()
+    (src / 'a.bin').rename(target / 'a.bin')
+    info = action.data.ingest(src, 'raw', mode='move')
+    assert not src.exists()
+    assert info['sha256'] == expected['sha256']
+    assert info['files'] == 2
+    assert action.data.verify('raw', checksum=True) == []
+
+    # the destination must be in the data directory
+    other = tmp_path / 'other.bin'
+    other.write_bytes(b'o')
+    for dest in ['../escaped.bin', 'sub/../../escaped.bin',
+                 str(tmp_path / 'escaped.bin')]:
+        with pytest.raises(ValueError):
+            action.data.ingest(other, 'other', dest=dest)
+    assert not (action.path / 'escaped.bin').exists()
+    assert not (tmp_path / 'escaped.bin').exists()
+
+
+def test_dedup(project_path, tmp_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    paths = []
+    for i in range(3):
+        action = project.create_action('action-{}'.format(i))
+        (action.data_path() / 'shared.bin').write_bytes(b's' * 100)
+        (action.data_path() / 'own.bin').write_bytes(bytes([i]) * 10)
+        action.data.register('shared', 'shared.bin')
+        paths.append(action.data_path() / 'shared.bin')
+    mode = paths[0].stat().st_mode
+    result = project.dedup(jobs=2)
+    assert result == (6, 4, 2, 200, 0)
+    assert len(set(path.stat().st_ino for path in paths)) == 1
+    assert paths[0].stat().st_mode == mode
+    for i in range(3):
+        assert project.actions['action-{}'.format(i)].data.verify() == []
+
+    # hashes are reused and deleted files are pruned from the store
+    project.delete_action('action-0')
+    project.delete_action('action-1')
+    project.delete_action('action-2')
+    result = project.dedup()
+    assert result == (0, 0, 0, 0, 0)
+    objects = project._backend.internal_path('objects')
+    assert not any(p.is_file() for p in objects.rglob('*'))
+
+    # ingest straight into the store
+    src = tmp_path / 'src.bin'
+    src.write_bytes(b'x' * 50)
+    a = project.create_action('a')
+    b = project.create_action('b')
+    a.data.ingest(src, 'x', dedup=True)
+    b.data.ingest(src, 'x', dedup=True)
+    assert a.data.path('x').stat().st_ino == b.data.path('x').stat().st_ino
+
+
+def test_dedup_other_file_system(project_path, monkeypatch):
+    import errno
+    import os
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    paths = []
+    for i in range(3):
+        action = project.create_action('action-{}'.format(i))
+        (action.data_path() / 'shared.bin').write_bytes(b's' * 100)
+        paths.append(action.data_path() / 'shared.bin')
+    link = os.link
+
+    def cross_device_link(src, dst):
+        if 'action-1' in str(src) or 'action-1' in str(dst):
+            raise OSError(errno.EXDEV, 'Invalid cross-device link')
+        link(src, dst)
+
+    monkeypatch.setattr(os, 'link', cross_device_link)
+    result = project.dedup()
+    assert result == (3, 1, 1, 100, 1)
+    assert paths[0].stat().st_ino == paths[2].stat().st_ino
+    assert paths[1].stat().st_nlink == 1
+    assert paths[1].read_bytes() == b's' * 100
+
+
+@pytest.mark.parametrize('jobs', [None, 2])
+def test_verify(project_path, tmp_path, jobs):
+    import os
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action('a')
+    action.create_module('tracking', contents={'fps': 30})
+    assert list(project.verify(jobs=jobs)) == []
+    assert project._backend.internal_path('manifest.json').exists()
+
+    # files written by expipe are recorded as they are written
+    project = expipe.get_project(project_path)
+    action = project.actions['a']
+    action.tags = ['recorded']
+    action.modules['tracking']['fps'] = 60
+    action.create_message('hello', user='user')
+    (action.data_path() / 'raw.bin').write_bytes(b'r' * 10)
+    src = tmp_path / 'src.bin'
+    src.write_bytes(b's' * 10)
+    action.data.ingest(src, 'src')
+    project.create_action('b')
+    project.delete_action('b')
+    assert list(project.verify(jobs=jobs)) == [('actions/a/data/raw.bin', 'new', '')]
+    assert list(project.verify(jobs=jobs)) == []
+
+    module_path = action.path / 'modules' / 'tracking.yaml'
+    st = module_path.stat()
+    module_path.write_text('{fps: [60\n')
+    os.utime(str(module_path), ns=(st.st_atime_ns, st.st_mtime_ns))
+    (action.data_path() / 'raw.bin').write_bytes(b'changed')
+    (action.data_path() / 'src.bin').unlink()
+    problems = list(project.verify(jobs=jobs, update=False))
+    assert [problem[:2] for problem in problems] == [
+        ('actions/a/data/raw.bin', 'modified'),
+        ('actions/a/data/src.bin', 'missing'),
+    ]
+    # the size and mtime of the module did not change
+    problems = list(project.verify(full=True, jobs=jobs, update=False))
+    assert sorted(problem[:2] for problem in problems) == [
+        ('actions/a/data/raw.bin', 'modified'),
+        ('actions/a/data/src.bin', 'missing'),
+        ('actions/a/modules/tracking.yaml', 'corrupt'),
+        ('actions/a/modules/tracking.yaml', 'malformed'),
+    ]
+    problems = list(project.verify(yaml=True, jobs=jobs))
+    assert sorted(problem[:2] for problem in problems) == [
+        ('actions/a/data/raw.bin', 'modified'),
+        ('actions/a/data/src.bin', 'missing'),
+        ('actions/a/modules/tracking.yaml', 'corrupt'),
+        ('actions/a/modules/tracking.yaml', 'malformed'),
+    ]
+    # corrupt files keep their checksum until they are rewritten
+    problems = list(project.verify(yaml=True, jobs=jobs))
+    assert sorted(problem[:2] for problem in problems) == [
+        ('actions/a/modules/tracking.yaml', 'corrupt'),
+        ('actions/a/modules/tracking.yaml', 'malformed'),
+    ]
+
+
+def test_verify_compacts_log(project_path):
+    from expipe.manifest import Manifest
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action('a')
+    assert list(project.verify()) == []
+    log_path = project._backend.internal_path('manifest.jsonl')
+
+    # the log is compacted also when verify finds no changes
+    action.create_module('tracking', contents={'fps': 30})
+    assert log_path.exists()
+    assert list(project.verify()) == []
+    assert not log_path.exists()
+
+    # changes recorded by others while compacting are kept
+    manifest = Manifest(project.path).load()
+    action.modules['tracking']['fps'] = 60
+    action.create_message('hello', user='user')
+    manifest.save()
+    assert not log_path.exists()
+    files = Manifest(project.path).load().files
+    assert 'actions/a/modules/tracking.yaml' in files
+    assert len([rel for rel in files if '/messages/' in rel]) == 1
+    assert list(project.verify()) == []
+
+
+@pytest.mark.parametrize('checksum', [True, False])
+def test_copy_file_resumes(tmp_path, checksum):
+    import hashlib
+    from expipe.datafiles import copy_file
+    data = bytes(range(256)) * 4000
+    src = tmp_path / 'src.bin'
+    src.write_bytes(data)
+    dst = tmp_path / 'dst.bin'
+    (tmp_path / 'dst.bin.partial').write_bytes(data[:300000])
+    digest = copy_file(src, dst, checksum=checksum, chunk_size=4096)
+    assert dst.read_bytes() == data
+    assert not (tmp_path / 'dst.bin.partial').exists()
+    if checksum:
+        assert digest == hashlib.sha256(data).hexdigest()
+    else:
+        assert digest is None
+    assert dst.stat().st_mtime_ns == src.stat().st_mtime_ns
+
+
 def test_isinstance_module(project_path):
     module_contents = {'species': {}}
 
@@ -713,6 +1025,116 @@ def test_require_action_module_from_template_no_module_name(project_path):
     assert action.modules[pytest.TEMPLATE_ID] == template_contents
 
 
+def test_template_cache(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template(
+        pytest.TEMPLATE_ID, {'identifier': 'module', 'value': 1})
+    action = project.create_action(pytest.ACTION_ID)
+    templates = action._backend.templates
+    assert templates is project._backend.templates
+    contents = templates.template_contents(pytest.TEMPLATE_ID)
+    contents['value'] = 2
+    assert templates.template_contents(pytest.TEMPLATE_ID)['value'] == 1
+    project.templates[pytest.TEMPLATE_ID]['value'] = 300
+    module = action.create_module(template=pytest.TEMPLATE_ID)
+    assert module['value'] == 300
+
+
+def test_template_cache_nested_write(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template(pytest.TEMPLATE_ID, {
+        'identifier': 'module', 'daq': {'channels': 1}})
+    templates = project._backend.templates
+    assert templates.template_contents(pytest.TEMPLATE_ID)['daq'] == {
+        'channels': 1}
+    # same size, possibly within the mtime granularity
+    project.templates[pytest.TEMPLATE_ID]['daq']['channels'] = 2
+    assert pytest.TEMPLATE_ID not in templates._cache
+    assert templates.template_contents(pytest.TEMPLATE_ID)['daq'] == {
+        'channels': 2}
+
+
+def test_apply_template(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template(
+        pytest.TEMPLATE_ID, {'identifier': 'module', 'value': 1})
+    for i in range(5):
+        project.create_action('action-{}'.format(i))
+    project.actions['action-0'].create_module('module', contents={'value': 0})
+    written = project.apply_template(pytest.TEMPLATE_ID, jobs=2)
+    assert sorted(written) == ['action-{}'.format(i) for i in range(1, 5)]
+    assert project.actions['action-0'].modules['module']['value'] == 0
+    assert project.actions['action-3'].modules['module']['value'] == 1
+    written = project.apply_template(
+        pytest.TEMPLATE_ID, actions=['action-0'], overwrite=True)
+    assert written == ['action-0']
+    assert project.actions['action-0'].modules['module']['value'] == 1
+    with pytest.raises(KeyError):
+        project.apply_template(pytest.TEMPLATE_ID, actions=['missing'])
+
+
+@pytest.mark.parametrize('jobs', [None, 2])
+def test_validate_template_schema(project_path, jobs):
+    import quantities as pq
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template(pytest.TEMPLATE_ID, {
+        'identifier': 'recording',
+        'depth': 1 * pq.um,
+        'region': {'value': 'MEC'},
+        'schema': {
+            'depth': {'unit': 'um', 'required': True},
+            'region/value': {'type': 'str', 'values': ['MEC', 'LEC']},
+            'channels': {'type': 'int'},
+        }})
+    contents = [
+        {'depth': 2 * pq.um, 'region': {'value': 'LEC'}, 'channels': 4},
+        {'depth': 2 * pq.micrometer, 'region': {'value': 'CA1'}},
+        {'region': {'value': 'MEC'}, 'channels': 1.5},
+        {'depth': 2 * pq.mm},
+    ]
+    for i, module_contents in enumerate(contents):
+        action = project.create_action('action-{}'.format(i))
+        action.create_module('recording', contents=module_contents)
+    project.create_action('action-without-module')
+    module = project.actions['action-0'].create_module(
+        'other', template=pytest.TEMPLATE_ID)
+    assert 'schema' not in module.contents
+
+    violations = list(project.validate(pytest.TEMPLATE_ID, jobs=jobs))
+    assert [(v.action, v.path) for v in violations] == [
+        ('action-1', 'region/value'),
+        ('action-2', 'channels'),
+        ('action-2', 'depth'),
+        ('action-3', 'depth'),
+    ]
+    assert violations[0].module == 'recording'
+    assert violations[0].message == "expected one of ['MEC', 'LEC'] got 'CA1'"
+    assert violations[1].message == 'expected int got float'
+    assert violations[2].message == 'missing required key'
+    assert violations[3].message == 'expected unit "um" got "mm"'
+
+
+def test_template_ordinary_schema_key(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template(pytest.TEMPLATE_ID, {
+        'identifier': 'recording',
+        'schema': {'name': 'tetrode', 'version': {'value': 2}}})
+    action = project.create_action(pytest.ACTION_ID)
+    module = action.create_module('recording', template=pytest.TEMPLATE_ID)
+    assert module.contents['schema'] == {
+        'name': 'tetrode', 'version': {'value': 2}}
+    assert list(project.validate(pytest.TEMPLATE_ID)) == []
+
+    # a typo in a schema is an error instead of ordinary contents
+    project.create_template('typo', {
+        'identifier': 'recording',
+        'schema': {'depth': {'unit': 'um', 'requird': True}}})
+    with pytest.raises(ValueError):
+        action.create_module('typo-module', template='typo')
+    with pytest.raises(ValueError):
+        list(project.validate('typo'))
+
+
 def test_create_retrieve_project_module(project_path):
     module_contents = {'species': {'value': 'rat'}}
 
@@ -1019,3 +1441,408 @@ def test_fill_the_project(project_path):
         setattr(action, attr, orig_list)
         prop_list.extend(['sub3'])
         orig_list.extend(['sub3'])
+
+
+def test_query_actions(project_path):
+    from datetime import datetime
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(4):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = ['even'] if i % 2 == 0 else ['odd']
+        action.users = ['user-{}'.format(i)]
+        action.location = 'room' if i < 2 else 'lab'
+        action.datetime = datetime(2020, 1, i + 1)
+
+    def names(**kwargs):
+        return sorted(name for name, _ in project.actions.query(**kwargs))
+
+    assert names() == ['action-{}'.format(i) for i in range(4)]
+    assert names(tags=['even']) == ['action-0', 'action-2']
+    assert names(tags=['even'], location='lab') == ['action-2']
+    assert names(users=['user-1', 'user-3']) == []
+    assert names(location=['room', 'lab']) == names()
+    assert names(since='2020-01-02', until='2020-01-04') == ['action-1', 'action-2']
+    assert names(tags='odd', jobs=2) == ['action-1', 'action-3']
+    attributes = dict(project.actions.iter_attributes(jobs=2))
+    assert attributes['action-3']['users'] == ['user-3']
+
+
+def test_disk_usage(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i, tag in enumerate(['big', 'small']):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = [tag]
+        data_path = action.data_path() / 'sub'
+        data_path.mkdir()
+        (data_path / 'file.bin').write_bytes(b'0' * 1000 * (10 - 9 * i))
+    project.create_action('empty')
+
+    usage = project.disk_usage()
+    assert list(usage) == ['action-0', 'action-1', 'empty']
+    assert usage['action-0'] == (10000, 1)
+    assert usage['empty'] == (0, 0)
+    assert project.disk_usage(by='tag', jobs=2)['small'].size == 1000
+    project.actions['action-0'].entities = ['mouse1']
+    by_entity = project.disk_usage(by='entity')
+    assert by_entity['mouse1'] == (10000, 1)
+    assert by_entity[None] == (1000, 1)
+
+    # new files change the directory mtime and are picked up
+    (project.actions['action-1'].data_path() / 'other.bin').write_bytes(b'0' * 500)
+    assert project.disk_usage()['action-1'] == (1500, 2)
+    # files modified in place need a refresh
+    with (project.actions['action-1'].data_path() / 'other.bin').open('ab') as f:
+        f.write(b'0' * 500)
+    assert project.disk_usage(refresh=True)['action-1'] == (2000, 2)
+    with pytest.raises(ValueError):
+        project.disk_usage(by='nothing')
+
+
+def test_actions_to_dataframe(project_path):
+    from datetime import datetime
+    import numpy as np
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(3):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = ['a', 'b'] if i == 0 else ['b']
+        action.users = ['user-{}'.format(i)]
+        action.location = 'room'
+        action.datetime = datetime(2020, 1, i + 1)
+
+    df = project.actions.to_dataframe(jobs=2)
+    assert sorted(df.index) == ['action-0', 'action-1', 'action-2']
+    df = df.sort_index()
+    assert np.issubdtype(df['datetime'].dtype, np.datetime64)
+    assert df['location'].dtype == 'category'
+    assert df['users']['action-1'] == ['user-1']
+    assert df['entities']['action-1'] == []
+    assert list(df['tags.a']) == [True, False, False]
+    assert df['tags.b'].all()
+
+    df = project.actions.to_dataframe(
+        columns=['tags'], ids=['action-0', 'action-1'], tags='exploded')
+    assert list(df['tags']) == ['a', 'b', 'b'] or list(df['tags']) == ['b', 'a', 'b']
+    df = project.actions.to_dataframe(columns=['tags'], tags='list')
+    assert sorted(df['tags']['action-0']) == ['a', 'b']
+    with pytest.raises(ValueError):
+        project.actions.to_dataframe(tags='nothing')
+
+
+@pytest.mark.parametrize('format', ['csv', 'parquet', 'feather'])
+def test_export(project_path, tmp_path, format):
+    import csv
+    import quantities as pq
+    if format != 'csv':
+        pytest.importorskip('pyarrow')
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(5):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = ['tag-{}'.format(i)]
+        action.create_module('tracking', contents={
+            'box': {'value': 'square'}, 'depth': i * pq.um})
+        action.create_message('message {}'.format(i), user='me')
+    project.create_entity('entity')
+    path = tmp_path / 'export'
+
+    def read(table, key='id'):
+        if format == 'csv':
+            with (path / (table + '.csv')).open() as f:
+                return {r[key]: r for r in csv.DictReader(f)}
+        import pyarrow.parquet
+        import pyarrow.feather
+        if format == 'parquet':
+            rows = pyarrow.parquet.read_table(path / (table + '.parquet'))
+        else:
+            rows = pyarrow.feather.read_table(path / (table + '.feather'))
+        return {r[key]: r for r in rows.to_pylist()}
+
+    fields = ['tracking/box/value', 'tracking/depth']
+    counts = project.export(path, format=format, fields=fields, chunk_size=2)
+    assert counts['actions'] == {'read': 5, 'copied': 0}
+    actions = read('actions')
+    assert sorted(actions) == ['action-{}'.format(i) for i in range(5)]
+    assert actions['action-1']['tracking/box/value'] == 'square'
+    assert '"unit": "um"' in actions['action-1']['tracking/depth']
+    assert list(read('entities')) == ['entity']
+    messages = read('messages-actions', key='object')
+    assert messages['action-4']['text'] == 'message 4'
+    assert len(messages) == 5
+
+    project.actions['action-2'].tags = ['changed']
+    project.delete_action('action-3')
+    counts = project.export(
+        path, format=format, fields=fields, chunk_size=2, incremental=True)
+    assert counts['actions'] == {'read': 1, 'copied': 3}
+    assert counts['entities'] == {'read': 0, 'copied': 1}
+    actions = read('actions')
+    assert sorted(actions) == ['action-0', 'action-1', 'action-2', 'action-4']
+    tags = actions['action-2']['tags']
+    assert tags == (['changed'] if format != 'csv' else '["changed"]')
+    assert len(read('messages-actions', key='object')) == 4
+
+
+def test_changes_since(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    kept = project.create_action('kept')
+    kept.create_module('tracking', contents={'fps': 30})
+    project.create_action('removed')
+    token = project.state_token()
+    assert project.changes_since(token).actions == ([], [], [])
+
+    kept.tags = ['new-tag']
+    kept.modules['tracking']['fps'] = 60
+    kept.create_message('hello', user='user')
+    project.delete_action('removed')
+    added = project.create_action('added')
+    (added.data_path() / 'raw.bin').write_bytes(b'r')
+    temporary = project.create_action('temporary')
+    project.delete_action('temporary')
+    changes = project.changes_since(token)
+    assert changes.actions == (['added'], ['kept'], ['removed'])
+    assert changes.modules == ([], [('actions/kept', 'tracking')], [])
+    message, = changes.messages.created
+    assert message[0] == 'actions/kept'
+    # written outside expipe
+    assert changes.data == ([], [], [])
+    changes = project.changes_since(token, refresh=True)
+    assert changes.data == ([('added', 'raw.bin')], [], [])
+    assert project.changes_since(changes.token) == (changes.token, ) + (
+        ([], [], []), ) * 7
+
+    with pytest.raises(ValueError):
+        project.changes_since('other:1')
+
+
+def test_events(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    received = []
+    project.subscribe(received.append)
+    try:
+        action = project.create_action('a')
+        action.tags = ['one']
+        action.tags.append('two')
+        module = action.create_module('tracking', contents={'fps': 30})
+        module['fps'] = 60
+        module['camera'] = {'lens': {'focal': 8}}
+        action.modules['tracking']['camera']['lens']['focal'] = 12
+        action.create_message('hello', user='user')
+        entity = project.create_entity('mouse')
+        entity.location = 'cage'
+        action.delete_module('tracking')
+        project.delete_action('a')
+    finally:
+        project.unsubscribe(received.append)
+    expected = [
+        ('created', 'action', '', 'a', None),
+        ('modified', 'attribute', 'actions/a', 'tags', None),
+        ('modified', 'attribute', 'actions/a', 'tags', None),
+        ('created', 'module', 'actions/a', 'tracking', None),
+        ('modified', 'module', 'actions/a', 'tracking', 'fps'),
+        ('modified', 'module', 'actions/a', 'tracking', 'camera'),
+        ('modified', 'module', 'actions/a', 'tracking', 'camera/lens/focal'),
+        ('created', 'message', 'actions/a', received[7].name, None),
+        ('created', 'entity', '', 'mouse', None),
+        ('modified', 'attribute', 'entities/mouse', 'location', None),
+        ('deleted', 'module', 'actions/a', 'tracking', None),
+        ('deleted', 'action', '', 'a', None),
+    ]
+    assert [event[:5] for event in received] == expected
+    assert all(event.project == str(project.path) for event in received)
+
+    # other processes read the journal
+    project.create_action('b')
+    events = list(project.follow(interval=0.01, timeout=0.05))
+    assert [event[:5] for event in events] == expected + [
+        ('created', 'action', '', 'b', None)]
+    offset = events[-1].offset
+    project.delete_action('b')
+    events = list(project.follow(offset, interval=0.01, timeout=0.05))
+    assert [event[:5] for event in events] == [
+        ('deleted', 'action', '', 'b', None)]
+
+
+@pytest.mark.parametrize('poll', [True, False])
+def test_watch(project_path, poll):
+    import os
+    import shutil
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template('daq', {'identifier': 'daq', 'channels': 8})
+    action = project.create_action('a')
+    try:
+        watcher = project.watch(interval=0.01, poll=poll)
+    except OSError:
+        pytest.skip('inotify is not available')
+    with watcher:
+        assert watcher.method == ('polling' if poll else 'inotify')
+        assert project._backend.templates.template_contents('daq')['channels'] == 8
+        # another process
+        other = expipe.get_project(project_path)
+        other.create_action('b')
+        other.actions['a'].create_module('tracking', contents={'fps': 30})
+        template_path = project.path / 'templates' / 'daq.yaml'
+        st = template_path.stat()
+        template_path.write_text(
+            template_path.read_text().replace('channels: 8', 'channels: 4'))
+        if not poll:
+            # only inotify notices changes that keep the size and mtime
+            os.utime(str(template_path), ns=(st.st_atime_ns, st.st_mtime_ns))
+        changes = watcher.poll(timeout=2)
+        changes += watcher.poll(timeout=0.05)
+        summary = set(change[:4] for change in changes)
+        assert ('created', 'action', '', 'b') in summary
+        assert ('created', 'module', 'actions/a', 'tracking') in summary
+        assert ('modified', 'template', '', 'daq') in summary
+        # the cached template was dropped
+        assert project._backend.templates.template_contents('daq')['channels'] == 4
+
+        shutil.rmtree(str(action.path / 'modules'))
+        changes = watcher.poll(timeout=2)
+        changes += watcher.poll(timeout=0.05)
+        assert ('deleted', 'module', 'actions/a', 'tracking') in set(
+            change[:4] for change in changes)
+        assert watcher.poll() == []
+
+
+def test_watch_overflow(project_path):
+    from expipe.watch import Change
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    project.create_template('daq', {'identifier': 'daq', 'channels': 8})
+    try:
+        watcher = project.watch(interval=0.01, poll=False)
+    except OSError:
+        pytest.skip('inotify is not available')
+    with watcher:
+        assert project._backend.templates.template_contents('daq')['channels'] == 8
+        template_path = project.path / 'templates' / 'daq.yaml'
+        template_path.write_text(
+            template_path.read_text().replace('channels: 8', 'channels: 4'))
+        # the kernel queue overflowed and the events were lost
+        watcher._inotify.read = lambda timeout: None
+        assert watcher.poll() == [
+            Change('rescan', 'project', '', '', project.path.absolute())]
+        assert project._backend.templates.template_contents('daq')['channels'] == 4
+
+
+def _spike_count(action):
+    if 'broken' in action.tags:
+        raise ValueError('broken recording')
+    if 'no-data' in action.tags:
+        return {'count': 0}
+    return {'count': len(action.data_path('spikes').read_bytes())}
+
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_map_actions(project_path, workers):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(4):
+        action = project.create_action('action-{}'.format(i))
+        (action.data_path() / 'spikes.bin').write_bytes(b's' * i)
+        action.data.register('spikes', 'spikes.bin', checksum=False)
+        action.tags = ['ephys']
+    project.actions['action-3'].tags = ['ephys', 'broken']
+    # without registered data
+    project.create_action('other').tags = ['ephys', 'no-data']
+    project.create_action('unselected')
+
+    result = project.map_actions(
+        _spike_count, 'spike_count', query={'tags': 'ephys'}, workers=workers)
+    assert sorted(result.done) == [
+        'action-0', 'action-1', 'action-2', 'other']
+    assert project.actions['other'].modules['spike_count']['count'] == 0
+    assert result.skipped == []
+    (name, error), = result.failed
+    assert name == 'action-3' and 'broken recording' in error
+    assert project.actions['action-2'].modules['spike_count']['count'] == 2
+
+    # unchanged actions are skipped, changed and failed ones run again
+    (project.actions['action-1'].data_path() / 'spikes.bin').write_bytes(b'ss')
+    project.actions['action-3'].tags = ['ephys']
+    result = project.map_actions(
+        _spike_count, 'spike_count', query={'tags': 'ephys'}, workers=workers)
+    assert sorted(result.done) == ['action-1', 'action-3']
+    assert sorted(result.skipped) == ['action-0', 'action-2', 'other']
+    assert result.failed == []
+    assert project.actions['action-1'].modules['spike_count']['count'] == 2
+
+    # removed results are computed again
+    project.actions['action-0'].delete_module('spike_count')
+    result = project.map_actions(
+        _spike_count, 'spike_count', query=['action-0', 'action-1'])
+    assert result.done == ['action-0']
+    result = project.map_actions(
+        _spike_count, 'spike_count', query=['action-0'], force=True)
+    assert result.done == ['action-0']
+
+
+def test_cached(project_path):
+    import datetime
+    import quantities as pq
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action('a')
+    (action.data_path() / 'spikes.bin').write_bytes(b'sss')
+    action.data.register('spikes', 'spikes.bin', checksum=False)
+    calls = []
+
+    @expipe.cached(module='spike_rate')
+    def spike_rate(action, duration=1.0):
+        calls.append(duration)
+        count = len(action.data_path('spikes').read_bytes())
+        return {'rate': pq.Quantity(count / duration, 'Hz')}
+
+    @expipe.cached(module='spike_times', data=False)
+    def spike_times(action):
+        calls.append('times')
+        return [0.1, 0.2]
+
+    assert spike_rate(action)['rate'] == 3 * pq.Hz
+    result = spike_rate(action)
+    assert isinstance(result['rate'], pq.Quantity)
+    assert result == {'rate': 3 * pq.Hz}
+    assert calls == [1.0]
+    assert spike_rate(action, duration=3.0) == {'rate': 1 * pq.Hz}
+    assert calls == [1.0, 3.0]
+    assert spike_times(action) == spike_times(action) == [0.1, 0.2]
+    assert calls == [1.0, 3.0, 'times']
+
+    # changed data is computed again
+    (action.data_path() / 'spikes.bin').write_bytes(b'ssssss')
+    assert spike_rate(action, duration=3.0) == {'rate': 2 * pq.Hz}
+    assert calls == [1.0, 3.0, 'times', 3.0]
+
+    # cleanup of stale and old results
+    assert project.clean_cache() == []
+    action.tags = ['changed']
+    assert project.clean_cache(dry_run=True) == [
+        ('a', 'spike_rate', 'inputs changed'),
+        ('a', 'spike_times', 'inputs changed')]
+    assert project.clean_cache(module='spike_times') == [
+        ('a', 'spike_times', 'inputs changed')]
+    assert 'spike_times' not in action.modules
+    assert spike_times(action) == [0.1, 0.2]
+    removed = project.clean_cache(
+        stale=False, older_than=datetime.timedelta(seconds=-1))
+    assert len(removed) == 2
+    assert list(action.modules) == []
+
+    # one index entry per cached module
+    spike_rate(action, duration=2.0)
+    spike_rate(action, duration=4.0)
+    spike_times(action)
+    index = project._backend.internal_path('cached.jsonl').read_text()
+    assert sorted(index.splitlines()) == [
+        '{"action": "a", "module": "spike_rate"}',
+        '{"action": "a", "module": "spike_times"}']
+
+
+def test_cached_keeps_other_modules(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action('a')
+    action.create_module('tracking', contents={'fps': 30})
+
+    @expipe.cached(module='tracking')
+    def tracking(action):
+        return {'fps': 60}
+
+    with pytest.raises(ValueError):
+        tracking(action)
+    assert action.modules['tracking'].contents == {'fps': 30}
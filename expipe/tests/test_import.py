@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+# Generous budget for `import expipe` in seconds. Before the heavy imports
+# were deferred this took about a second.
+IMPORT_TIME_BUDGET = 0.5
+
+
+def _run_python(code):
+    result = subprocess.run(
+        [sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+
+def test_import_does_not_load_heavy_modules():
+    heavy = ['IPython', 'ipywidgets', 'pandas', 'quantities', 'tqdm']
+    code = (
+        'import sys, expipe; '
+        'print(",".join(m for m in {} if m in sys.modules))'.format(heavy))
+    assert _run_python(code) == ''
+
+
+def test_import_time():
+    code = (
+        'import time; t = time.perf_counter(); import expipe; '
+        'print(time.perf_counter() - t)')
+    duration = min(float(_run_python(code)) for _ in range(3))
+    assert duration < IMPORT_TIME_BUDGET
+
+
+def test_lazy_browser():
+    code = 'import expipe, sys; expipe.Browser; print("ipywidgets" in sys.modules)'
+    assert _run_python(code) == 'True'
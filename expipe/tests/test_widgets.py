@@ -0,0 +1,298 @@
+import pytest
+import expipe
+from datetime import datetime
+
+pytest.importorskip('ipywidgets')
+
+
+def _create_actions(project, tags):
+    for i, action_tags in enumerate(tags):
+        action = project.create_action('action-{}'.format(i))
+        action.tags = action_tags
+        action.users = ['user']
+        action.datetime = datetime(2020, 1, i + 1)
+
+
+def test_browser_index_refresh(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    _create_actions(project, [['a'], ['a', 'b'], ['b']])
+    browser = expipe.Browser(project_path)
+    browser.wait()
+    attributes = browser.action_attributes
+    assert attributes['tags']['a']['actions'] == ['action-0', 'action-1']
+    assert attributes['users']['user']['actions'] == [
+        'action-0', 'action-1', 'action-2']
+    assert '2020-01-01 00:00:00' in attributes['datetime']
+
+    # only changed actions are read on refresh
+    project.actions['action-0'].tags = ['c']
+    project.delete_action('action-2')
+    changed, deleted, _ = browser.index.changes()
+    assert changed == ['action-0'] and deleted == ['action-2']
+    browser.refresh(background=False)
+    attributes = browser.action_attributes
+    assert attributes['tags']['a']['actions'] == ['action-1']
+    assert attributes['tags']['b']['actions'] == ['action-1']
+    assert attributes['tags']['c']['actions'] == ['action-0']
+    assert browser.index.changes()[:2] == ([], [])
+
+
+def test_browser_export_view_filter(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    _create_actions(project, [['a'], ['a', 'b'], ['b']])
+    browser = expipe.Browser(project_path, background=False)
+    view = browser._export_view()
+    facets, selection = view.children[1].children
+    actions_visible = selection.children[0]
+    tags_box = facets.children[0]
+    match_mode = view.children[0].children[1]
+
+    def checkboxes():
+        return {
+            ch.description.rsplit(' (', 1)[0]: ch for ch in tags_box.children}
+
+    def descriptions():
+        return sorted(ch.description for ch in tags_box.children)
+
+    assert descriptions() == ['a (2)', 'b (2)']
+    checkboxes()['a'].value = True
+    assert list(actions_visible.options) == ['action-0', 'action-1']
+    assert descriptions() == ['a (2)', 'b (1)']
+    checkboxes()['b'].value = True
+    assert list(actions_visible.options) == ['action-1']
+    match_mode.value = 'any'
+    assert list(actions_visible.options) == ['action-0', 'action-1', 'action-2']
+    match_mode.value = 'all'
+    checkboxes()['a'].value = False
+    checkboxes()['b'].value = False
+    assert sorted(actions_visible.options) == ['action-0', 'action-1', 'action-2']
+
+    # new values show up after a refresh
+    project.actions['action-2'].tags = ['new']
+    browser.refresh(background=False)
+    assert descriptions() == ['a (2)', 'b (1)', 'new (1)']
+
+
+def test_browser_export_view_listener(project_path):
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    _create_actions(project, [['a']])
+    browser = expipe.Browser(project_path, background=False)
+    browser._export_view()
+    view = browser._export_view()
+    assert len(browser._listeners) == 1
+    tags_box = view.children[1].children[0].children[0]
+    project.actions['action-0'].tags = ['new']
+    browser.refresh(background=False)
+    assert [ch.description for ch in tags_box.children] == ['new (1)']
+
+
+def test_action_index_bitmaps(project_path):
+    from expipe.widgets.index import ActionIndex
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    _create_actions(project, [['a'], ['a', 'b'], ['b'], []])
+    index = ActionIndex(project)
+    index.update(batch_size=2)
+    assert len(index) == 4
+    mask = index.mask({'tags': ['a', 'b']})
+    assert index.select(mask) == ['action-1']
+    mask = index.mask({'tags': ['a', 'b']}, mode='any')
+    assert sorted(index.select(mask)) == ['action-0', 'action-1', 'action-2']
+    assert index.counts('tags', index.mask({'tags': ['b']})) == {'a': 1, 'b': 2}
+    project.delete_action('action-1')
+    index.update()
+    assert index.counts('tags') == {'a': 1, 'b': 1}
+    assert index.select(index.mask()) == ['action-0', 'action-2', 'action-3']
+
+
+def test_action_index_counts_after_growth(project_path):
+    from expipe.widgets.index import ActionIndex
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    _create_actions(project, [['a'], ['a', 'b']])
+    index = ActionIndex(project)
+    index.update()
+    mask = index.mask({'tags': ['a']})
+    # the indexing thread grows the bitmaps after the mask is computed
+    index._reserve(4 * len(mask))
+    assert index.counts('tags', mask) == {'a': 2, 'b': 1}
+    assert index.select(mask) == ['action-0', 'action-1']
+
+
+def test_search_index():
+    from expipe.widgets.search import SearchIndex
+    options = ['rat-001-recording', 'rat-002-surgery', 'mouse-001-recording',
+               'Rat-003-Recording']
+    index = SearchIndex(options)
+    assert index.search('recording') == (
+        ['rat-001-recording', 'mouse-001-recording', 'Rat-003-Recording'], 3)
+    assert index.search('rat recording')[0] == [
+        'rat-001-recording', 'Rat-003-Recording']
+    assert index.search('01 mo') == (['mouse-001-recording'], 1)
+    assert index.search('recording', limit=1) == (['rat-001-recording'], 3)
+    assert index.search('nothing') == ([], 0)
+    assert index.search('') == (options, 4)
+    matches, _ = index.search('surgrey rat', fuzzy=True)
+    assert matches[0] == 'rat-002-surgery'
+
+
+def test_search_field():
+    import ipywidgets
+    from expipe.widgets.display import _add_search_field
+    options = ['action-{}'.format(i) for i in range(50)]
+    select = ipywidgets.Select(options=options)
+    box = _add_search_field(select, limit=5, delay=0)
+    search, _, status = box.children
+    search.value = 'action-1'
+    assert list(select.options) == ['action-1'] + [
+        'action-1{}'.format(i) for i in range(4)]
+    assert status.value == 'Showing 5 of 11 matches'
+    search.value = ''
+    assert list(select.options) == options
+    # replacing the options resets the search
+    select.options = ['other-1', 'other-2']
+    search.value = '2'
+    assert list(select.options) == ['other-2']
+
+
+def test_paged_select(project_path):
+    from expipe.widgets.display import _paged_select
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(25):
+        project.create_action('action-{:02d}'.format(i))
+    keys = list(project.actions.keys())
+    assert project.actions.keys_window(20, 30) == keys[20:]
+
+    select, box = _paged_select(project.actions, page_size=10, delay=0)
+    search, controls, _ = box.children
+    previous_button, next_button, jump, status = controls.children
+    assert list(select.options) == keys[:10]
+    assert select.value == keys[0]
+    assert previous_button.disabled and not next_button.disabled
+    next_button.click()
+    next_button.click()
+    assert list(select.options) == keys[20:]
+    assert next_button.disabled
+    assert status.value == '21-25'
+    jump.value = '2'
+    assert list(select.options) == keys[10:20]
+    jump.value = keys[23]
+    assert list(select.options) == keys[20:]
+    assert select.value == keys[23]
+    jump.value = 'nothing'
+    assert status.value == 'No match for "nothing"'
+    jump.value = '-11'
+    assert select.value == 'action-11'
+
+    # search results are paged like the keys
+    search.value = 'action 1'
+    matches = [k for k in keys if '1' in k]
+    assert list(select.options) == matches[:10]
+    assert status.value == '1-10 of 12 matches'
+    next_button.click()
+    assert list(select.options) == matches[10:]
+    assert status.value == '11-12 of 12 matches'
+    jump.value = 'on-21'
+    assert select.value == 'action-21'
+    search.value = '~acton-24'
+    assert select.options[0] == 'action-24'
+    search.value = 'on-0 n-2'
+    assert list(select.options) == []
+    assert status.value == 'No matches'
+    search.value = ''
+    assert list(select.options) == keys[:10]
+    assert status.value == '1-10'
+
+
+def test_views(project_path):
+    from expipe.widgets import display
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    action = project.create_action(pytest.ACTION_ID)
+    action.create_module(pytest.ACTION_MODULE_ID, contents={'a': 1})
+    action.create_message('text', user='user')
+    project.create_entity(pytest.ENTITY_ID)
+    project.create_module(pytest.PROJECT_MODULE_ID, contents={'b': 2})
+    display.actions_view(project)
+    display.entities_view(project)
+    display.modules_view(project)
+    display.messages_view(action)
+    display.objects_and_modules_view(project.actions)
+    display.objects_and_messages_view(project.actions)
+    display.objects_and_modules_view(project.entities)
+
+
+def test_dict_html():
+    import numpy as np
+    import quantities as pq
+    from expipe.widgets.display import dict_html
+    html = dict_html({'a': 1, 'b': {'c': '<x>'}, 'd': [1, 2]})
+    assert html == (
+        '<ul><li>a: 1</li><li>b: <ul><li>c: &lt;x&gt;</li></ul></li>'
+        '<li>d: [1, 2]</li></ul>')
+    html = dict_html({
+        'long': list(range(100)),
+        'array': np.arange(1000.),
+        'quantity': [1., 2.] * pq.ms,
+        'deep': {'a': {'b': {'c': 1}}},
+    }, max_items=10, max_depth=2)
+    assert '… (100 items)' in html
+    assert 'array(shape=(1000,), dtype=float64, min=0.0, max=999.0)' in html
+    assert '[1., 2.] ms' in html
+    assert '<details><summary>1 items</summary><ul><li>b:' in html
+    html = dict_html({str(i): i for i in range(20)}, max_items=5)
+    assert html.count('<li>') == 6 and '… 15 more items' in html
+
+
+def test_display_object_html_cache(project_path):
+    from expipe.widgets import display
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    module = project.create_module(pytest.PROJECT_MODULE_ID, contents={'a': 1})
+    display._html_cache.clear()
+    display.display_object_html(module)
+    key = display._cache_key(module)
+    assert 'a: 1' in display._html_cache.get(key)
+    module['a'] = 20
+    new_key = display._cache_key(module)
+    display.display_object_html(module)
+    assert 'a: 20' in display._html_cache.get(new_key)
+
+
+def test_objects_and_modules_view_loading(project_path):
+    from expipe.widgets import display
+    project = expipe.require_project(project_path, pytest.PROJECT_ID)
+    for i in range(2):
+        action = project.create_action('action-{}'.format(i))
+        action.create_module('module', contents={'value': i})
+    display._html_cache.clear()
+    view = display.objects_and_modules_view(project.actions, background=False)
+    objects_box, modules_box, out = view.children
+    objects_select = objects_box.children[2]
+    modules_select = modules_box.children[1]
+
+    def shown():
+        return out.outputs[0]['data']['text/html']
+
+    assert list(modules_select.options) == ['module']
+    assert 'value: 0' in shown()
+    objects_select.value = 'action-1'
+    assert 'value: 1' in shown()
+    assert len(display._html_cache) == 2
+
+
+def test_latest_loader_drops_stale_requests():
+    import threading
+    from expipe.widgets.display import LatestLoader
+    loader = LatestLoader()
+    started, release = threading.Event(), threading.Event()
+    shown = []
+
+    def slow():
+        started.set()
+        release.wait()
+        return 'stale'
+
+    loader.submit(slow, shown.append)
+    started.wait()
+    loader.submit(lambda: 'skipped', shown.append)
+    loader.submit(lambda: 'latest', shown.append)
+    release.set()
+    loader.wait()
+    assert shown == ['latest']
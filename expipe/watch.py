@@ -0,0 +1,314 @@
+"""Watching a project for changes made by other processes.
+
+On Linux the project is watched with inotify, elsewhere, or when inotify
+is unavailable, the sizes and mtimes of all files are compared at an
+interval. Every change also drops what expipe has cached about the
+changed file, see `expipe.backends.filesystem.invalidate`. When inotify
+loses events, a `Change` with change "rescan" tells that any file of the
+project may have changed.
+"""
+import collections
+import ctypes
+import ctypes.util
+import errno
+import os
+import pathlib
+import select
+import struct
+import time
+
+from .backends.filesystem import invalidate
+from .datafiles import PARTIAL_SUFFIX
+from .manifest import IGNORED, categorize
+
+KINDS = {
+    'actions': 'action', 'entities': 'entity', 'modules': 'module',
+    'messages': 'message', 'data': 'data', 'templates': 'template',
+    'other': 'other'}
+
+Change = collections.namedtuple(
+    'Change', ['change', 'kind', 'owner', 'name', 'path'])
+RESCAN = 'rescan'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+    IN_ONLYDIR)
+EVENT = struct.Struct('iIII')
+
+
+def _change(rel, change, root):
+    category, name = categorize(rel)
+    owner = ''
+    if isinstance(name, tuple):
+        owner, name = name
+        if category == 'data':
+            owner = 'actions/' + owner
+    return Change(change, KINDS[category], owner, name, root / rel)
+
+
+def _ignored(rel):
+    return (rel.split('/', 1)[0] in IGNORED or
+            rel.endswith(PARTIAL_SUFFIX) or '.dedup-' in rel)
+
+
+def _scan(root):
+    """Sizes and mtimes of all files below `root` by relative path."""
+    files = {}
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        try:
+            entries = os.scandir(os.path.join(root, rel))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with entries:
+            for entry in entries:
+                name = rel + '/' + entry.name if rel else entry.name
+                if _ignored(name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(name)
+                    else:
+                        st = entry.stat(follow_symlinks=False)
+                        files[name] = st.st_size, st.st_mtime_ns
+                except FileNotFoundError:
+                    continue
+    return files
+
+
+def _merge(changes, rel, change):
+    """Add a change of a file to the changes of the current batch."""
+    previous = changes.pop(rel, None)
+    if previous == 'created':
+        if change == 'deleted':
+            return
+        change = 'created'
+    elif previous == 'deleted' and change == 'created':
+        change = 'modified'
+    changes[rel] = change
+
+
+class _Inotify:
+    def __init__(self, root):
+        path = ctypes.util.find_library('c') or 'libc.so.6'
+        libc = ctypes.CDLL(path, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = libc
+        self.root = root
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._dirs = {}
+        self.add_tree('')
+
+    def add(self, rel):
+        path = os.path.join(str(self.root), rel).encode()
+        wd = self._libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            code = ctypes.get_errno()
+            if code in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise OSError(code, 'inotify_add_watch failed for {}'.format(
+                path.decode()))
+        self._dirs[wd] = rel
+        return True
+
+    def add_tree(self, rel):
+        """Watch a directory and its subdirectories, returning the files
+        in them, which may have been created before they were watched."""
+        files = []
+        stack = [rel]
+        while stack:
+            rel = stack.pop()
+            if not self.add(rel):
+                continue
+            try:
+                entries = os.scandir(os.path.join(str(self.root), rel))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with entries:
+                for entry in entries:
+                    name = rel + '/' + entry.name if rel else entry.name
+                    if _ignored(name):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(name)
+                    else:
+                        files.append(name)
+        return files
+
+    def read(self, timeout):
+        """Changes by relative path, waiting up to `timeout` seconds.
+
+        Returns None if events were lost and the project must be
+        rescanned.
+        """
+        changes = collections.OrderedDict()
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return changes
+        overflow = False
+        while True:
+            try:
+                buffer = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, cookie, length = EVENT.unpack_from(buffer, offset)
+                offset += EVENT.size
+                name = buffer[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                parent = self._dirs.get(wd)
+                if parent is None:
+                    continue
+                name = os.fsdecode(name)
+                rel = parent + '/' + name if parent else name
+                if _ignored(rel):
+                    continue
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    if mask & IN_ISDIR:
+                        _merge(changes, rel, 'created')
+                        for file in self.add_tree(rel):
+                            _merge(changes, file, 'created')
+                    else:
+                        _merge(changes, rel, 'created')
+                elif mask & IN_CLOSE_WRITE:
+                    _merge(changes, rel, 'modified')
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    _merge(changes, rel, 'deleted')
+        return None if overflow else changes
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class Watcher:
+    """
+    Changes of the files of a project since the watcher was created.
+
+    Iterating over the watcher yields changes as they happen. Changes
+    made through expipe in this process are included. If inotify lost
+    events, `Change("rescan", "project", "", "", path)` is yielded
+    instead of the lost changes, and everything cached about the project
+    is dropped.
+
+    Parameters
+    ----------
+    path : str or pathlib.Path
+        Path to the project.
+    interval : float
+        Seconds between scans when polling, and the longest wait for
+        changes when iterating.
+    poll : bool
+        Scan the project at an interval instead of using inotify. If
+        None, poll only when inotify is unavailable.
+    """
+    def __init__(self, path, interval=1.0, poll=None):
+        self.root = pathlib.Path(path).absolute()
+        self.interval = interval
+        self._inotify = None
+        self._files = None
+        if not poll:
+            try:
+                self._inotify = _Inotify(self.root)
+            except (OSError, AttributeError):
+                if poll is False:
+                    raise
+        if self._inotify is None:
+            self._files = _scan(str(self.root))
+
+    @property
+    def method(self):
+        return 'polling' if self._inotify is None else 'inotify'
+
+    def _diff(self):
+        files = _scan(str(self.root))
+        old = self._files
+        changes = collections.OrderedDict()
+        for rel in sorted(set(old) | set(files)):
+            if rel not in old:
+                changes[rel] = 'created'
+            elif rel not in files:
+                changes[rel] = 'deleted'
+            elif old[rel] != files[rel]:
+                changes[rel] = 'modified'
+        self._files = files
+        return changes
+
+    def poll(self, timeout=0):
+        """Changes since the last call, waiting up to `timeout` seconds
+        for the first.
+
+        Returns
+        -------
+        changes : list
+            `Change(change, kind, owner, name, path)` tuples, named like
+            the events of `expipe.events`, or a single change "rescan" of
+            the project if events were lost.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            if self._inotify is not None:
+                remaining = max(0, deadline - time.monotonic())
+                changes = self._inotify.read(remaining)
+                if changes is None:
+                    # events were lost, forget everything cached and watch
+                    # the directories created meanwhile
+                    invalidate(self.root)
+                    self._inotify.add_tree('')
+                    return [Change(RESCAN, 'project', '', '', self.root)]
+            else:
+                changes = self._diff()
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                break
+            if self._inotify is None:
+                time.sleep(min(self.interval, remaining))
+        result = []
+        for rel, change in changes.items():
+            path = self.root / rel
+            invalidate(path)
+            result.append(_change(rel, change, self.root))
+        return result
+
+    def __iter__(self):
+        while True:
+            for change in self.poll(self.interval):
+                yield change
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def watch(project, interval=1.0, poll=None):
+    """Watch a project for changes, see `Watcher`."""
+    return Watcher(project.path, interval=interval, poll=poll)
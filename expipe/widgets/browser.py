@@ -3,12 +3,19 @@ import pathlib
 import uuid
 import json
 from collections import OrderedDict
+import importlib.util
+import threading
 from . import display
-try:
-    import pandas as pd
-    HAS_PANDAS = True
-except ImportError as e:
-    HAS_PANDAS = False
+from .index import ActionIndex
+from ..cliutils.misc import lazy_import
+HAS_PANDAS = importlib.util.find_spec('pandas') is not None
+
+
+@lazy_import
+def pd():
+    import pandas
+    return pandas
+
 try:
     import IPython.display as ipd
     import ipywidgets
@@ -16,66 +23,156 @@ try:
 except ImportError as e:
     HAS_IPYW = False
     IPYW_ERR = e
-try:
-    from tqdm import tqdm
-except:
-    def tqdm(x, **kw):
-        return x
+
 
 class Browser:
-    def __init__(self, project_path=None):
+    def __init__(self, project_path=None, background=True):
         if not HAS_IPYW:
             raise IPYW_ERR
         project_path = project_path or pathlib.Path.cwd()
         self.project_path = pathlib.Path(project_path)
         self.project = expipe.require_project(self.project_path)
 
-        self.action_attributes = OrderedDict([
-            ('tags', {}),
-            ('location', {}),
-            ('users', {}),
-            ('entities', {}),
-            ('datetime', {}),
-        ])
-        for action in tqdm(self.project.actions, desc='Indexing project'):
-            for key, container in self.action_attributes.items():
-                values = getattr(self.project.actions[action], key)
-                values = values if isinstance(values, expipe.core.PropertyList) else [values]
-                for attr in values:
-                    attr = str(attr)
-                    if attr in container:
-                        container[attr]['actions'].append(action)
-                    else:
-                        container[attr] = {
-                            'actions': [action],
-                            'state': False
-                        }
+        self.index = ActionIndex(self.project)
+        self._states = {}
+        self._listeners = []
+        self._export_listener = None
+        self._thread = None
+        self.refresh(background=background)
+
+    @property
+    def action_attributes(self):
+        with self.index.lock:
+            return OrderedDict(
+                (facet, {
+                    value: {
+                        'actions': sorted(self.index.actions(facet, value)),
+                        'state': self._states.get((facet, value), False)
+                    }
+                    for value in self.index.facet_values(facet)
+                })
+                for facet in self.index.facets
+            )
+
+    def refresh(self, background=True):
+        """
+        Index new and modified actions and drop deleted ones. Only actions
+        whose attributes changed since they were last indexed are read.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        if not background:
+            self.index.update(callback=self._on_index_progress)
+            return None
+        self._thread = threading.Thread(
+            target=self.index.update,
+            kwargs={'callback': self._on_index_progress}, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def wait(self, timeout=None):
+        """Wait for indexing in the background to finish."""
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _on_index_progress(self, index, done, total):
+        for listener in list(self._listeners):
+            listener(done, total)
 
     def _export_view(self):
-        actions_list = list(self.project.actions.keys())
         actions_visible = ipywidgets.SelectMultiple(
-            options=actions_list,
+            options=list(self.project.actions.keys()),
             disabled=False,
             layout={'height': '500px'}
         )
+        progress = ipywidgets.Label()
 
         checkbox_group = {}
+        checkbox_boxes = OrderedDict(
+            (facet, ipywidgets.VBox([])) for facet in self.index.facets)
+        checkboxes = {facet: OrderedDict() for facet in self.index.facets}
+        # checkboxes are updated from the indexing thread
+        view_lock = threading.RLock()
+
+        match_mode = ipywidgets.ToggleButtons(
+            options=[('Match all', 'all'), ('Match any', 'any')],
+            value='all',
+            tooltips=['Actions with all values checked in a group',
+                      'Actions with any of the values checked in a group'],
+        )
+
+        def update_visible():
+            selected = {}
+            for (facet, value), state in self._states.items():
+                if state:
+                    selected.setdefault(facet, []).append(value)
+            # the indexing thread may grow the bitmaps between calls
+            with self.index.lock:
+                mask = self.index.mask(selected, mode=match_mode.value)
+                names = self.index.select(mask) if selected else None
+                counts = {
+                    facet: self.index.counts(facet, mask)
+                    for facet in checkboxes}
+            if names is None:
+                actions_visible.options = list(self.project.actions.keys())
+            else:
+                actions_visible.options = names
+            for facet, current in checkboxes.items():
+                for value, ch in current.items():
+                    ch.description = '{} ({})'.format(
+                        value, counts[facet].get(value, 0))
 
         def on_checkbox_change(change):
             if change['name'] == 'value':
-                ch = change['owner']
-                group = checkbox_group[ch]
-                self.action_attributes[group][ch.description]['state'] = ch.value
-                actions = [set(g['actions']) for attr in self.action_attributes.values() for g in attr.values() if g['state']]
-                states = [g['state'] for attr in self.action_attributes.values() for g in attr.values()]
+                with view_lock:
+                    ch = change['owner']
+                    self._states[checkbox_group[ch]] = ch.value
+                    update_visible()
+
+        def on_mode_change(change):
+            with view_lock:
+                update_visible()
 
-                if not any(states):
-                    actions_visible.options = self.project.actions.keys()
-                else:
-                    actions = actions + [set(actions_list)]
-                    actions = set.intersection(*actions)
-                    actions_visible.options = actions
+        match_mode.observe(on_mode_change, names='value')
 
+        def update_checkboxes(done=None, total=None):
+            with view_lock:
+                _update_checkboxes(done, total)
+
+        def _update_checkboxes(done, total):
+            for facet, box in checkbox_boxes.items():
+                current = checkboxes[facet]
+                values = self.index.facet_values(facet)
+                if list(current) == values:
+                    continue
+                for value in set(current) - set(values):
+                    self._states.pop((facet, value), None)
+                    del checkbox_group[current.pop(value)]
+                for value in values:
+                    if value in current:
+                        continue
+                    ch = ipywidgets.Checkbox(
+                        value=self._states.get((facet, value), False),
+                        description=value,
+                        disabled=False
+                    )
+                    ch.observe(on_checkbox_change, names='value')
+                    current[value] = ch
+                    checkbox_group[ch] = (facet, value)
+                box.children = list(current.values())
+            if done is not None:
+                progress.value = (
+                    'Indexed {} of {} changed actions'.format(done, total)
+                    if done < total else
+                    'Indexed {} actions'.format(len(self.index)))
+            update_visible()
+
+        update_checkboxes()
+        # only the latest view is updated, earlier ones are replaced
+        if self._export_listener in self._listeners:
+            self._listeners.remove(self._export_listener)
+        self._export_listener = update_checkboxes
+        self._listeners.append(update_checkboxes)
 
         export_actions_name = ipywidgets.Text(
             placeholder='Action name for export')
@@ -95,27 +192,17 @@ class Browser:
                 print('You have to select from the list, "ctrl+a" for all') # TODO show text in widget
                 return
             action_for_export = self.project.require_action(export_actions_name.value)
-            df = []
-            tags = []
-            for action_name in actions:
-                a = self.project.actions[action_name]
-                v = {
-                    'action': action_name,
-                    'users': '//'.join(a.users),
-                    'entities': '//'.join(a.entities),
-                    'location': a.location,
-                    'datetime': a.datetime
-                }
-                for tag in a.tags:
-                    v[tag] = True
-                    tags.append(tag)
-                df.append(v)
+            df = self.project.actions.to_dataframe(
+                columns=['users', 'entities', 'location', 'datetime', 'tags'],
+                ids=list(actions))
+            df['users'] = df['users'].str.join('//')
+            df['entities'] = df['entities'].str.join('//')
+            df.index.name = 'action'
+            df = df.rename(columns=lambda c: c[len('tags.'):] if c.startswith('tags.') else c)
+            df = df.reset_index()
             csv_name = export_csv_name.value
             csv_name = csv_name.replace('.csv', '')
             action_for_export.data[csv_name] = csv_name + '.csv'
-            df = pd.DataFrame(df)
-            for tag in set(tags):
-                df[tag].fillna(False, inplace=True)
             df.to_csv(action_for_export.data_path(csv_name), index=False)
             print(
                 'Actions successfully exported.\n'
@@ -129,31 +216,19 @@ class Browser:
         )
         export_actions_button.on_click(on_export_actions)
 
-        checkbox_groups = []
-        checkbox_group_names = []
-        for name, value in self.action_attributes.items():
-            temp = []
-            for key in value:
-                ch = ipywidgets.Checkbox(
-                    value=False,
-                    description=key,
-                    disabled=False
-                )
-                ch.observe(on_checkbox_change, names='value')
-                temp.append(ch)
-                checkbox_group[ch] = name
-            box = ipywidgets.VBox(temp)
-            checkbox_groups.append(box)
-            checkbox_group_names.append(name)
-
         action_attributes = ipywidgets.Accordion(
-            checkbox_groups, layout={'height': '500px'})
-        for i, name in enumerate(checkbox_group_names):
+            list(checkbox_boxes.values()), layout={'height': '500px'})
+        for i, name in enumerate(checkbox_boxes):
             action_attributes.set_title(i, name.capitalize())
 
+        refresh_button = ipywidgets.Button(description='Refresh')
+        refresh_button.on_click(lambda change: self.refresh())
+
         actions_select = ipywidgets.VBox(
             [actions_visible, export_actions_name, export_csv_name, export_actions_button])
-        return ipywidgets.HBox([action_attributes, actions_select])
+        return ipywidgets.VBox([
+            ipywidgets.HBox([refresh_button, match_mode, progress]),
+            ipywidgets.HBox([action_attributes, actions_select])])
 
     def _action_modules_view(self):
         return display.objects_and_modules_view(self.project.actions)
@@ -1,4 +1,13 @@
+import collections
+import concurrent.futures
+import html
+import os
+import pathlib
+import threading
+import numpy as np
 import expipe
+from ..backends.filesystem import add_invalidator
+from .search import SearchIndex, Debouncer
 try:
     import IPython.display as ipd
     import ipywidgets
@@ -6,55 +15,423 @@ try:
 except ImportError:
     HAS_IPYW = False
 
-def _build_dict_tree(key, value):
-    contents = "<li>"
-    contents += "{}: ".format(key)
-    try:
-        items = value.items()
-        inner_contents = ""
-        for subkey, subvalue in items:
-            inner_contents += _build_dict_tree(subkey, subvalue)
-        if inner_contents != "":
-            contents += "<ul>{}</ul>".format(inner_contents)
-    except AttributeError:
-        contents += "{}".format(value)
-
-    contents += "</li>"
-
-    return contents
+MAX_ITEMS = 50
+MAX_DEPTH = 3
+MAX_NODES = 5000
+MAX_STRING = 1000
+
+
+class LRUCache:
+    """Thread safe mapping that keeps the `maxsize` most recently used items."""
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._items.move_to_end(key)
+            except KeyError:
+                return default
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def discard(self, predicate):
+        """Remove the items whose key satisfies the predicate."""
+        with self._lock:
+            for key in [key for key in self._items if predicate(key)]:
+                del self._items[key]
+
+
+_html_cache = LRUCache(256)
+
+
+def _invalidate_html(path):
+    # keys of objects are (path, mtime, size) of the rendered file
+    def stale(key):
+        if not isinstance(key, tuple) or not isinstance(key[0], str):
+            return False
+        return key[0] == str(path) or path in pathlib.Path(key[0]).parents
+    _html_cache.discard(stale)
+
+
+add_invalidator(_invalidate_html)
+
+
+def _is_container(value):
+    if isinstance(value, (str, bytes)):
+        return False
+    return isinstance(value, (list, tuple, np.ndarray)) or hasattr(value, 'items')
+
+
+def _unit(value):
+    dimensionality = getattr(value, 'dimensionality', None)
+    if dimensionality is None:
+        return ''
+    return ' ' + dimensionality.string
+
+
+def _short(text, max_length=MAX_STRING):
+    if len(text) > max_length:
+        text = text[:max_length] + '… ({} characters)'.format(len(text))
+    return html.escape(text)
+
+
+def _array_text(value, max_items):
+    unit = _unit(value)
+    magnitude = np.asarray(getattr(value, 'magnitude', value))
+    if magnitude.size <= max_items:
+        text = np.array2string(magnitude, threshold=max_items, separator=', ')
+        uncertainty = getattr(value, 'uncertainty', None)
+        if uncertainty is not None:
+            text += ' ± ' + np.array2string(
+                np.asarray(getattr(uncertainty, 'magnitude', uncertainty)),
+                threshold=max_items, separator=', ')
+        return html.escape(text + unit)
+    summary = ['shape={}'.format(magnitude.shape), 'dtype={}'.format(magnitude.dtype)]
+    if magnitude.dtype.kind in 'biuf':
+        with np.errstate(invalid='ignore'):
+            summary.append('min={}'.format(np.nanmin(magnitude)))
+            summary.append('max={}'.format(np.nanmax(magnitude)))
+    return html.escape('array({}){}'.format(', '.join(summary), unit))
+
+
+class _HtmlRenderer:
+    """
+    Render nested dictionaries as nested HTML lists. Parts are collected
+    in a list and joined once, sequences and arrays longer than
+    `max_items` are summarized, levels deeper than `max_depth` are
+    collapsed in expandable <details> elements and rendering stops after
+    `max_nodes` entries.
+    """
+    def __init__(self, max_items=MAX_ITEMS, max_depth=MAX_DEPTH,
+                 max_nodes=MAX_NODES):
+        self.max_items = max_items
+        self.max_depth = max_depth
+        self.max_nodes = max_nodes
+        self.nodes = 0
+        self.parts = []
+
+    def render(self, dictionary):
+        self.parts.append('<ul>')
+        self._items(dictionary.items(), len(dictionary), 0)
+        self.parts.append('</ul>')
+        return ''.join(self.parts)
+
+    def _items(self, items, count, depth):
+        for i, (key, value) in enumerate(items):
+            if i >= self.max_items or self.nodes >= self.max_nodes:
+                self.parts.append(
+                    '<li>… {} more items</li>'.format(count - i))
+                break
+            self._node(key, value, depth)
+
+    def _children(self, value):
+        if isinstance(value, (str, bytes, np.ndarray)):
+            return None
+        if hasattr(value, 'items'):
+            return value.items(), len(value)
+        if isinstance(value, (list, tuple)) and any(
+                _is_container(v) for v in value[:self.max_items]):
+            return enumerate(value), len(value)
+        return None
+
+    def _leaf(self, value):
+        if isinstance(value, np.ndarray):
+            return _array_text(value, self.max_items)
+        if isinstance(value, (list, tuple)):
+            items = [repr(v) for v in value[:self.max_items]]
+            if len(value) > self.max_items:
+                items.append('… ({} items)'.format(len(value)))
+            return _short('[{}]'.format(', '.join(items)))
+        return _short(str(value))
+
+    def _node(self, key, value, depth):
+        self.nodes += 1
+        parts = self.parts
+        parts.append('<li>{}: '.format(html.escape(str(key))))
+        children = self._children(value)
+        if children is None:
+            parts.append(self._leaf(value))
+        else:
+            items, count = children
+            if count > 0:
+                collapsed = depth + 1 >= self.max_depth
+                if collapsed:
+                    parts.append(
+                        '<details><summary>{} items</summary>'.format(count))
+                parts.append('<ul>')
+                self._items(items, count, depth + 1)
+                parts.append('</ul>')
+                if collapsed:
+                    parts.append('</details>')
+        parts.append('</li>')
+
+
+def dict_html(dictionary, max_items=MAX_ITEMS, max_depth=MAX_DEPTH,
+              max_nodes=MAX_NODES):
+    """Render a nested dictionary as nested HTML lists.
+
+    Quantities and arrays are rendered at the leaves. Sequences and
+    arrays longer than `max_items` are summarized, levels deeper than
+    `max_depth` are collapsed and rendering stops after `max_nodes`
+    entries.
+    """
+    renderer = _HtmlRenderer(
+        max_items=max_items, max_depth=max_depth, max_nodes=max_nodes)
+    return renderer.render(dictionary)
+
+
+def display_dict_html(dictionary, cache_key=None):
+    """Display a dictionary as HTML, reusing the HTML rendered earlier for
+    the same `cache_key` if given."""
+    html_ = None if cache_key is None else _html_cache.get(cache_key)
+    if html_ is None:
+        html_ = dict_html(dictionary)
+        if cache_key is not None:
+            _html_cache.put(cache_key, html_)
+    ipd.clear_output()
+    ipd.display_html(html_, raw=True)
 
 
-def dict_html(dictionary):
-    output = ""
-    for key, value in dictionary.items():
-        output += _build_dict_tree(key, value)
-    return "<ul>{}</ul>".format(output)
+def _cache_key(obj):
+    """(path, mtime, size) of the file backing an object, or None."""
+    path = pathlib.Path(obj._backend.path)
+    if isinstance(obj, expipe.core.ExpipeSubObject):
+        path = path / 'attributes.yaml'
+    else:
+        path = path.with_suffix('.yaml')
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return str(path), st.st_mtime_ns, st.st_size
+
+
+def _cached_html(obj):
+    key = _cache_key(obj)
+    return None if key is None else _html_cache.get(key)
+
+
+def object_html(obj):
+    """HTML of the attributes of an action or entity or the contents of a
+    module, message or template. The file is only read and rendered again
+    when it has changed since it was last rendered."""
+    key = _cache_key(obj)
+    html_ = None if key is None else _html_cache.get(key)
+    if html_ is None:
+        if isinstance(obj, expipe.core.ExpipeSubObject):
+            contents = obj.attributes
+        else:
+            contents = obj.contents
+        html_ = dict_html(contents or {})
+        if key is not None:
+            _html_cache.put(key, html_)
+    return html_
 
 
-def display_dict_html(dictionary):
+def display_object_html(obj):
     ipd.clear_output()
-    dictionary = expipe.backends.filesystem.convert_quantities(dictionary)
-    ipd.display_html(dict_html(dictionary), raw=True)
+    ipd.display_html(object_html(obj), raw=True)
+
+
+def _set_html(out, html_):
+    # assigning the outputs directly is safe from worker threads, unlike
+    # displaying inside the output context
+    out.outputs = ({
+        'output_type': 'display_data',
+        'data': {'text/html': html_, 'text/plain': ''},
+        'metadata': {}},)
+
+
+class LatestLoader:
+    """
+    Run loading requests on a worker thread, keeping only the latest.
+
+    Every request gets a generation number. A request that is superseded
+    before it starts is skipped and the result of a request that is
+    superseded while loading is dropped, so only the most recent selection
+    is shown.
+    """
+    def __init__(self, background=True):
+        self.background = background
+        self._generation = 0
+        self._lock = threading.RLock()
+        self._executor = None
+        self._future = None
+
+    def cancel(self):
+        with self._lock:
+            self._generation += 1
+
+    def submit(self, load, show):
+        """Call `show(load())` unless a newer request arrives meanwhile."""
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+
+        def run():
+            if generation != self._generation:
+                return
+            try:
+                result = load()
+            except Exception as e:
+                result = e
+            with self._lock:
+                if generation == self._generation:
+                    show(result)
+
+        if not self.background:
+            run()
+            return
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1)
+        self._future = self._executor.submit(run)
+
+    def wait(self):
+        """Wait for the latest request to finish."""
+        if self._future is not None:
+            self._future.result()
+
+
+def _paged_select(objects, page_size=100, height='200px', delay=0.2):
+    """
+    Select box that only fetches one page of keys at a time from the
+    backend, with previous/next buttons, a field to jump to a page number
+    or a name and a search field. Search results are paged like the keys,
+    tokens separated by whitespace must all match and queries starting
+    with "~" are fuzzy. The search index is built on the first search or
+    jump to a name and rebuilt after the search is cleared.
+
+    Returns
+    -------
+    select : ipywidgets.Select
+        The select box holding the current page.
+    box : ipywidgets.VBox
+        The select box together with the search field and paging controls.
+    """
+    first_page = objects.keys_window(0, page_size + 1)
+    select = ipywidgets.Select(
+        options=first_page[:page_size],
+        disabled=False,
+        value=first_page[0] if first_page else None,
+        layout={'height': height}
+    )
+    search_widget = ipywidgets.Text(placeholder='Search')
+    previous_button = ipywidgets.Button(
+        icon='chevron-left', tooltip='Previous page', layout={'width': '40px'})
+    next_button = ipywidgets.Button(
+        icon='chevron-right', tooltip='Next page', layout={'width': '40px'})
+    jump = ipywidgets.Text(
+        placeholder='Go to page or name', continuous_update=False,
+        layout={'width': '150px'})
+    status = ipywidgets.Label()
+    # matches is None unless searching, then pages are taken from it
+    state = {'page': 0, 'matches': None, 'index': None}
+
+    def search_index():
+        if state['index'] is None:
+            state['index'] = SearchIndex(list(objects))
+        return state['index']
+
+    def window(start, stop):
+        if state['matches'] is None:
+            return objects.keys_window(start, stop)
+        return state['matches'][start:stop]
+
+    def show(page, keys, value=None):
+        state['page'] = page
+        select.options = keys[:page_size]
+        if value is not None:
+            select.value = value
+        previous_button.disabled = page == 0
+        next_button.disabled = len(keys) <= page_size
+        if keys:
+            start = page * page_size
+            status.value = '{}-{}'.format(
+                start + 1, start + len(keys[:page_size]))
+            if state['matches'] is not None:
+                status.value += ' of {} matches'.format(len(state['matches']))
+        elif state['matches'] is not None and page == 0:
+            status.value = 'No matches'
+        else:
+            status.value = 'Page {} is empty'.format(page + 1)
+
+    def load(page, value=None):
+        start = page * page_size
+        show(page, window(start, start + page_size + 1), value)
+
+    def find(name):
+        # an exact match or else the first search match among the keys paged
+        index = search_index()
+        keys = index.options if state['matches'] is None else state['matches']
+        positions = {key: i for i, key in enumerate(keys)}
+        if name in positions:
+            return positions[name]
+        for match in index.search(name)[0]:
+            if match in positions:
+                return positions[match]
+        return None
+
+    def on_jump(change):
+        text = change['new'].strip()
+        if text == '':
+            return
+        if text.isdigit() and int(text) > 0:
+            load(int(text) - 1)
+            return
+        position = find(text)
+        if position is None:
+            status.value = 'No match for "{}"'.format(text)
+            return
+        page = position // page_size
+        start = page * page_size
+        keys = window(start, start + page_size + 1)
+        show(page, keys, value=keys[position - start])
+
+    def search(text):
+        is_fuzzy = text.startswith('~')
+        text = text.lstrip('~')
+        if text.strip() == '':
+            state['matches'] = None
+            state['index'] = None
+        else:
+            state['matches'] = search_index().search(text, fuzzy=is_fuzzy)[0]
+        load(0)
 
+    debounced_search = Debouncer(search, delay=delay)
+    previous_button.on_click(lambda b: load(max(state['page'] - 1, 0)))
+    next_button.on_click(lambda b: load(state['page'] + 1))
+    jump.observe(on_jump, names='value')
+    search_widget.observe(
+        lambda change: debounced_search(change['new']), names='value')
+    show(0, first_page)
+    controls = ipywidgets.HBox([previous_button, next_button, jump, status])
+    return select, ipywidgets.VBox([search_widget, controls, select])
 
-def modules_view(holder):
-    modules_list = list(holder.modules.keys())
-    if len(modules_list) == 0:
-        modules_list_empty = True
-    else:
-        modules_list_empty = False
-        module_first = holder.modules[modules_list[0]]
 
-    modules_select = ipywidgets.Select(
-        options=modules_list,
-        disabled=False,
-        value=None if modules_list_empty else modules_list[0],
-        layout={'height': '200px'}
-    )
+def modules_view(holder):
+    modules = holder.modules
+    modules_select, modules_box = _paged_select(modules)
     out = ipywidgets.Output(layout={'height': '250px'})
-    if not modules_list_empty:
+    if modules_select.value is not None:
         with out:
-            display_dict_html(module_first.contents)
+            display_object_html(modules[modules_select.value])
 
 
     def on_select_module(change):
@@ -65,32 +442,20 @@ def modules_view(holder):
             else:
                 module = holder.modules[change['owner'].value]
                 with out:
-                    display_dict_html(module.contents)
+                    display_object_html(module)
 
     modules_select.observe(on_select_module, names='value')
-    search_select = _add_search_field(modules_select)
 
-    return ipywidgets.HBox([search_select, out], style={'overflow': 'scroll'})
+    return ipywidgets.HBox([modules_box, out], style={'overflow': 'scroll'})
 
 
 def messages_view(holder):
-    messages_list = list(holder.messages.keys())
-    if len(messages_list) == 0:
-        messages_list_empty = True
-    else:
-        messages_list_empty = False
-        message_first = holder.messages[messages_list[0]]
-
-    messages_select = ipywidgets.Select(
-        options=messages_list,
-        disabled=False,
-        value=None if messages_list_empty else messages_list[0],
-        layout={'height': '200px'}
-    )
+    messages = holder.messages
+    messages_select, messages_box = _paged_select(messages)
     out = ipywidgets.Output(layout={'height': '250px'})
-    if not messages_list_empty:
+    if messages_select.value is not None:
         with out:
-            display_dict_html(message_first.contents)
+            display_object_html(messages[messages_select.value])
 
 
     def on_select_message(change):
@@ -101,12 +466,11 @@ def messages_view(holder):
             else:
                 message = holder.messages[change['owner'].value]
                 with out:
-                    display_dict_html(message.contents)
+                    display_object_html(message)
 
     messages_select.observe(on_select_message, names='value')
-    search_select = _add_search_field(messages_select)
 
-    return ipywidgets.HBox([search_select, out], style={'overflow': 'scroll'})
+    return ipywidgets.HBox([messages_box, out], style={'overflow': 'scroll'})
 
 
 def templates_view(project):
@@ -127,7 +491,7 @@ def templates_view(project):
     out = ipywidgets.Output(layout={'height': '250px'})
     if not templates_list_empty:
         with out:
-            display_dict_html(template_first.contents)
+            display_object_html(template_first)
 
     def on_select_template(change):
         if change['name'] == 'value':
@@ -137,7 +501,7 @@ def templates_view(project):
             else:
                 template = project.templates[change['owner'].value]
                 with out:
-                    display_dict_html(template.contents)
+                    display_object_html(template)
 
     templates_select.observe(on_select_template, names='value')
     search_select = _add_search_field(templates_select)
@@ -146,24 +510,12 @@ def templates_view(project):
 
 
 def entities_view(project):
-    entities_list = list(project.entities.keys())
-    if len(entities_list) == 0:
-        entities_list_empty = True
-    else:
-        entities_list_empty = False
-        entity_first = project.entities[entities_list[0]]
-
-    entities_select = ipywidgets.Select(
-        options=entities_list,
-        disabled=False,
-        value=None if entities_list_empty else entities_list[0],
-        layout={'height': '200px'}
-    )
+    entities_select, entities_box = _paged_select(project.entities)
 
     out = ipywidgets.Output(layout={'height': '250px'})
-    if not entities_list_empty:
+    if entities_select.value is not None:
         with out:
-            display_dict_html(entity_first.attributes)
+            display_object_html(project.entities[entities_select.value])
 
     def on_select_entity(change):
         if change['name'] == 'value':
@@ -173,33 +525,20 @@ def entities_view(project):
             else:
                 entity = project.entities[change['owner'].value]
                 with out:
-                    display_dict_html(entity.attributes)
+                    display_object_html(entity)
 
     entities_select.observe(on_select_entity, names='value')
-    search_select = _add_search_field(entities_select)
 
-    return ipywidgets.HBox([search_select, out], style={'overflow': 'scroll'})
+    return ipywidgets.HBox([entities_box, out], style={'overflow': 'scroll'})
 
 
 def actions_view(project):
-    actions_list = list(project.actions.keys())
-    if len(actions_list) == 0:
-        actions_list_empty = True
-    else:
-        actions_list_empty = False
-        action_first = project.actions[actions_list[0]]
-
-    actions_select = ipywidgets.Select(
-        options=actions_list,
-        disabled=False,
-        value=None if actions_list_empty else actions_list[0],
-        layout={'height': '200px'}
-    )
+    actions_select, actions_box = _paged_select(project.actions)
 
     out = ipywidgets.Output(layout={'height': '250px'})
-    if not actions_list_empty:
+    if actions_select.value is not None:
         with out:
-            display_dict_html(action_first.attributes)
+            display_object_html(project.actions[actions_select.value])
 
     def on_select_action(change):
         if change['name'] == 'value':
@@ -209,153 +548,164 @@ def actions_view(project):
             else:
                 action = project.actions[change['owner'].value]
                 with out:
-                    display_dict_html(action.attributes)
+                    display_object_html(action)
 
     actions_select.observe(on_select_action, names='value')
-    search_select = _add_search_field(actions_select)
 
-    return ipywidgets.HBox([search_select, out], style={'overflow': 'scroll'})
+    return ipywidgets.HBox([actions_box, out], style={'overflow': 'scroll'})
 
 
-def _add_search_field(selectbox):
+def _add_search_field(selectbox, limit=1000, delay=0.2, fuzzy=False):
+    """
+    Add a search field above a select box. Tokens separated by whitespace
+    must all match, and queries starting with "~" are fuzzy. The search
+    index is built on the first search and rebuilt when the options of
+    the select box are replaced.
+    """
     search_widget = ipywidgets.Text(placeholder='Search')
-    orig_list = list(selectbox.options)
+    status = ipywidgets.Label()
+    state = {
+        'options': list(selectbox.options),
+        'index': None,
+        'updating': False,
+    }
+
+    def set_options(options):
+        state['updating'] = True
+        try:
+            selectbox.options = options
+        finally:
+            state['updating'] = False
+
+    def on_options_change(change):
+        if not state['updating']:
+            state['options'] = list(change['new'])
+            state['index'] = None
+            search_widget.value = ''
+            status.value = ''
+
+    def search(search_input):
+        is_fuzzy = fuzzy or search_input.startswith('~')
+        search_input = search_input.lstrip('~')
+        if search_input.strip() == '':
+            # Reset search field
+            set_options(state['options'])
+            status.value = ''
+            return
+        if state['index'] is None:
+            state['index'] = SearchIndex(state['options'])
+        new_options, total = state['index'].search(
+            search_input, limit=limit, fuzzy=is_fuzzy)
+        set_options(new_options)
+        status.value = 'Showing {} of {} matches'.format(len(new_options), total)
+
+    debounced_search = Debouncer(search, delay=delay)
+
     # Wire the search field to the checkboxes
     def on_text_change(change):
-        search_input = change['new']
-        if search_input == '':
-            # Reset search field
-            new_options = orig_list
-        else:
-            # Filter by search field.
-            new_options = [a for a in orig_list if search_input in a]
-        selectbox.options = new_options
+        debounced_search(change['new'])
 
     search_widget.observe(on_text_change, names='value')
-    return ipywidgets.VBox([search_widget, selectbox])
+    selectbox.observe(on_options_change, names='options')
+    return ipywidgets.VBox([search_widget, selectbox, status])
 
 
-def objects_and_modules_view(objects):
-    objects_list = list(objects.keys())
-    if len(objects_list) == 0:
-        objects_list_empty = True
-        modules_list_empty = True
-        object_first_modules = []
-        object_first = None
-    else:
-        objects_list_empty = False
-        object_first = objects[objects_list[0]]
-        object_first_modules = list(object_first.modules.keys())
-        if len(object_first_modules) == 0:
-            modules_list_empty = True
-        else:
-            modules_list_empty = False
-            module_first = object_first.modules[object_first_modules[0]]
+LOADING_HTML = '<i>Loading…</i>'
 
-    objects_select = ipywidgets.Select(
-        options=objects_list,
-        disabled=False,
-        value=None if objects_list_empty else objects_list[0],
-        layout={'height': '200px'}
-    )
-    modules_select = ipywidgets.Select(
-        options=object_first_modules,
+
+def _objects_and_children_view(objects, children, background=True):
+    objects_select, objects_box = _paged_select(objects)
+    children_select = ipywidgets.Select(
+        options=[],
         disabled=False,
-        value=None if modules_list_empty else object_first_modules[0],
+        value=None,
         layout={'height': '200px'}
     )
     out = ipywidgets.Output(layout={'height': '250px'})
-    if not modules_list_empty:
-        with out:
-            display_dict_html(module_first.contents)
+    keys_loader = LatestLoader(background)
+    contents_loader = LatestLoader(background)
+    curr_state = {'curr_object': None}
+
+    def show_error(error):
+        _set_html(out, '<pre>{}</pre>'.format(html.escape(repr(error))))
+
+    def show_keys(keys):
+        if isinstance(keys, Exception):
+            show_error(keys)
+            return
+        children_select.options = keys
+        if keys:
+            children_select.value = keys[0]
+        else:
+            _set_html(out, dict_html({}))
 
-    curr_state = {'curr_object': object_first}
+    def show_contents(contents):
+        if isinstance(contents, Exception):
+            show_error(contents)
+        else:
+            _set_html(out, contents)
+
+    def select_object(object_id):
+        contents_loader.cancel()
+        children_select.options = []
+        if object_id is None:
+            keys_loader.cancel()
+            curr_state['curr_object'] = None
+            _set_html(out, dict_html({}))
+            return
+        curr_object = objects[object_id]
+        curr_state['curr_object'] = curr_object
+        _set_html(out, LOADING_HTML)
+        keys_loader.submit(
+            lambda: list(children(curr_object).keys()), show_keys)
+
+    def select_child(child_id):
+        curr_object = curr_state['curr_object']
+        if child_id is None or curr_object is None:
+            contents_loader.cancel()
+            return
+        child = children(curr_object)[child_id]
+        html_ = _cached_html(child)
+        if html_ is not None:
+            contents_loader.cancel()
+            _set_html(out, html_)
+            return
+        _set_html(out, LOADING_HTML)
+        contents_loader.submit(lambda: object_html(child), show_contents)
 
     def on_select_object(change):
         if change['name'] == 'value':
-            curr_object = objects[change['owner'].value]
-            curr_state['curr_object'] = curr_object
-            modules_select.options = curr_object.modules.keys()
+            select_object(change['owner'].value)
 
-    def on_select_module(change):
+    def on_select_child(change):
         if change['name'] == 'value':
-            module_id = change['owner'].value
-            if module_id is not None:
-                module = curr_state['curr_object'].modules[module_id]
-                contents = module.contents
-            else:
-                contents = {}
-            with out:
-                display_dict_html(contents)
+            select_child(change['owner'].value)
 
     objects_select.observe(on_select_object, names='value')
-    modules_select.observe(on_select_module, names='value')
-    search_object_select = _add_search_field(objects_select)
-    search_modules_select = _add_search_field(modules_select)
+    children_select.observe(on_select_child, names='value')
+    search_children_select = _add_search_field(children_select)
+    select_object(objects_select.value)
 
     return ipywidgets.HBox(
-        [search_object_select, search_modules_select, out],
+        [objects_box, search_children_select, out],
         style={'overflow': 'scroll'})
 
-def objects_and_messages_view(objects):
-    objects_list = list(objects.keys())
-    if len(objects_list) == 0:
-        objects_list_empty = True
-        messages_list_empty = True
-        object_first_messages = []
-        object_first = None
-    else:
-        objects_list_empty = False
-        object_first = objects[objects_list[0]]
-        object_first_messages = list(object_first.messages.keys())
-        if len(object_first_messages) == 0:
-            messages_list_empty = True
-        else:
-            messages_list_empty = False
-            message_first = object_first.messages[object_first_messages[0]]
 
-    objects_select = ipywidgets.Select(
-        options=objects_list,
-        disabled=False,
-        value=None if objects_list_empty else objects_list[0],
-        layout={'height': '200px'}
-    )
-    messages_select = ipywidgets.Select(
-        options=object_first_messages,
-        disabled=False,
-        value=None if messages_list_empty else object_first_messages[0],
-        layout={'height': '200px'}
-    )
-    out = ipywidgets.Output(layout={'height': '250px'})
-    if not messages_list_empty:
-        with out:
-            display_dict_html(message_first.contents)
-
-    curr_state = {'curr_object': object_first}
-
-    def on_select_object(change):
-        if change['name'] == 'value':
-            curr_object = objects[change['owner'].value]
-            curr_state['curr_object'] = curr_object
-            messages_select.options = curr_object.messages.keys()
-
-    def on_select_message(change):
-        if change['name'] == 'value':
-            message_id = change['owner'].value
-            if message_id is not None:
-                message = curr_state['curr_object'].messages[message_id]
-                contents = message.contents
-            else:
-                contents = {}
-            with out:
-                display_dict_html(contents)
-
-
-    objects_select.observe(on_select_object, names='value')
-    messages_select.observe(on_select_message, names='value')
-    search_object_select = _add_search_field(objects_select)
-    search_message_select = _add_search_field(messages_select)
-
-    return ipywidgets.HBox(
-        [search_object_select, search_message_select, out],
-        style={'overflow': 'scroll'})
+def objects_and_modules_view(objects, background=True):
+    """
+    Select an object and one of its modules to show. Modules are listed
+    and loaded on a worker thread, and recently viewed modules are shown
+    from a cache.
+    """
+    return _objects_and_children_view(
+        objects, lambda obj: obj.modules, background=background)
+
+
+def objects_and_messages_view(objects, background=True):
+    """
+    Select an object and one of its messages to show. Messages are listed
+    and loaded on a worker thread, and recently viewed messages are shown
+    from a cache.
+    """
+    return _objects_and_children_view(
+        objects, lambda obj: obj.messages, background=background)
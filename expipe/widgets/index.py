@@ -0,0 +1,250 @@
+import datetime as dt
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+FACETS = ['tags', 'location', 'users', 'entities', 'datetime']
+LIST_FACETS = ['tags', 'users', 'entities']
+
+
+def _facet_values(attributes, facet):
+    from ..core import datetime_format
+    value = attributes.get(facet)
+    if facet in LIST_FACETS:
+        return [str(v) for v in value or []]
+    if facet == 'datetime' and value is not None:
+        try:
+            value = dt.datetime.strptime(value, datetime_format)
+        except ValueError:
+            pass
+    return [str(value)]
+
+
+class ActionIndex:
+    """
+    Index of action attribute values used by the browser facets.
+
+    Every action is given an ordinal and every facet value a boolean
+    bitmap over the ordinals, so that filtering and counting are
+    vectorized operations on the bitmaps.
+
+    The index is built incrementally: `update` only re-reads the actions
+    whose attribute file is new or has a different mtime than when it was
+    last read, and drops deleted actions.
+    """
+    def __init__(self, project, facets=None):
+        self.project = project
+        self.facets = list(facets or FACETS)
+        self.lock = threading.RLock()
+        self._mtimes = {}
+        self._values = {}
+        self._ordinals = {}
+        self._names = np.empty(0, dtype=object)
+        self._alive = np.zeros(0, dtype=bool)
+        self._bitmaps = OrderedDict((facet, {}) for facet in self.facets)
+        self._matrices = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def names(self):
+        with self.lock:
+            return list(self._values)
+
+    def changes(self):
+        """Return the names of new or modified actions and of deleted ones."""
+        actions_path = self.project.path / 'actions'
+        mtimes = {}
+        with os.scandir(actions_path) as entries:
+            for entry in entries:
+                try:
+                    st = os.stat(os.path.join(entry.path, 'attributes.yaml'))
+                except (FileNotFoundError, NotADirectoryError):
+                    continue
+                mtimes[entry.name] = st.st_mtime_ns
+        changed = sorted(
+            name for name, mtime in mtimes.items()
+            if self._mtimes.get(name) != mtime)
+        deleted = [name for name in self._mtimes if name not in mtimes]
+        return changed, deleted, mtimes
+
+    def update(self, batch_size=500, callback=None, jobs=None):
+        """Re-read new and modified actions.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of actions read between calls to `callback`.
+        callback : callable
+            Called as `callback(index, done, total)` after each batch.
+        jobs : int
+            Number of processes reading attribute files.
+
+        Returns
+        -------
+        changed : list
+            Names of the actions that were added, modified or deleted.
+        """
+        changed, deleted, mtimes = self.changes()
+        with self.lock:
+            for name in deleted:
+                self._remove(name)
+                del self._mtimes[name]
+        total = len(changed)
+        if deleted and callback is not None:
+            callback(self, 0, total)
+        for start in range(0, total, batch_size):
+            batch = changed[start:start + batch_size]
+            results = list(self.project.actions.iter_attributes(
+                names=batch, jobs=jobs))
+            with self.lock:
+                self._reserve(len(self._ordinals) + len(results))
+                for name, attributes in results:
+                    self._remove(name)
+                    self._add(name, attributes)
+                    self._mtimes[name] = mtimes[name]
+            if callback is not None:
+                callback(self, min(start + batch_size, total), total)
+        return changed + deleted
+
+    def _reserve(self, size):
+        capacity = len(self._alive)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 1024)
+
+        def grow(array):
+            result = np.zeros(capacity, dtype=array.dtype)
+            result[:len(array)] = array
+            return result
+
+        self._names = grow(self._names)
+        self._alive = grow(self._alive)
+        for bitmaps in self._bitmaps.values():
+            for value, bitmap in bitmaps.items():
+                bitmaps[value] = grow(bitmap)
+        self._matrices.clear()
+
+    def _add(self, name, attributes):
+        ordinal = self._ordinals.get(name)
+        if ordinal is None:
+            ordinal = len(self._ordinals)
+            self._reserve(ordinal + 1)
+            self._ordinals[name] = ordinal
+            self._names[ordinal] = name
+        values = {
+            facet: _facet_values(attributes, facet) for facet in self.facets}
+        self._values[name] = values
+        self._alive[ordinal] = True
+        for facet, facet_values in values.items():
+            bitmaps = self._bitmaps[facet]
+            for value in facet_values:
+                bitmap = bitmaps.get(value)
+                if bitmap is None:
+                    bitmap = bitmaps[value] = np.zeros(
+                        len(self._alive), dtype=bool)
+                    self._matrices.pop(facet, None)
+                bitmap[ordinal] = True
+            self._matrices.pop(facet, None)
+
+    def _remove(self, name):
+        values = self._values.pop(name, None)
+        if values is None:
+            return
+        ordinal = self._ordinals[name]
+        self._alive[ordinal] = False
+        for facet, facet_values in values.items():
+            bitmaps = self._bitmaps[facet]
+            for value in facet_values:
+                bitmap = bitmaps.get(value)
+                if bitmap is None:
+                    continue
+                bitmap[ordinal] = False
+                if not bitmap.any():
+                    del bitmaps[value]
+            self._matrices.pop(facet, None)
+
+    def _matrix(self, facet):
+        # values x ordinals matrix of a facet, rebuilt only after changes
+        matrix = self._matrices.get(facet)
+        if matrix is None:
+            bitmaps = self._bitmaps[facet]
+            values = list(bitmaps)
+            if values:
+                data = np.vstack([bitmaps[value] for value in values])
+            else:
+                data = np.zeros((0, len(self._alive)), dtype=bool)
+            matrix = self._matrices[facet] = (values, data)
+        return matrix
+
+    def facet_values(self, facet):
+        with self.lock:
+            return list(self._bitmaps[facet])
+
+    def bitmap(self, facet, value):
+        """Boolean array over ordinals of the actions with a facet value."""
+        with self.lock:
+            bitmap = self._bitmaps[facet].get(value)
+            if bitmap is None:
+                return np.zeros(len(self._alive), dtype=bool)
+            return bitmap.copy()
+
+    def mask(self, selected=None, mode='all'):
+        """Boolean array over ordinals of the actions matching a selection.
+
+        Parameters
+        ----------
+        selected : dict
+            Mapping of facet to selected values. Different facets are
+            always combined with AND.
+        mode : str
+            Combine values selected within a facet with AND ("all") or
+            OR ("any").
+        """
+        if mode not in ['all', 'any']:
+            raise ValueError('Expected "mode" to be "all" or "any"')
+        with self.lock:
+            result = self._alive.copy()
+            for facet, values in (selected or {}).items():
+                values = list(values)
+                if not values:
+                    continue
+                bitmaps = self._bitmaps[facet]
+                missing = np.zeros(len(self._alive), dtype=bool)
+                stack = [bitmaps.get(value, missing) for value in values]
+                if mode == 'all':
+                    result &= np.logical_and.reduce(stack)
+                else:
+                    result &= np.logical_or.reduce(stack)
+            return result
+
+    def select(self, mask):
+        """Names of the actions in a mask."""
+        with self.lock:
+            return list(self._names[np.flatnonzero(mask[:len(self._names)])])
+
+    def counts(self, facet, mask=None):
+        """Number of actions in the mask for each value of a facet."""
+        with self.lock:
+            values, matrix = self._matrix(facet)
+            if mask is None:
+                mask = self._alive
+            elif len(mask) != len(self._alive):
+                # computed before the bitmaps grew, new actions are unmasked
+                padded = np.zeros(len(self._alive), dtype=bool)
+                padded[:len(mask)] = mask[:len(padded)]
+                mask = padded
+            selected = np.flatnonzero(mask)
+            if len(selected) < len(mask) // 8:
+                # sparse selections are cheaper to count column-wise
+                counts = np.count_nonzero(matrix[:, selected], axis=1)
+            else:
+                counts = np.count_nonzero(matrix & mask, axis=1)
+            return OrderedDict(zip(values, counts.tolist()))
+
+    def actions(self, facet, value):
+        return set(self.select(self.bitmap(facet, value)))
@@ -0,0 +1,125 @@
+import collections
+import threading
+
+
+def _grams(text, n):
+    return set(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class SearchIndex:
+    """
+    N-gram index over a list of options for case-insensitive substring
+    search.
+
+    Every whitespace separated token of a query must be contained in an
+    option. Tokens of at least `n` characters are looked up in the index
+    and verified, shorter tokens fall back to a scan of the candidates.
+    Fuzzy queries rank options by the number of n-grams they share with
+    the query instead.
+    """
+    def __init__(self, options, n=3):
+        self.options = list(options)
+        self.n = n
+        self._lower = [str(option).lower() for option in self.options]
+        self._postings = {}
+        for i, text in enumerate(self._lower):
+            for gram in _grams(text, n):
+                self._postings.setdefault(gram, []).append(i)
+
+    def __len__(self):
+        return len(self.options)
+
+    def _candidates(self, token):
+        grams = _grams(token, self.n)
+        postings = sorted(
+            (self._postings.get(gram, []) for gram in grams), key=len)
+        if not postings or not postings[0]:
+            return set()
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result.intersection_update(posting)
+            if not result:
+                break
+        return result
+
+    def search(self, query, limit=None, fuzzy=False):
+        """Search the options.
+
+        Parameters
+        ----------
+        query : str
+            Whitespace separated tokens.
+        limit : int
+            Maximum number of options returned.
+        fuzzy : bool
+            Rank options by shared n-grams instead of requiring every
+            token to be a substring.
+
+        Returns
+        -------
+        matches : list
+            Matching options in their original order, or by rank when fuzzy.
+        total : int
+            Total number of matches before applying the limit.
+        """
+        tokens = query.lower().split()
+        if not tokens:
+            matches = list(range(len(self.options)))
+        elif fuzzy:
+            matches = self._fuzzy(tokens)
+        else:
+            matches = self._match(tokens)
+        total = len(matches)
+        if limit is not None:
+            matches = matches[:limit]
+        return [self.options[i] for i in matches], total
+
+    def _match(self, tokens):
+        long_tokens = [t for t in tokens if len(t) >= self.n]
+        if long_tokens:
+            candidates = None
+            for token in long_tokens:
+                found = self._candidates(token)
+                candidates = found if candidates is None else candidates & found
+            candidates = sorted(candidates)
+        else:
+            candidates = range(len(self.options))
+        lower = self._lower
+        return [
+            i for i in candidates if all(t in lower[i] for t in tokens)]
+
+    def _fuzzy(self, tokens, min_share=0.5):
+        grams = set().union(*(_grams(token, self.n) for token in tokens))
+        if not grams:
+            return self._match(tokens)
+        scores = collections.Counter()
+        for gram in grams:
+            scores.update(self._postings.get(gram, ()))
+        threshold = max(1, int(min_share * len(grams)))
+        ranked = sorted(
+            (i for i, score in scores.items() if score >= threshold),
+            key=lambda i: (-scores[i], len(self._lower[i]), i))
+        return ranked
+
+
+class Debouncer:
+    """Call a function once no new calls have arrived for `delay` seconds."""
+    def __init__(self, func, delay=0.2):
+        self.func = func
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self.delay <= 0:
+                self._timer = None
+            else:
+                self._timer = threading.Timer(
+                    self.delay, self.func, args=args, kwargs=kwargs)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+        self.func(*args, **kwargs)